@@ -0,0 +1,102 @@
+"""Admission control for LLM work.
+
+At most ``max_concurrent`` callers hold a slot at once. Up to ``max_queue``
+more may wait for one, each for at most ``max_wait`` seconds. A caller that
+finds the queue full, or waits too long, is shed with ``Overloaded``
+before any work is done, and the app answers 503 with a ``Retry-After``
+estimated from recent slot hold times. Bounding the wait keeps tail
+latency flat under overload instead of letting requests pile up behind the
+model.
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from metrics import llm_shed
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"LLM admission shed request ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    def __init__(self, max_concurrent=16, max_queue=64, max_wait=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_seconds = 1.0
+        self._cond = threading.Condition()
+
+    def acquire(self, shed=True):
+        """Take a slot, raising Overloaded when shedding; ``shed=False`` waits as long as needed."""
+        with self._cond:
+            if self.in_flight < self.max_concurrent and not self.waiting:
+                self.in_flight += 1
+                return
+            if shed and self.waiting >= self.max_queue:
+                self._shed("queue_full")
+            deadline = time.monotonic() + self.max_wait if shed else None
+            self.waiting += 1
+            try:
+                while self.in_flight >= self.max_concurrent:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._shed("timeout")
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, held_seconds=None):
+        with self._cond:
+            self.in_flight -= 1
+            if held_seconds is not None:
+                self._hold_seconds = 0.9 * self._hold_seconds + 0.1 * held_seconds
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, shed=True):
+        self.acquire(shed)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def check(self):
+        """Shed now if the wait queue is full, without taking a slot."""
+        with self._cond:
+            if self.waiting >= self.max_queue:
+                self._shed("queue_full")
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+        }
+
+    def _shed(self, reason):
+        # Time for the queue ahead to drain through the available slots
+        retry_after = max(1, math.ceil(self._hold_seconds * (self.waiting + 1) / self.max_concurrent))
+        llm_shed.inc(reason=reason)
+        raise Overloaded(reason, retry_after)
+
+
+def admission_from_env():
+    return Admission(
+        max_concurrent=int(os.environ.get("LLM_ADMISSION_MAX_CONCURRENT", os.environ.get("LLM_MAX_CONCURRENCY", 16))),
+        max_queue=int(os.environ.get("LLM_ADMISSION_MAX_QUEUE", 64)),
+        max_wait=float(os.environ.get("LLM_ADMISSION_MAX_WAIT", 10)),
+    )
+
+
+llm_admission = admission_from_env()
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from cache import LRUCache
+
+
+def normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+def question_hash(question):
+    """sha256 of the normalized question; identifies a stored Query per user."""
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()
+
+
+def answer_cache_key(question, docs, model, prompt_version):
+    """Hash of everything that determines an answer: question, ordered docs, model and prompt.
+
+    ``docs`` are ``{"id", "text"}`` dicts. Their text is part of the key, so
+    editing a document stops its old answers from being served.
+    """
+    doc_keys = [[doc["id"], hashlib.sha256(doc["text"].encode("utf-8")).hexdigest()] for doc in docs]
+    payload = json.dumps([normalize_question(question), doc_keys, model, prompt_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """Two-tier cache of LLM answers.
+
+    Lookups check a per-process LRU (with ``ttl`` seconds expiry) first and
+    then the ``answer_cache`` table, which is shared by all processes and
+    survives restarts; database hits are promoted into memory. Entries carry
+    the estimated cost of the call they replace so ``stats`` can report the
+    spend saved.
+
+    At most every ``prune_interval`` seconds a write also deletes rows that
+    can no longer be hit: older than ``db_ttl``, or written for another
+    model or prompt version (both are part of every key).
+    """
+
+    def __init__(self, maxsize=4096, ttl=3600, persistent=True, db_ttl=None, prune_interval=300):
+        self.memory = LRUCache(maxsize, ttl=ttl)
+        self.persistent = persistent
+        self.db_ttl = db_ttl
+        self.prune_interval = prune_interval
+        self._next_prune = 0.0
+        self.db_hits = 0
+        self.misses = 0
+        self.cost_saved = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is None and self.persistent:
+            entry = self._fetch(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+                with self._lock:
+                    self.db_hits += 1
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        answer, cost = entry
+        with self._lock:
+            self.cost_saved += cost
+        return answer
+
+    def set(self, key, answer, model, prompt_version, cost=0.0):
+        self.memory.set(key, (answer, cost))
+        if self.persistent:
+            self._store(key, answer, model, prompt_version, cost)
+
+    def stats(self):
+        hits = self.memory.hits + self.db_hits
+        lookups = hits + self.misses
+        return {
+            "memory": self.memory.stats(),
+            "hits": hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "cost_saved_usd": round(self.cost_saved, 6),
+        }
+
+    def _fetch(self, key):
+        from database import SessionLocal
+        from models import CachedAnswer
+
+        db = SessionLocal()
+        try:
+            query = db.query(CachedAnswer.answer_json, CachedAnswer.cost).filter(CachedAnswer.key == key)
+            if self.db_ttl:
+                query = query.filter(CachedAnswer.created_at >= datetime.utcnow() - timedelta(seconds=self.db_ttl))
+            row = query.first()
+        except Exception as e:
+            print(f"[CACHE DEBUG] Answer cache lookup failed: {e}")
+            return None
+        finally:
+            db.close()
+        return (json.loads(row.answer_json), row.cost) if row else None
+
+    def _store(self, key, answer, model, prompt_version, cost):
+        from database import SessionLocal
+        from models import CachedAnswer
+
+        db = SessionLocal()
+        try:
+            # merge() overwrites, so a forced refresh replaces the stale answer
+            db.merge(CachedAnswer(
+                key=key,
+                answer_json=json.dumps(answer),
+                model=model,
+                prompt_version=prompt_version,
+                cost=cost,
+                created_at=datetime.utcnow(),
+            ))
+            if time.monotonic() >= self._next_prune:
+                self._next_prune = time.monotonic() + self.prune_interval
+                self._prune(db, model, prompt_version)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[CACHE DEBUG] Answer cache write failed: {e}")
+        finally:
+            db.close()
+
+    def _prune(self, db, model, prompt_version):
+        from sqlalchemy import or_
+        from models import CachedAnswer
+
+        stale = [CachedAnswer.model != model, CachedAnswer.prompt_version != prompt_version]
+        if self.db_ttl:
+            stale.append(CachedAnswer.created_at < datetime.utcnow() - timedelta(seconds=self.db_ttl))
+        pruned = db.query(CachedAnswer).filter(or_(*stale)).delete(synchronize_session=False)
+        if pruned:
+            print(f"[CACHE DEBUG] Pruned {pruned} stale answer cache rows")
@@ -0,0 +1,71 @@
+import json
+
+ANSWER_FIELDS = ("summary", "facts")
+
+
+def _decode_string(raw):
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except json.JSONDecodeError:
+        return None
+
+
+class AnswerStreamParser:
+    """Incremental parser for the ``{"summary": [...], "facts": [...]}`` answer format.
+
+    ``feed`` takes the next chunk of model output and returns the
+    ``(field, item)`` pairs whose string items were completed by it, so
+    items can be forwarded while the rest of the JSON is still being
+    generated. Anything before the opening brace is ignored, as in
+    llm.parse_answer; the final answer should still come from parsing the
+    whole output.
+    """
+
+    def __init__(self, fields=ANSWER_FIELDS):
+        self.fields = fields
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._buf = []
+        self._expect_key = False
+        self._key = None
+
+    def feed(self, text):
+        items = []
+        for ch in text:
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    self._buf.append(ch)
+                elif ch == "\\":
+                    self._escape = True
+                    self._buf.append(ch)
+                elif ch == '"':
+                    self._in_string = False
+                    self._end_string(items)
+                else:
+                    self._buf.append(ch)
+            elif ch == '"':
+                if self._stack:
+                    self._in_string = True
+                    self._buf = []
+            elif ch in "{[":
+                self._stack.append(ch)
+                self._expect_key = ch == "{"
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                self._expect_key = False
+            elif ch == ":":
+                self._expect_key = False
+            elif ch == ",":
+                self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+        return items
+
+    def _end_string(self, items):
+        if self._stack == ["{"] and self._expect_key:
+            self._key = _decode_string("".join(self._buf))
+        elif self._stack == ["{", "["] and self._key in self.fields:
+            value = _decode_string("".join(self._buf))
+            if value is not None:
+                items.append((self._key, value))
@@ -1,29 +1,169 @@
+import math
 import os
-from flask import Flask, jsonify
+import re
+import time
+import uuid
+from flask import Flask, g, jsonify, request
 from flask_cors import CORS
-from database import SessionLocal
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from database import get_db, init_app as init_db, pool_stats
 
 # Import blueprints
 from routes.query import query_bp
 from routes.history import history_bp
 from routes.feedback import feedback_bp
+from routes.documents import documents_bp
+from routes.jobs import jobs_bp
+from llm import answer_cache
+from routes.query import query_flight
+from jobs import job_queue
+from admission import Overloaded, llm_admission
+from ratelimit import rate_limiter_from_env
+from startup import readiness, start_snapshot_watcher, start_warmup
+import metrics
 
 app = Flask(__name__)
-CORS(app)
+# Behind this many reverse proxies, take the client address from X-Forwarded-For
+TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+if TRUSTED_PROXIES:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES)
+# Expose the /history pagination cursor and tracing headers to browser clients
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Trace-Id', 'Server-Timing'])
+
+TRACE_IDS = os.environ.get("TRACE_IDS", "true").lower() == "true"
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+rate_limiter = rate_limiter_from_env()
+
+# Request-scoped sessions, closed (and rolled back on error) at teardown
+init_db(app)
 
 app.register_blueprint(query_bp)
 app.register_blueprint(history_bp)
 app.register_blueprint(feedback_bp)
+app.register_blueprint(documents_bp)
+app.register_blueprint(jobs_bp)
+
+# Create the schema, load the index and open connections once per process,
+# off the import path
+start_warmup()
+# Follow index snapshots rewritten by other worker processes
+start_snapshot_watcher()
+# Run jobs queued before this process started, not only after its first submit
+job_queue.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if TRACE_IDS:
+        # Propagate the caller's trace id when it sends a well-formed one
+        incoming = request.headers.get('X-Trace-Id', '')
+        g.trace_id = incoming if TRACE_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+
+@app.before_request
+def enforce_rate_limit():
+    if rate_limiter is None or request.url_rule is None:
+        return None
+    endpoint = request.url_rule.rule
+    if endpoint not in rate_limiter.rules:
+        return None
+    # Clients choose their user id freely, so the bucket that always applies
+    # is the client address's; a user id only adds a second, stricter one.
+    # Never read the body here: it may be a large upload the view streams
+    allowed, retry_after = rate_limiter.check(endpoint, f"addr:{request.remote_addr}")
+    user_id = request.headers.get('X-User-Id') or request.args.get('user_id')
+    if allowed and user_id:
+        allowed, retry_after = rate_limiter.check(endpoint, f"user:{user_id}")
+    if allowed:
+        return None
+    metrics.rate_limited.inc(endpoint=endpoint)
+    return jsonify({"error": "Too many requests", "code": 429}), 429, {"Retry-After": str(max(1, math.ceil(retry_after)))}
+
+@app.after_request
+def record_request_metrics(response):
+    # For streamed responses this is the time to the first byte
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.request_seconds.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+    if TRACE_IDS and 'trace_id' in g:
+        response.headers['X-Trace-Id'] = g.trace_id
+        server_timing = metrics.server_timing_header()
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing
+    return response
+
+def _cache_lookups():
+    from vector_search_demo import retrieval_cache_stats
+
+    samples = {}
+    caches = {**retrieval_cache_stats(), "answers": answer_cache.stats()}
+    for name, stats in caches.items():
+        samples[(("cache", name), ("result", "hit"))] = stats["hits"]
+        samples[(("cache", name), ("result", "miss"))] = stats["misses"]
+    return samples
+
+metrics.Collector("genai_cache_lookups_total", "Cache lookups by cache and result", "counter", _cache_lookups)
+metrics.Collector(
+    "genai_answer_cache_cost_saved_usd_total", "Estimated LLM spend avoided by the answer cache", "counter",
+    lambda: {(): answer_cache.stats()["cost_saved_usd"]}
+)
+metrics.Collector(
+    "genai_db_pool_connections", "Database pool connections by state", "gauge",
+    lambda: {(("state", name),): value for name, value in pool_stats().items() if name != "pool"}
+)
+metrics.Collector(
+    "genai_singleflight_calls_total", "/query calls that ran retrieval and the LLM (leaders) or waited for another call's result", "counter",
+    lambda: {(("outcome", role),): value for role, value in (query_flight.stats() if query_flight else {}).items()}
+)
+metrics.Collector(
+    "genai_jobs", "Background jobs by state (queued is per process for the memory backend)", "gauge",
+    lambda: {(("state", name),): value for name, value in job_queue.stats().items() if name in ("queued", "running") and value is not None}
+)
+metrics.Collector(
+    "genai_jobs_finished_total", "Background jobs finished by this process", "counter",
+    lambda: {(("status", "succeeded"),): job_queue.completed, (("status", "failed"),): job_queue.failed}
+)
+metrics.Collector(
+    "genai_llm_admission", "LLM admission slots in use and requests waiting for one", "gauge",
+    lambda: {(("state", "in_flight"),): llm_admission.in_flight, (("state", "waiting"),): llm_admission.waiting}
+)
+def _index_vectors():
+    from vector_search_demo import index_manager
+
+    # Shards still loading are left out rather than built by the scrape
+    return {(("shard", name),): vectors for name, vectors in index_manager.stats(loaded_only=True).items()}
+
+metrics.Collector("genai_index_vectors", "Live vectors in each document index shard", "gauge", _index_vectors)
+metrics.Collector(
+    "genai_ready", "1 once warmup has finished and /ready reports ready", "gauge",
+    lambda: {(): int(readiness.ready)}
+)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
-        db = SessionLocal()
-        db.execute("SELECT 1")
-        db.close()
-        return jsonify({"status": "healthy", "database": "connected"}), 200
+        get_db().execute(text("SELECT 1"))
+        return jsonify({"status": "healthy", "database": "connected", "pool": pool_stats()}), 200
     except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+        return jsonify({"status": "unhealthy", "error": str(e), "pool": pool_stats()}), 500
+
+@app.route('/ready', methods=['GET'])
+def ready_check():
+    # Readiness, unlike /health (liveness), waits for the index and pool warmup
+    state = readiness.snapshot()
+    return jsonify(state), 200 if state["ready"] else 503
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    from vector_search_demo import retrieval_cache_stats
+
+    return jsonify({**retrieval_cache_stats(), "answers": answer_cache.stats()})
 
 @app.errorhandler(404)
 def handle_404(e):
@@ -33,6 +173,17 @@ def handle_404(e):
 def handle_429(e):
     return jsonify({"error": "Too many requests", "code": 429}), 429
 
+@app.errorhandler(PoolTimeoutError)
+def handle_pool_timeout(e):
+    # Every pooled connection stayed busy for DB_POOL_TIMEOUT seconds
+    print(f"[DB DEBUG] Connection pool exhausted: {pool_stats()}")
+    return jsonify({"error": "Database busy, try again", "code": 503}), 503, {"Retry-After": "1"}
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    # Shed before any work was done; the client should back off and retry
+    return jsonify({"error": "Server busy, try again", "code": 503}), 503, {"Retry-After": str(e.retry_after)}
+
 @app.errorhandler(500)
 def handle_500(e):
     return jsonify({"error": "Internal server error", "code": 500}), 500
@@ -0,0 +1,406 @@
+"""Tiered storage for old responses.
+
+``archive_responses`` moves the responses of queries that got no new
+response since a cutoff out of the hot tables and into
+``response_archive_chunks``: compressed NDJSON, one chunk per month and
+batch of queries. Each record carries the response's document references
+and feedback, and ``archived_responses`` maps the response id to its chunk.
+Queries are archived whole, so a regeneration chain never spans both tiers.
+``rehydrate`` moves queries back, e.g. when an archived response is
+revalidated. Reads such as ``GET /responses/<id>/history`` go to the
+chunks directly and leave the rows archived.
+
+Chunks are compressed with zstd when the optional ``zstandard`` package is
+installed and with gzip otherwise. Each chunk records its codec, so a
+database can mix both. Run from cron, or queue with ``POST /history/archive``:
+
+    python archive.py --older-than-days 180 [--batch-size 500] [--dump DIR]
+
+``--dump`` also writes every chunk to ``DIR/<YYYY-MM>/<chunk id>.ndjson.zst``
+(or ``.gz``), e.g. for copying to object storage.
+"""
+import argparse
+import gzip
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import and_, exists, func, insert, select
+from sqlalchemy.orm import aliased
+from database import SessionLocal
+from jobs import handler
+from models import ArchivedResponse, Feedback, Query, Response, ResponseArchiveChunk, ResponseDocument
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Queries moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 500))
+ARCHIVE_CODEC = os.environ.get("ARCHIVE_CODEC") or ("zstd" if zstandard else "gzip")
+ARCHIVE_ZSTD_LEVEL = int(os.environ.get("ARCHIVE_ZSTD_LEVEL", 10))
+CODEC_EXTENSIONS = {"zstd": "zst", "gzip": "gz"}
+
+
+def compress(data, codec=ARCHIVE_CODEC):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The zstd archive codec needs the zstandard package")
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    if codec == "gzip":
+        return gzip.compress(data, mtime=0)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Reading zstd archive chunks needs the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"Unknown archive codec {codec!r}")
+
+
+def iter_records(chunk):
+    """Archived response records of ``chunk``, oldest first."""
+    for line in decompress(chunk.data, chunk.codec).splitlines():
+        if line:
+            yield json.loads(line)
+
+
+def _fill_chunk(chunk, records, codec):
+    records.sort(key=lambda record: (record["created_at"], record["id"]))
+    chunk.codec = codec
+    chunk.count = len(records)
+    chunk.min_created_at = datetime.fromisoformat(records[0]["created_at"])
+    chunk.max_created_at = datetime.fromisoformat(records[-1]["created_at"])
+    chunk.data = compress(b"".join(json.dumps(record).encode("utf-8") + b"\n" for record in records), codec)
+    return chunk
+
+
+def _archivable(query_ids, cutoff):
+    """Responses of ``query_ids`` older than ``cutoff`` whose query has no newer response."""
+    newer = aliased(Response)
+    return and_(
+        Response.query_id.in_(query_ids),
+        Response.created_at < cutoff,
+        ~exists().where(newer.query_id == Response.query_id, newer.created_at >= cutoff),
+    )
+
+
+def _archive_batch(db, query_ids, cutoff, codec):
+    """Move the responses of ``query_ids`` older than ``cutoff`` into new chunks.
+
+    The deletes repeat the selection's predicate, so a regeneration written
+    after the rows were read keeps its query's rows in place. Returns
+    ``(responses, chunks)`` moved and written, or None when that happened
+    and the caller must roll back; otherwise the caller commits.
+    """
+    predicate = _archivable(query_ids, cutoff)
+    rows = (
+        db.query(
+            Response.id,
+            Response.query_id,
+            Response.answer_json,
+            Response.docs_json,
+            Response.parent_response_id,
+            Response.created_at,
+            Query.user_id,
+            Query.query,
+        )
+        .join(Query, Response.query_id == Query.id)
+        .filter(predicate)
+        .all()
+    )
+    if not rows:
+        return 0, 0
+    response_ids = [row.id for row in rows]
+    documents = {}
+    for ref in (
+        db.query(ResponseDocument.response_id, ResponseDocument.rank, ResponseDocument.doc_id, ResponseDocument.score)
+        .filter(ResponseDocument.response_id.in_(response_ids))
+        .order_by(ResponseDocument.response_id, ResponseDocument.rank)
+    ):
+        documents.setdefault(ref.response_id, []).append({"rank": ref.rank, "doc_id": ref.doc_id, "score": ref.score})
+    feedback = {}
+    for row in db.query(Feedback).filter(Feedback.response_id.in_(response_ids)):
+        feedback.setdefault(row.response_id, []).append({
+            "id": row.id,
+            "user_id": row.user_id,
+            "rating": row.rating,
+            "comment": row.comment,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        })
+
+    partitions = {}
+    for row in rows:
+        partitions.setdefault(row.created_at.strftime("%Y-%m"), []).append({
+            "id": row.id,
+            "query_id": row.query_id,
+            "user_id": row.user_id,
+            "query": row.query,
+            "answer_json": row.answer_json,
+            "docs_json": row.docs_json,
+            "documents": documents.get(row.id, []),
+            "parent_response_id": row.parent_response_id,
+            "created_at": row.created_at.isoformat(),
+            "feedback": feedback.get(row.id, []),
+        })
+    locations = []
+    for partition, records in partitions.items():
+        chunk = _fill_chunk(ResponseArchiveChunk(id=str(uuid.uuid4()), partition=partition), records, codec)
+        db.add(chunk)
+        locations.extend(
+            {"response_id": record["id"], "query_id": record["query_id"], "chunk_id": chunk.id}
+            for record in records
+        )
+    db.flush()
+    db.execute(insert(ArchivedResponse), locations)
+    still_archivable = select(Response.id).where(Response.id.in_(response_ids), predicate)
+    db.query(Feedback).filter(Feedback.response_id.in_(still_archivable)).delete(synchronize_session=False)
+    db.query(ResponseDocument).filter(
+        ResponseDocument.response_id.in_(still_archivable)
+    ).delete(synchronize_session=False)
+    # One statement, so parent links within the batch are checked once all rows are gone
+    deleted = db.query(Response).filter(Response.id.in_(response_ids), predicate).delete(synchronize_session=False)
+    if deleted != len(rows):
+        return None
+    return len(rows), len(partitions)
+
+
+def archive_responses(cutoff, batch_size=ARCHIVE_BATCH_SIZE, codec=ARCHIVE_CODEC):
+    """Archive every query whose newest response is older than ``cutoff``.
+
+    Queries are walked in id order, ``batch_size`` per transaction, so an
+    interrupted run keeps what it committed and a re-run picks up the rest.
+    Returns counts of queries, responses and chunks written.
+    """
+    counts = {"queries": 0, "responses": 0, "chunks": 0}
+    last_query_id = ""
+    db = SessionLocal()
+    try:
+        while True:
+            query_ids = [
+                query_id for (query_id,) in
+                db.query(Response.query_id)
+                .filter(Response.query_id > last_query_id)
+                .group_by(Response.query_id)
+                .having(func.max(Response.created_at) < cutoff)
+                .order_by(Response.query_id)
+                .limit(batch_size)
+            ]
+            if not query_ids:
+                break
+            moved = _archive_batch(db, query_ids, cutoff, codec)
+            if moved is None:
+                # A regeneration landed mid-batch; the retry no longer selects its query
+                db.rollback()
+                print("[ARCHIVE DEBUG] Batch raced a new response; retrying")
+                continue
+            last_query_id = query_ids[-1]
+            responses, chunks = moved
+            counts["responses"] += responses
+            counts["chunks"] += chunks
+            counts["queries"] += len(query_ids)
+            db.commit()
+            db.expunge_all()
+            print(f"[ARCHIVE DEBUG] {counts} (through query {last_query_id})")
+    finally:
+        db.close()
+    return counts
+
+
+def rehydrate(db, query_ids=(), response_ids=()):
+    """Move archived queries back to the hot tables and commit.
+
+    Restores every archived response of ``query_ids`` and of the queries of
+    ``response_ids``. The chunks they came from are rewritten without them,
+    or deleted once empty. Returns the number of responses restored.
+    """
+    query_ids = set(query_ids)
+    if response_ids:
+        query_ids.update(
+            query_id for (query_id,) in
+            db.query(ArchivedResponse.query_id).filter(ArchivedResponse.response_id.in_(list(response_ids)))
+        )
+    if not query_ids:
+        return 0
+    chunk_ids = [
+        chunk_id for (chunk_id,) in
+        db.query(ArchivedResponse.chunk_id).filter(ArchivedResponse.query_id.in_(query_ids)).distinct()
+    ]
+    if not chunk_ids:
+        return 0
+    # Row locks keep a concurrent rehydrate from rewriting the same chunks
+    chunks = (
+        db.query(ResponseArchiveChunk)
+        .filter(ResponseArchiveChunk.id.in_(chunk_ids))
+        .with_for_update()
+        .all()
+    )
+    restored = []
+    emptied = []
+    for chunk in chunks:
+        kept = []
+        for record in iter_records(chunk):
+            (restored if record["query_id"] in query_ids else kept).append(record)
+        if kept:
+            _fill_chunk(chunk, kept, chunk.codec)
+        else:
+            emptied.append(chunk.id)
+    if not restored:
+        db.rollback()
+        return 0
+
+    # Parents are older than their regenerations, so they are inserted first
+    restored.sort(key=lambda record: (record["created_at"], record["id"]))
+    db.execute(insert(Response), [
+        {
+            "id": record["id"],
+            "query_id": record["query_id"],
+            "answer_json": record["answer_json"],
+            "docs_json": record["docs_json"],
+            "parent_response_id": record["parent_response_id"],
+            "created_at": datetime.fromisoformat(record["created_at"]),
+        }
+        for record in restored
+    ])
+    documents = [
+        {"response_id": record["id"], **ref} for record in restored for ref in record["documents"]
+    ]
+    if documents:
+        db.execute(insert(ResponseDocument), documents)
+    feedback = [
+        {
+            **row,
+            "query_id": record["query_id"],
+            "response_id": record["id"],
+            "created_at": datetime.fromisoformat(row["created_at"]) if row["created_at"] else None,
+        }
+        for record in restored for row in record["feedback"]
+    ]
+    if feedback:
+        db.execute(insert(Feedback), feedback)
+    db.query(ArchivedResponse).filter(
+        ArchivedResponse.response_id.in_([record["id"] for record in restored])
+    ).delete(synchronize_session=False)
+    if emptied:
+        db.query(ResponseArchiveChunk).filter(ResponseArchiveChunk.id.in_(emptied)).delete(synchronize_session=False)
+    db.commit()
+    print(f"[ARCHIVE DEBUG] Rehydrated {len(restored)} responses of {len(query_ids)} queries")
+    return len(restored)
+
+
+def is_archived(db, response_id):
+    return db.query(ArchivedResponse.response_id).filter(ArchivedResponse.response_id == response_id).first() is not None
+
+
+def iter_archived(db, since=None, until=None):
+    """Archived records created in ``[since, until)``, one chunk in memory at a time.
+
+    Chunks are read in order of their oldest response, so records are only
+    sorted within each chunk. Each record gains a ``docs`` list hydrated
+    like ``load_response_docs``.
+    """
+    chunks = db.query(ResponseArchiveChunk.id).order_by(
+        ResponseArchiveChunk.min_created_at, ResponseArchiveChunk.id
+    )
+    if since is not None:
+        chunks = chunks.filter(ResponseArchiveChunk.max_created_at >= since)
+    if until is not None:
+        chunks = chunks.filter(ResponseArchiveChunk.min_created_at < until)
+    for (chunk_id,) in chunks.all():
+        chunk = db.get(ResponseArchiveChunk, chunk_id)
+        if chunk is None:
+            # Rehydrated away since the listing
+            continue
+        records = []
+        for record in iter_records(chunk):
+            created_at = datetime.fromisoformat(record["created_at"])
+            if (since is None or created_at >= since) and (until is None or created_at < until):
+                records.append(record)
+        db.expunge(chunk)
+        yield from _with_docs(records)
+
+
+def archived_regenerations(db, response_id):
+    """Archived regenerations of ``response_id``, oldest first, read in place.
+
+    Only the chunks holding its query are decompressed and nothing is
+    rehydrated, so reading stays a read. Records gain ``docs`` as in
+    ``iter_archived``.
+    """
+    location = db.query(ArchivedResponse.query_id).filter(ArchivedResponse.response_id == response_id).first()
+    if location is None:
+        return []
+    chunk_ids = [
+        chunk_id for (chunk_id,) in
+        db.query(ArchivedResponse.chunk_id).filter(ArchivedResponse.query_id == location.query_id).distinct()
+    ]
+    records = [
+        record
+        for chunk in db.query(ResponseArchiveChunk).filter(ResponseArchiveChunk.id.in_(chunk_ids))
+        for record in iter_records(chunk)
+        if record["parent_response_id"] == response_id
+    ]
+    records.sort(key=lambda record: (record["created_at"], record["id"]))
+    return list(_with_docs(records))
+
+
+def _with_docs(records):
+    """Add a ``docs`` list to each record, hydrated like ``load_response_docs``."""
+    from response_docs import hydrate_refs
+
+    refs = [
+        SimpleNamespace(response_id=record["id"], **ref)
+        for record in records if record["docs_json"] is None for ref in record["documents"]
+    ]
+    docs = hydrate_refs(refs)
+    for record in records:
+        if record["docs_json"] is not None:
+            record["docs"] = json.loads(record["docs_json"])
+        else:
+            record["docs"] = docs.get(record["id"], [])
+        yield record
+
+
+def dump_chunks(directory):
+    """Write every archive chunk to ``directory/<YYYY-MM>/<chunk id>.ndjson.<ext>``. Returns the file count."""
+    written = 0
+    db = SessionLocal()
+    try:
+        for (chunk_id,) in db.query(ResponseArchiveChunk.id).order_by(ResponseArchiveChunk.min_created_at).all():
+            chunk = db.get(ResponseArchiveChunk, chunk_id)
+            path = os.path.join(directory, chunk.partition, f"{chunk.id}.ndjson.{CODEC_EXTENSIONS[chunk.codec]}")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(chunk.data)
+            db.expunge(chunk)
+            written += 1
+    finally:
+        db.close()
+    return written
+
+
+@handler("archive")
+def _archive_job(payload):
+    return archive_responses(
+        datetime.fromisoformat(payload["before"]),
+        batch_size=payload.get("batch_size", ARCHIVE_BATCH_SIZE),
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--older-than-days", type=float, required=True)
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--dump", metavar="DIR", help="Also write every chunk to files under DIR")
+    args = parser.parse_args()
+
+    counts = archive_responses(datetime.utcnow() - timedelta(days=args.older_than_days), args.batch_size)
+    print(f"Archived {counts['responses']} responses of {counts['queries']} queries into {counts['chunks']} {ARCHIVE_CODEC} chunks")
+    if args.dump:
+        print(f"Wrote {dump_chunks(args.dump)} chunk files to {args.dump}")
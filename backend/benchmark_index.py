@@ -0,0 +1,117 @@
+"""Recall / latency / memory benchmark for the index types in index_factory.
+
+Builds every index type over synthetic clustered corpora and reports, for
+each operating point, recall@k against the exact flat index, single-query
+p50/p99 latency and serialized bytes per vector:
+
+    python benchmark_index.py --sizes 10000 100000 1000000 --dim 64 \
+        --nprobe 4 16 64 --ef-search 32 128 --json ann_results.json
+"""
+import argparse
+import json
+import time
+import numpy as np
+import faiss
+from index_factory import DEFAULT_INDEX_PARAMS, INDEX_TYPES, IVF_INDEX_TYPES, create_index, set_search_params
+
+
+def synthetic_corpus(n, dim, n_clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 1, (n_clusters, dim))
+    assignments = rng.integers(0, n_clusters, n)
+    return (centers[assignments] + rng.normal(0, 0.3, (n, dim))).astype("float32")
+
+
+def recall_at_k(found, truth, k):
+    hits = sum(len(set(f[:k]) & set(t[:k])) for f, t in zip(found, truth))
+    return hits / (k * len(truth))
+
+
+def latency_ms(index, queries, k):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query[None, :], k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 99))
+
+
+def bytes_per_vector(index):
+    return len(faiss.serialize_index(index)) / max(index.ntotal, 1)
+
+
+def operating_points(index_type, args):
+    if index_type in IVF_INDEX_TYPES:
+        return [{"nprobe": nprobe} for nprobe in args.nprobe]
+    if index_type == "hnsw":
+        return [{"ef_search": ef} for ef in args.ef_search]
+    return [{}]
+
+
+def run(args):
+    results = []
+    for n in args.sizes:
+        corpus = synthetic_corpus(n, args.dim, seed=args.seed)
+        queries = synthetic_corpus(args.queries, args.dim, seed=args.seed + 1)
+        flat = faiss.IndexFlatL2(args.dim)
+        flat.add(corpus)
+        _, truth = flat.search(queries, args.k)
+        for index_type in args.types:
+            params = dict(
+                DEFAULT_INDEX_PARAMS,
+                index_type=index_type,
+                nlist=args.nlist,
+                hnsw_m=args.hnsw_m,
+                pq_m=args.pq_m,
+                pq_nbits=args.pq_nbits,
+            )
+            start = time.perf_counter()
+            index = create_index(args.dim, corpus, **params)
+            index.add_with_ids(corpus, np.arange(n, dtype="int64"))
+            build_s = time.perf_counter() - start
+            memory = bytes_per_vector(index)
+            for point in operating_points(index_type, args):
+                set_search_params(index, **point)
+                _, found = index.search(queries, args.k)
+                p50, p99 = latency_ms(index, queries, args.k)
+                row = {
+                    "n": n,
+                    "dim": args.dim,
+                    "index_type": index_type,
+                    **point,
+                    f"recall@{args.k}": round(recall_at_k(found, truth, args.k), 4),
+                    "p50_ms": round(p50, 4),
+                    "p99_ms": round(p99, 4),
+                    "bytes_per_vector": round(memory, 1),
+                    "build_s": round(build_s, 2),
+                }
+                results.append(row)
+                print(
+                    f"n={n:>8} {index_type:<9} {json.dumps(point):<18} "
+                    f"recall@{args.k}={row[f'recall@{args.k}']:.3f} p50={p50:.3f}ms p99={p99:.3f}ms "
+                    f"{memory:.1f} B/vec build={build_s:.1f}s"
+                )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--dim", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument("--nlist", type=int, default=DEFAULT_INDEX_PARAMS["nlist"])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--hnsw-m", type=int, default=DEFAULT_INDEX_PARAMS["hnsw_m"])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--pq-m", type=int, default=DEFAULT_INDEX_PARAMS["pq_m"])
+    parser.add_argument("--pq-nbits", type=int, default=DEFAULT_INDEX_PARAMS["pq_nbits"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
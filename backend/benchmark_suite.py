@@ -0,0 +1,288 @@
+"""Reproducible performance benchmarks for retrieval, the LLM path and the HTTP API.
+
+Two suites, both with fixed seeds:
+
+* ``micro``: get_mock_embedding, get_faiss_index, embedding + index build on
+  synthetic corpora of increasing size, and retrieve_top_k_faiss over them
+  (cold, i.e. unique queries, and warm, i.e. repeated queries).
+* ``http``: /query, /revalidate, /history and /feedback/aggregate end to
+  end through the Flask test client against a fresh SQLite database, once
+  with the mock LLM answers and once against the local stub LLM server
+  with injected latency. Each LLM mode runs in its own subprocess because
+  the LLM client is configured at import time.
+
+Results are printed and, with ``--json``, written with run metadata so runs
+can be compared across commits:
+
+    python benchmark_suite.py --json bench_head.json
+    python benchmark_suite.py --json bench_new.json --compare bench_head.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+WORDS = (
+    "tesla battery supply chain cybertruck regulatory openai nvidia chips google microsoft "
+    "adobe ai cloud revenue quarter growth launch satellites drone delivery translation "
+    "antitrust lawsuit advertising semiconductor shortage production investors market"
+).split()
+
+
+def synthetic_texts(n, seed=0, words_per_text=40):
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(WORDS), (n, words_per_text))
+    return [" ".join(WORDS[i] for i in row) for row in picks]
+
+
+def summarize(name, timings_s, **params):
+    timings_ms = np.asarray(timings_s) * 1000
+    mean = float(timings_ms.mean())
+    return {
+        "name": name,
+        **params,
+        "runs": len(timings_ms),
+        "mean_ms": round(mean, 4),
+        "p50_ms": round(float(np.percentile(timings_ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(timings_ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(timings_ms, 99)), 4),
+        "ops_per_s": round(1000 / mean, 2) if mean else None,
+    }
+
+
+def measure(fn, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def print_row(row):
+    params = {k: v for k, v in row.items() if k not in ("name", "runs", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "ops_per_s")}
+    print(
+        f"{row['name']:<28} {json.dumps(params):<36} "
+        f"p50={row['p50_ms']:.3f}ms p95={row['p95_ms']:.3f}ms p99={row['p99_ms']:.3f}ms "
+        f"({row['ops_per_s']} ops/s, {row['runs']} runs)"
+    )
+
+
+def run_micro(args):
+    import vector_search_demo as vsd
+    from document_store import DocumentStore
+    from sharded_index import ShardedIndex, shard_of
+
+    rows = []
+    queries = synthetic_texts(args.queries, seed=args.seed + 1, words_per_text=8)
+
+    rows.append(summarize("get_mock_embedding", measure(
+        vsd.get_mock_embedding, [(text,) for text in queries]
+    )))
+    rows.append(summarize("get_faiss_index", measure(vsd.get_faiss_index, [()] * args.repeat)))
+    for row in rows:
+        print_row(row)
+
+    originals = (vsd.index_manager, vsd.document_store)
+    try:
+        for n in args.sizes:
+            texts = synthetic_texts(n, seed=args.seed)
+            corpus = [{"id": f"bench_{i}", "text": text} for i, text in enumerate(texts)]
+
+            start = time.perf_counter()
+            vectors = vsd.embed_batch(texts, dim=8)
+            embed_s = time.perf_counter() - start
+            rows.append(summarize("embed_batch", [embed_s / n], n=n, per="doc"))
+
+            def load_shard(collection, shard, n_shards, corpus=corpus, vectors=vectors):
+                rows = [i for i, doc in enumerate(corpus) if shard_of(doc["id"], n_shards) == shard]
+                return [corpus[i]["id"] for i in rows], vectors[rows]
+
+            # Older baselines have no shards parameter; keep their row keys
+            sharding = {"shards": args.shards} if args.shards > 1 else {}
+            manager = ShardedIndex(load_shard, shards_per_collection=args.shards, dim=8)
+            start = time.perf_counter()
+            manager.warm()
+            rows.append(summarize("index_build", [time.perf_counter() - start], n=n, **sharding))
+
+            vsd.index_manager = manager
+            vsd.document_store = DocumentStore(corpus, cache_size=0)
+            vsd.query_embedding_cache.clear()
+            vsd.search_result_cache.clear()
+            rows.append(summarize("retrieve_top_k_faiss", measure(
+                vsd.retrieve_top_k_faiss, [(query,) for query in queries]
+            ), n=n, cache="cold", **sharding))
+            rows.append(summarize("retrieve_top_k_faiss", measure(
+                vsd.retrieve_top_k_faiss, [(query,) for query in queries]
+            ), n=n, cache="warm", **sharding))
+            for row in rows[-4:]:
+                print_row(row)
+    finally:
+        vsd.index_manager, vsd.document_store = originals
+    return rows
+
+
+def run_http_worker(args):
+    """Body of one ``http`` subprocess; environment is already set by run_http."""
+    import uuid
+    from app import app
+    from database import SessionLocal
+    from models import Feedback, Query, Response
+    from response_docs import document_refs
+    from vector_search_demo import docs
+
+    rows = []
+    client = app.test_client()
+    questions = synthetic_texts(args.requests, seed=args.seed + 2, words_per_text=6)
+
+    def post_query(question):
+        response = client.post("/query", json={"user_id": "bench", "query": question})
+        assert response.status_code == 200, response.status_code
+        return response.get_json()
+
+    timings = []
+    results = []
+    for question in questions:
+        start = time.perf_counter()
+        results.append(post_query(question))
+        timings.append(time.perf_counter() - start)
+    rows.append(summarize("POST /query", timings, cache="miss"))
+    rows.append(summarize("POST /query", measure(post_query, [(q,) for q in questions]), cache="hit"))
+
+    def revalidate(response_id):
+        assert client.post("/revalidate", json={"response_id": response_id}).status_code == 200
+    rows.append(summarize("POST /revalidate", measure(revalidate, [(r["response_id"],) for r in results])))
+
+    # Grow the history table to a realistic size without going through the LLM
+    db = SessionLocal()
+    rng = np.random.default_rng(args.seed)
+    for i in range(args.history_rows):
+        query_id = str(uuid.uuid4())
+        response_id = str(uuid.uuid4())
+        db.add(Query(id=query_id, user_id=f"user_{i % 50}", query=f"history question {i}"))
+        db.add(Response(
+            id=response_id,
+            query_id=query_id,
+            answer_json=json.dumps({"summary": ["s"], "facts": ["f"]}),
+            documents=document_refs([docs[j] for j in rng.choice(len(docs), 3, replace=False)]),
+        ))
+        db.add(Feedback(id=str(uuid.uuid4()), user_id="anonymous", query_id=query_id, response_id=response_id, rating="like"))
+    db.commit()
+    db.close()
+
+    def history(url):
+        assert client.get(url).status_code == 200
+    rows.append(summarize("GET /history", measure(history, [("/history",)] * args.repeat), history_rows=args.history_rows))
+    rows.append(summarize("GET /history", measure(history, [("/history?user_id=user_7",)] * args.repeat), history_rows=args.history_rows, filter="user"))
+
+    def aggregate(response_id):
+        assert client.get(f"/feedback/aggregate?response_id={response_id}").status_code == 200
+    rows.append(summarize("GET /feedback/aggregate", measure(aggregate, [(r["response_id"],) for r in results])))
+
+    for row in rows:
+        row["llm"] = args.http_worker
+    with open(args.worker_output, "w") as f:
+        json.dump(rows, f)
+
+
+def run_http(args):
+    rows = []
+    for mode in args.llm:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ)
+            env.pop("OPENAI_API_KEY", None)
+            env.pop("FAISS_INDEX_PATH", None)
+            env.update(
+                DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                LLM_STUB="true" if mode == "stub" else "false",
+                LLM_STUB_LATENCY=str(args.stub_latency),
+                DETERMINISTIC_EMBEDDINGS="true",
+                # Measure raw latency, not the limiter
+                RATE_LIMITS="",
+                # Warm before timing so the first request does not pay for the index build
+                WARMUP="sync",
+            )
+            output = os.path.join(tmp, "rows.json")
+            command = [
+                sys.executable, os.path.abspath(__file__),
+                "--http-worker", mode, "--worker-output", output,
+                "--requests", str(args.requests), "--history-rows", str(args.history_rows),
+                "--repeat", str(args.repeat), "--seed", str(args.seed),
+            ]
+            # The app logs every prompt; keep that out of the report
+            subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL, cwd=os.path.dirname(os.path.abspath(__file__)))
+            with open(output) as f:
+                mode_rows = json.load(f)
+        for row in mode_rows:
+            print_row(row)
+        rows.extend(mode_rows)
+    return rows
+
+
+def row_key(row):
+    return json.dumps({k: v for k, v in row.items() if k not in ("runs", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "ops_per_s")}, sort_keys=True)
+
+
+def compare(rows, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {row_key(row): row for row in json.load(f)["results"]}
+    print(f"\nChange in p50 vs {baseline_path}:")
+    for row in rows:
+        before = baseline.get(row_key(row))
+        if before and before["p50_ms"]:
+            change = (row["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100
+            print(f"{row_key(row):<90} {before['p50_ms']:>10.3f} -> {row['p50_ms']:>10.3f} ms ({change:+.1f}%)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", choices=("micro", "http", "all"), default="all")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200, help="Queries per retrieval benchmark")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per HTTP benchmark")
+    parser.add_argument("--history-rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--shards", type=int, default=1, help="Index shards for the retrieval benchmarks")
+    parser.add_argument("--llm", nargs="+", choices=("mock", "stub"), default=["mock", "stub"])
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="Seconds the stub LLM waits per call")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results and run metadata to this file")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run to diff against")
+    parser.add_argument("--http-worker", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.http_worker:
+        run_http_worker(args)
+        sys.exit(0)
+
+    results = []
+    if args.suite in ("micro", "all"):
+        results += [{"suite": "micro", **row} for row in run_micro(args)]
+    if args.suite in ("http", "all"):
+        results += [{"suite": "http", **row} for row in run_http(args)]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": datetime.utcnow().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("json", "compare", "http_worker", "worker_output")},
+                "results": results,
+            }, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
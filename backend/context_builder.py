@@ -0,0 +1,191 @@
+"""Token-budgeted prompt context.
+
+``ContextBuilder.build`` turns retrieved documents into the CONTEXT block of the
+prompt without exceeding a token budget:
+
+* each document is cut down to its sentences that share terms with the
+  question (its lead sentence when none do), in original order;
+* sentences that mostly repeat one already selected from a higher-ranked
+  document are dropped;
+* documents are added best lexical match first (then in rank order) until
+  the budget is spent, so a larger retrieval ``k`` costs tokens only for
+  passages that are relevant. A passage that does not fit loses trailing
+  sentences, then words, as long as a useful part of it remains; the first
+  passage is always kept in part, so retrieved documents never leave the
+  CONTEXT empty.
+
+Token counts come from a pluggable tokenizer (``CONTEXT_TOKENIZER``). The
+default ``chars`` counts one token per four characters, which needs no
+model files and slightly overestimates English text. ``tiktoken`` uses the
+real encoding when that package and its data files are available.
+``package.module:function`` plugs in any callable that returns a count.
+"""
+import hashlib
+import importlib
+import math
+import os
+import re
+from functools import lru_cache
+
+# End of sentence, but not inside initialisms such as "U.S." or "A.I."
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])(?<!\b[A-Z]\.[A-Z]\.)\s+(?=[A-Z0-9\"'])")
+WORD = re.compile(r"[a-z0-9]{2,}")
+# A passage cut to fit the budget keeps at least this many words (except the first)
+MIN_TRUNCATED_WORDS = 8
+STOPWORDS = frozenset(
+    "a an and are as at be by did do does for from has have how in is it its of on or "
+    "that the their this to was were what when where which who why will with about "
+    "latest new recent tell me us".split()
+)
+
+
+def count_chars(text):
+    return math.ceil(len(text) / 4)
+
+
+def tokenizer_from_env():
+    name = os.environ.get("CONTEXT_TOKENIZER", "chars")
+    if name == "chars":
+        return count_chars
+    if name == "tiktoken":
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(os.environ.get("TIKTOKEN_ENCODING", "o200k_base"))
+        except Exception as e:
+            print(f"[CONTEXT DEBUG] tiktoken unavailable, counting characters instead: {e}")
+            return count_chars
+        return lambda text: len(encoding.encode(text))
+    module_name, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def terms(text):
+    """Lowercased content words, with a trailing plural ``s`` removed."""
+    words = set()
+    for word in WORD.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith("s"):
+            word = word[:-1]
+        words.add(word)
+    return frozenset(words)
+
+
+@lru_cache(maxsize=4096)
+def _split(doc_key, text):
+    """Sentences of a document with their terms; cached per document version."""
+    sentences = [s.strip() for s in SENTENCE_BOUNDARY.split(text) if s.strip()]
+    return tuple((sentence, terms(sentence)) for sentence in sentences)
+
+
+def _overlap(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+class Context:
+    def __init__(self, text, doc_ids, tokens):
+        self.text = text
+        self.doc_ids = doc_ids
+        self.tokens = tokens
+
+
+class ContextBuilder:
+    def __init__(self, budget=1500, max_sentences=4, dedup_threshold=0.8, count_tokens=count_chars):
+        self.budget = budget
+        self.max_sentences = max_sentences
+        self.dedup_threshold = dedup_threshold
+        self.count_tokens = count_tokens
+
+    def passage(self, sentences, question_terms, selected_terms):
+        """Query-relevant sentences (or the lead sentence) that do not repeat ``selected_terms``."""
+        scored = sorted(
+            ((len(sentence_terms & question_terms), i) for i, (_, sentence_terms) in enumerate(sentences)),
+            key=lambda s: -s[0],
+        )
+        relevant = sorted(i for score, i in scored[:self.max_sentences] if score > 0)
+        chosen = []
+        for i in relevant or [0]:
+            sentence, sentence_terms = sentences[i]
+            if any(_overlap(sentence_terms, seen) >= self.dedup_threshold for seen in selected_terms):
+                continue
+            chosen.append((sentence, sentence_terms))
+        return chosen
+
+    def fit(self, prefix, chosen, remaining, min_words=MIN_TRUNCATED_WORDS):
+        """``(chosen, text, tokens)`` cut to ``remaining`` tokens, or None if too little would remain.
+
+        Trailing sentences are dropped first; a single sentence that is still
+        too long is cut at a word boundary, keeping at least ``min_words``.
+        """
+        while chosen:
+            text = " ".join(sentence for sentence, _ in chosen)
+            tokens = self.count_tokens(f"{prefix}{text}") + 1
+            if tokens <= remaining:
+                return chosen, text, tokens
+            if len(chosen) == 1:
+                break
+            chosen = chosen[:-1]
+        if not chosen:
+            return None
+        words = chosen[0][0].split()
+
+        def cut(n):
+            return " ".join(words[:n]) + " ..."
+
+        # Longest word prefix that fits; token counts grow with the prefix
+        lo, hi = 0, len(words) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.count_tokens(f"{prefix}{cut(mid)}") + 1 <= remaining:
+                lo = mid
+            else:
+                hi = mid - 1
+        if lo < max(min_words, 1):
+            return None
+        text = cut(lo)
+        return chosen, text, self.count_tokens(f"{prefix}{text}") + 1
+
+    def build(self, docs, question):
+        question_terms = terms(question)
+        split = [
+            _split((doc["id"], hashlib.sha1(doc["text"].encode("utf-8")).hexdigest()), doc["text"])
+            for doc in docs
+        ]
+        # Documents with the best-matching sentences get the budget first;
+        # ties (including no match at all) keep retrieval order
+        best = [max((len(st & question_terms) for _, st in sentences), default=0) for sentences in split]
+        order = sorted(range(len(docs)), key=lambda i: -best[i])
+        selected_terms = []
+        picked = {}
+        used = 0
+        for i in order:
+            doc = docs[i]
+            chosen = self.passage(split[i], question_terms, selected_terms) if split[i] else []
+            if not chosen:
+                continue
+            # Any part of the first passage beats an empty CONTEXT
+            fitted = self.fit(
+                f"{len(docs)}. {doc['id']}: ", chosen, self.budget - used,
+                min_words=MIN_TRUNCATED_WORDS if picked else 1,
+            )
+            if fitted is None:
+                # Smaller passages further down may still fit
+                continue
+            chosen, text, tokens = fitted
+            used += tokens
+            picked[i] = text
+            selected_terms.extend(sentence_terms for _, sentence_terms in chosen)
+        ranks = sorted(picked)
+        lines = [f"{n + 1}. {docs[i]['id']}: {picked[i]}" for n, i in enumerate(ranks)]
+        return Context("\n".join(lines), [docs[i]["id"] for i in ranks], used)
+
+
+def context_builder_from_env():
+    return ContextBuilder(
+        budget=int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1500)),
+        max_sentences=int(os.environ.get("CONTEXT_MAX_SENTENCES", 4)),
+        dedup_threshold=float(os.environ.get("CONTEXT_DEDUP_THRESHOLD", 0.8)),
+        count_tokens=tokenizer_from_env(),
+    )
@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from flask import g
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 from models import Base
@@ -7,7 +8,100 @@ from models import Base
 load_dotenv()
 
 DATABASE_URL = os.environ["DATABASE_URL"]
-engine = create_engine(DATABASE_URL)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+def _engine_options():
+    options = {"pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"}
+    # In-memory SQLite uses a single-connection pool that takes no sizing options
+    if IS_SQLITE and (DATABASE_URL in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in DATABASE_URL):
+        return options
+    options.update(
+        pool_size=int(os.environ.get("DB_POOL_SIZE", 10)),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+    )
+    return options
+
+
+engine = create_engine(DATABASE_URL, **_engine_options())
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # WAL lets readers run alongside the single writer; busy_timeout makes
+        # writers wait for the lock instead of failing with "database is locked"
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+
+def init_schema():
+    """Create missing tables and indexes.
+
+    Called once at app startup rather than on import, so scripts and workers
+    that only need a session skip the catalog round trips.
+    """
+    Base.metadata.create_all(bind=engine)
+
+
+def warm_pool(connections):
+    """Open up to ``connections`` pooled connections now instead of on the first requests."""
+    size = engine.pool.size() if hasattr(engine.pool, "size") else 1
+    held = []
+    try:
+        for _ in range(max(1, min(connections, size))):
+            conn = engine.connect()
+            held.append(conn)
+            conn.exec_driver_sql("SELECT 1")
+    finally:
+        for conn in held:
+            conn.close()
+    return len(held)
+
+
+def get_db():
+    """Session for the current request, opened on first use and closed at teardown."""
+    if "db" not in g:
+        g.db = SessionLocal()
+    return g.db
+
+
+def close_db(exc=None):
+    db = g.pop("db", None)
+    if db is not None:
+        if exc is not None:
+            db.rollback()
+        db.close()
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db)
+
+
+def insert_for(db):
+    """Dialect ``insert`` construct with ``on_conflict_*`` support for the session's database."""
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"No native upsert for {dialect}")
+    return insert
+
+
+def pool_stats():
+    """Connection pool counters for monitoring."""
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
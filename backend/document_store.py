@@ -0,0 +1,255 @@
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import threading
+from cache import LRUCache
+from seed_documents import docs as seed_docs
+
+SNAPSHOT_MAGIC = b"GDOCS001"
+
+
+def _id_hash(doc_id):
+    return int.from_bytes(hashlib.blake2b(doc_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def write_document_snapshot(path, records):
+    """Write ``(doc_id, text)`` records to a read-only snapshot file at ``path``.
+
+    Layout: magic, count, then sorted id hashes, record offsets and lengths
+    (uint64 each) and the ``id\\0text`` records themselves. Records are
+    streamed to a side file first, so memory grows by 24 bytes per document
+    rather than with the text. Returns the number of documents written.
+    """
+    import numpy as np
+
+    tmp = f"{path}.tmp.{os.getpid()}"
+    hashes, offsets, lengths = [], [], []
+    offset = 0
+    with open(f"{tmp}.data", "wb") as data:
+        for doc_id, text in records:
+            record = doc_id.encode("utf-8") + b"\0" + text.encode("utf-8")
+            data.write(record)
+            hashes.append(_id_hash(doc_id))
+            offsets.append(offset)
+            lengths.append(len(record))
+            offset += len(record)
+    order = np.argsort(np.array(hashes, dtype="<u8"), kind="stable")
+    with open(tmp, "wb") as f, open(f"{tmp}.data", "rb") as data:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<Q", len(hashes)))
+        for column in (hashes, offsets, lengths):
+            f.write(np.array(column, dtype="<u8")[order].tobytes())
+        shutil.copyfileobj(data, f)
+    os.remove(f"{tmp}.data")
+    os.replace(tmp, path)
+    return len(hashes)
+
+
+class DocumentSnapshot:
+    """Read-only view of a file written by ``write_document_snapshot``.
+
+    The file is memory-mapped, so every process that opens it shares the
+    same pages through the OS page cache instead of holding its own copy.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:8] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a document snapshot")
+        (self.count,) = struct.unpack_from("<Q", self._map, 8)
+        columns = [
+            np.frombuffer(self._map, dtype="<u8", count=self.count, offset=16 + 8 * self.count * i)
+            for i in range(3)
+        ]
+        self._hashes, self._offsets, self._lengths = columns
+        self._data_start = 16 + 24 * self.count
+
+    def __len__(self):
+        return self.count
+
+    def get(self, doc_id):
+        h = _id_hash(doc_id)
+        i = int(self._hashes.searchsorted(h))
+        key = doc_id.encode("utf-8") + b"\0"
+        while i < self.count and int(self._hashes[i]) == h:
+            start = self._data_start + int(self._offsets[i])
+            record = self._map[start:start + int(self._lengths[i])]
+            if record.startswith(key):
+                return record[len(key):].decode("utf-8")
+            i += 1
+        return None
+
+
+class DocumentStore:
+    """Document id -> text lookup for retrieval results.
+
+    Seed documents are always held in memory. With ``snapshot_path`` set,
+    documents are next looked up in a shared read-only ``DocumentSnapshot``.
+    Anything else is fetched from the ``documents`` table in one query per
+    lookup and kept in a bounded LRU cache.
+
+    The snapshot may predate an update or delete, and another process's LRU
+    cache may still hold the old text. ``discard`` therefore appends the ids
+    to a change log next to the snapshot (``<snapshot_path>.changed``), and
+    every process reads new entries before each lookup: those ids are no
+    longer served from its snapshot and are dropped from its cache.
+    """
+
+    def __init__(self, seed_docs, cache_size=10000, snapshot_path=None):
+        self._seed = {doc["id"]: doc["text"] for doc in seed_docs}
+        self._cache = LRUCache(cache_size)
+        self.snapshot_path = snapshot_path
+        self._snapshot = None
+        self._changed = set()
+        self.changes_path = f"{snapshot_path}.changed" if snapshot_path else None
+        # (inode, bytes read) of the change log
+        self._changes_read = (None, 0)
+        self._changes_lock = threading.Lock()
+        if snapshot_path:
+            self.refresh()
+
+    def add(self, documents):
+        for doc in documents:
+            self._cache.set(doc["id"], doc["text"])
+
+    def discard(self, doc_ids):
+        doc_ids = list(doc_ids)
+        for doc_id in doc_ids:
+            self._changed.add(doc_id)
+            self._cache.delete(doc_id)
+        if self.changes_path and doc_ids:
+            # One O_APPEND write, so lines from concurrent processes do not interleave
+            fd = os.open(self.changes_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, "".join(f"{doc_id}\n" for doc_id in doc_ids).encode("utf-8"))
+            finally:
+                os.close(fd)
+
+    def _read_changes(self):
+        """Apply change log entries written (by any process) since the last call."""
+        try:
+            stat = os.stat(self.changes_path)
+        except FileNotFoundError:
+            return
+        inode, offset = self._changes_read
+        if stat.st_ino == inode and stat.st_size == offset:
+            return
+        with self._changes_lock:
+            inode, offset = self._changes_read
+            if stat.st_ino != inode:
+                # Compacted after a snapshot rewrite; ids already read stay changed
+                offset = 0
+            try:
+                with open(self.changes_path, "rb") as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    f.seek(offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            # A line still being written is picked up next time
+            data = data[:data.rfind(b"\n") + 1]
+            for doc_id in data.decode("utf-8").splitlines():
+                self._changed.add(doc_id)
+                self._cache.delete(doc_id)
+            self._changes_read = (inode, offset + len(data))
+
+    def rewrite_snapshot(self, records):
+        """Replace the snapshot with ``(doc_id, text)`` records and compact the change log.
+
+        Change log entries written before the rewrite started are covered by
+        the new snapshot and dropped; later ones are kept, since the rows may
+        have been read before they changed. Returns the number of documents.
+        """
+        start = 0
+        if os.path.exists(self.changes_path):
+            start = os.path.getsize(self.changes_path)
+        count = write_document_snapshot(self.snapshot_path, records)
+        try:
+            old = open(self.changes_path, "rb")
+        except FileNotFoundError:
+            old = None
+        if old is not None:
+            with old:
+                old.seek(start)
+                tmp = f"{self.changes_path}.tmp.{os.getpid()}"
+                with open(tmp, "wb") as f:
+                    f.write(old.read())
+                os.replace(tmp, self.changes_path)
+                # Appends that reached the old file while it was being replaced
+                late = old.read()
+            if late:
+                with open(self.changes_path, "ab") as f:
+                    f.write(late)
+        self.refresh()
+        return count
+
+    def refresh(self):
+        """Open the snapshot file, or reopen it if it was replaced. Returns True if it changed."""
+        if not self.snapshot_path:
+            return False
+        self._read_changes()
+        try:
+            stat = os.stat(self.snapshot_path)
+        except FileNotFoundError:
+            return False
+        current = self._snapshot
+        if current is not None and current.signature == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+            return False
+        try:
+            # Readers holding the old snapshot keep its mapping until they finish
+            self._snapshot = DocumentSnapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            print(f"[DOCS DEBUG] Failed to open document snapshot {self.snapshot_path}: {e}")
+            return False
+        print(f"[DOCS DEBUG] Opened document snapshot {self.snapshot_path} ({len(self._snapshot)} documents)")
+        return True
+
+    def get_many(self, doc_ids):
+        """Return ``{"id", "text"}`` dicts in the order of ``doc_ids``, skipping unknown ids."""
+        if self.changes_path:
+            self._read_changes()
+        snapshot = self._snapshot
+        texts = {}
+        missing = []
+        for doc_id in doc_ids:
+            text = self._seed.get(doc_id)
+            if text is None and snapshot is not None and doc_id not in self._changed:
+                text = snapshot.get(doc_id)
+            if text is None:
+                text = self._cache.get(doc_id)
+            if text is None:
+                missing.append(doc_id)
+            else:
+                texts[doc_id] = text
+        if missing:
+            for doc_id, text in self._fetch(missing):
+                self._cache.set(doc_id, text)
+                texts[doc_id] = text
+        return [{"id": doc_id, "text": texts[doc_id]} for doc_id in doc_ids if doc_id in texts]
+
+    def _fetch(self, doc_ids):
+        from database import SessionLocal
+        from models import Document
+
+        db = SessionLocal()
+        try:
+            return db.query(Document.id, Document.text).filter(Document.id.in_(doc_ids)).all()
+        finally:
+            db.close()
+
+
+# Read-only id -> text file shared by every worker process. Built here rather
+# than next to the index, so reading stored responses never imports faiss.
+DOCUMENT_SNAPSHOT_PATH = os.environ.get("DOCUMENT_SNAPSHOT_PATH") or (
+    f"{os.environ['FAISS_INDEX_PATH']}.docs" if os.environ.get("FAISS_INDEX_PATH") else ""
+)
+document_store = DocumentStore(
+    seed_docs, int(os.environ.get("DOCUMENT_CACHE_SIZE", 10000)), snapshot_path=DOCUMENT_SNAPSHOT_PATH or None
+)
@@ -0,0 +1,35 @@
+import numpy as np
+
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def encode_embedding(vector, dtype="float32") -> bytes:
+    """Serialize an embedding for the ``documents.embedding`` column.
+
+    ``float32`` is lossless (4 bytes per dimension), ``float16`` halves that,
+    and ``int8`` stores a float32 scale followed by one signed byte per
+    dimension (symmetric per-vector quantization, ~4x smaller).
+    """
+    vector = np.asarray(vector, dtype="<f4")
+    if dtype == "float32":
+        return vector.tobytes()
+    if dtype == "float16":
+        return vector.astype("<f2").tobytes()
+    if dtype == "int8":
+        peak = float(np.abs(vector).max()) if vector.size else 0.0
+        scale = peak / 127 if peak > 0 else 1.0
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype("i1")
+        return np.float32(scale).astype("<f4").tobytes() + codes.tobytes()
+    raise ValueError(f"Unknown embedding dtype {dtype!r}, expected one of {EMBEDDING_DTYPES}")
+
+
+def decode_embedding(data: bytes, dtype="float32") -> np.ndarray:
+    """Inverse of encode_embedding; always returns a float32 vector."""
+    if dtype == "float32":
+        return np.frombuffer(data, dtype="<f4")
+    if dtype == "float16":
+        return np.frombuffer(data, dtype="<f2").astype("float32")
+    if dtype == "int8":
+        scale = np.frombuffer(data[:4], dtype="<f4")[0]
+        return np.frombuffer(data[4:], dtype="i1").astype("float32") * scale
+    raise ValueError(f"Unknown embedding dtype {dtype!r}, expected one of {EMBEDDING_DTYPES}")
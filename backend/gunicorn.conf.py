@@ -0,0 +1,47 @@
+"""Production serving: ``gunicorn -c gunicorn.conf.py app:app``.
+
+Workers do not share Python objects, so sharing happens at the file level.
+Before any worker starts, the master runs ``vector_search_demo.py
+--prepare`` in a subprocess. It writes the index shard and document
+snapshots that are missing, so workers do not each build the index or race
+to write it. Every worker then memory-maps the same files. For
+``FAISS_INDEX_TYPE=flat_mmap`` or an ``ivf_*`` type, and for the document
+snapshot, the kernel keeps one copy of those pages for all workers. Other
+index types are read into each worker.
+
+The app is not preloaded in the master. Its warmup thread, database pool
+and LLM client would not survive the fork, and each worker starts its own.
+Workers reload snapshots that another process rewrites, checking every
+``INDEX_RELOAD_INTERVAL`` seconds or at once on ``SIGUSR2``, e.g.
+``pkill -USR2 -P <master pid>``. ``kill -HUP <master pid>`` replaces all
+workers gracefully.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Requests mostly wait on the LLM and the database, so each worker also runs threads
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+# Long enough for a streamed answer; LLM_TIMEOUT bounds each model call
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+preload_app = False
+accesslog = "-"
+
+
+def on_starting(server):
+    if not os.environ.get("FAISS_INDEX_PATH"):
+        server.log.warning("FAISS_INDEX_PATH is not set; every worker builds its own in-memory index")
+        return
+    # A subprocess keeps faiss, its threads and database connections out of the master
+    result = subprocess.run(
+        [sys.executable, "vector_search_demo.py", "--prepare"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode:
+        server.log.error("Preparing index snapshots failed; workers will build their own")
@@ -0,0 +1,103 @@
+import os
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "flat_mmap", "ivf_flat", "hnsw", "ivf_pq", "sq8", "sq_fp16", "pq", "ivf_sq8")
+
+IVF_INDEX_TYPES = ("ivf_flat", "ivf_pq", "ivf_sq8")
+PQ_INDEX_TYPES = ("pq", "ivf_pq")
+
+DEFAULT_INDEX_PARAMS = {
+    "index_type": "flat",
+    "nlist": 1024,
+    "nprobe": 16,
+    "hnsw_m": 32,
+    "ef_construction": 80,
+    "ef_search": 64,
+    "pq_m": 8,
+    "pq_nbits": 8,
+}
+
+# FAISS k-means wants roughly this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def index_params_from_env():
+    params = dict(DEFAULT_INDEX_PARAMS)
+    for name, default in DEFAULT_INDEX_PARAMS.items():
+        value = os.environ.get(f"FAISS_{name.upper()}")
+        if value:
+            params[name] = value.lower() if isinstance(default, str) else int(value)
+    return params
+
+
+def create_index(dim, training_vectors, **params):
+    """Return an empty, trained, ID-mapped index described by ``params``.
+
+    ``params`` override DEFAULT_INDEX_PARAMS. Besides exact ``flat`` there
+    is ``flat_mmap``, equally exact but stored as a single inverted list so
+    that snapshots read with IO_FLAG_MMAP share its vectors across
+    processes instead of copying them (as for every ``ivf_*`` type). There
+    are also graph (``hnsw``) and inverted-list (``ivf_*``) indexes, and compact
+    codecs that trade accuracy for memory: ``sq_fp16`` (2 bytes per
+    dimension), ``sq8`` / ``ivf_sq8`` (1 byte) and ``pq`` / ``ivf_pq``
+    (``pq_m`` codes of ``pq_nbits`` bits per vector).
+
+    Trained indexes learn from ``training_vectors``; ``nlist`` is capped so
+    every centroid gets enough training points, and a corpus too small to
+    train on at all falls back to an exact flat index.
+    """
+    params = {**DEFAULT_INDEX_PARAMS, **params}
+    index_type = params["index_type"]
+    nlist = params["nlist"]
+    pq_m = params["pq_m"]
+    pq_nbits = params["pq_nbits"]
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    n = len(training_vectors)
+    if index_type in PQ_INDEX_TYPES and n < MIN_POINTS_PER_CENTROID * 2 ** pq_nbits:
+        print(f"[INDEX DEBUG] {n} vectors are too few to train {index_type}; using flat")
+        return create_index(dim, training_vectors)
+    if index_type == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+        base.hnsw.efConstruction = params["ef_construction"]
+    elif index_type in IVF_INDEX_TYPES:
+        nlist = min(nlist, n // MIN_POINTS_PER_CENTROID)
+        if nlist < 1:
+            print(f"[INDEX DEBUG] {n} vectors are too few to train {index_type}; using flat")
+            return create_index(dim, training_vectors)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        elif index_type == "ivf_sq8":
+            base = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit)
+        else:
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits)
+        base.train(training_vectors)
+    elif index_type == "pq":
+        base = faiss.IndexPQ(dim, pq_m, pq_nbits)
+        base.train(training_vectors)
+    elif index_type in ("sq8", "sq_fp16"):
+        if n == 0 and index_type == "sq8":
+            return create_index(dim, training_vectors)
+        qtype = faiss.ScalarQuantizer.QT_8bit if index_type == "sq8" else faiss.ScalarQuantizer.QT_fp16
+        base = faiss.IndexScalarQuantizer(dim, qtype)
+        base.train(training_vectors)
+    elif index_type == "flat_mmap":
+        # One list with a single zero centroid: every vector is scanned, as in flat
+        quantizer = faiss.IndexFlatL2(dim)
+        quantizer.add(np.zeros((1, dim), dtype="float32"))
+        base = faiss.IndexIVFFlat(quantizer, dim, 1)
+    else:
+        base = faiss.IndexFlatL2(dim)
+    return set_search_params(faiss.IndexIDMap2(base), **params)
+
+
+def set_search_params(index, nprobe=None, ef_search=None, **_):
+    """Apply query-time knobs to an (ID-mapped) index; ignores ones that do not apply."""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe, base.nlist)
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+    return index
@@ -0,0 +1,480 @@
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+import numpy as np
+import faiss
+from index_factory import create_index, set_search_params
+
+try:
+    import fcntl
+except ImportError:
+    # No cross-process file locks (Windows); concurrent savers may then lose updates
+    fcntl = None
+
+
+def _empty_id_index(dim):
+    return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+
+def _id_index_contents(index):
+    """Return (labels, vectors) stored in an IndexIDMap2 over a flat index."""
+    labels = faiss.vector_to_array(index.id_map).astype("int64")
+    vectors = index.index.reconstruct_n(0, index.ntotal) if index.ntotal else np.zeros((0, index.d), dtype="float32")
+    return labels, vectors
+
+
+class IndexSnapshot:
+    """Immutable view of the index that readers search against.
+
+    ``main`` holds the bulk of the vectors, ``delta`` the ones added since the
+    last compaction. Both are ID-mapped: FAISS labels resolve to document ids
+    through ``labels``. Deleted or superseded labels stay in the indexes as
+    ``tombstones`` and are filtered out of results until compaction.
+    """
+
+    __slots__ = ("main", "delta", "labels", "tombstones", "version")
+
+    def __init__(self, main, delta, labels, tombstones, version):
+        self.main = main
+        self.delta = delta
+        self.labels = labels
+        self.tombstones = tombstones
+        self.version = version
+
+    @property
+    def ntotal(self):
+        return self.main.ntotal + self.delta.ntotal - len(self.tombstones)
+
+    def search(self, query_vectors, k):
+        """Return (distance lists, doc id lists), one list per query row."""
+        fetch = k + len(self.tombstones)
+        distances, labels = [], []
+        for index in (self.main, self.delta):
+            if index.ntotal:
+                D, I = index.search(query_vectors, min(fetch, index.ntotal))
+                distances.append(D)
+                labels.append(I)
+        if not distances:
+            return [[] for _ in query_vectors], [[] for _ in query_vectors]
+        D = np.hstack(distances)
+        I = np.hstack(labels)
+        order = np.argsort(D, axis=1, kind="stable")
+        all_distances, all_doc_ids = [], []
+        for row in range(len(I)):
+            row_distances, row_doc_ids = [], []
+            for col in order[row]:
+                label = int(I[row, col])
+                if label == -1 or label in self.tombstones:
+                    continue
+                row_distances.append(float(D[row, col]))
+                row_doc_ids.append(self.labels[label])
+                if len(row_doc_ids) == k:
+                    break
+            all_distances.append(row_distances)
+            all_doc_ids.append(row_doc_ids)
+        return all_distances, all_doc_ids
+
+
+class IndexManager:
+    """Process-wide owner of the document vector index.
+
+    The index is built once from ``load_corpus`` (which returns document ids
+    and their float32 vectors) or loaded from an on-disk snapshot, and every
+    search is served from the shared instance. ``index_params`` choose the
+    main index type and its tuning, see index_factory.create_index.
+
+    Updates are read-copy-update: writers serialize on a lock, build the next
+    ``IndexSnapshot`` (new vectors go into a small delta index, deletes become
+    tombstones) and publish it with a single reference swap. Readers keep
+    searching whichever snapshot they grabbed and are never blocked. Once the
+    delta or the tombstone set crosses its threshold the writer compacts them
+    into a fresh main index. ``version`` increases on every swap so callers
+    can key caches on it.
+
+    With ``snapshot_path`` set, ``save`` persists the index for other
+    processes and restarts. While the main index is the one on disk, only
+    the delta and tombstones are written, to ``<snapshot_path>.delta.json``,
+    so saving after every update stays cheap whatever the index type. A
+    main index that was rebuilt or compacted is written whole. Processes
+    sharing the files save under a lock file; if another process saved since
+    this one last read the files, they are reloaded and this process's own
+    pending changes are applied on top before writing, so neither process's
+    updates are lost.
+    """
+
+    def __init__(
+        self,
+        load_corpus,
+        dim=8,
+        snapshot_path=None,
+        mmap=True,
+        max_delta=10000,
+        max_tombstone_ratio=0.2,
+        index_params=None,
+    ):
+        self._load_corpus = load_corpus
+        self.dim = dim
+        self.index_params = index_params or {}
+        self.snapshot_path = snapshot_path
+        self.mmap = mmap
+        self.max_delta = max_delta
+        self.max_tombstone_ratio = max_tombstone_ratio
+        self._snapshot = None
+        self._doc_labels = {}
+        self._next_label = 0
+        # Identity of the snapshot file this index matches, and whether it
+        # has changed since (local updates or a build not yet saved)
+        self._file_signature = None
+        self._dirty = False
+        # Generation id of the main index on disk, and whether the live main
+        # index is that one (so a delta written against it applies)
+        self._generation = None
+        self._main_saved = False
+        # Whether the live index was built from the corpus rather than the files
+        self._built = False
+        # doc id -> vector (None if deleted) changed since the files were last read or written
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot else 0
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    @property
+    def dirty(self):
+        """True if the live index has changes its snapshot file lacks."""
+        return self._dirty
+
+    def get_snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._publish(*self._load_or_build())
+                snapshot = self._snapshot
+        return snapshot
+
+    def get_index(self):
+        return self.get_snapshot().main
+
+    def __contains__(self, doc_id):
+        self.get_snapshot()
+        return doc_id in self._doc_labels
+
+    def __len__(self):
+        return self.get_snapshot().ntotal
+
+    def search(self, query_vectors, k):
+        return self.get_snapshot().search(query_vectors, k)
+
+    def add(self, doc_ids, vectors):
+        """Insert or replace vectors for ``doc_ids``.
+
+        Vectors go into the delta index; any previous vector for the same
+        document is tombstoned. Batch writes where possible: each call
+        copies the delta index.
+        """
+        doc_ids = list(doc_ids)
+        with self._lock:
+            current = self.get_snapshot()
+            labels = np.arange(self._next_label, self._next_label + len(doc_ids), dtype="int64")
+            self._next_label += len(doc_ids)
+            tombstones = set(current.tombstones)
+            vectors = np.ascontiguousarray(vectors, dtype="float32")
+            for row, (doc_id, label) in enumerate(zip(doc_ids, labels.tolist())):
+                if self.snapshot_path:
+                    self._pending[doc_id] = vectors[row]
+                previous = self._doc_labels.get(doc_id)
+                if previous is not None:
+                    tombstones.add(previous)
+                self._doc_labels[doc_id] = label
+                # Labels are never reused, so snapshots can share this dict
+                current.labels[label] = doc_id
+            delta = faiss.clone_index(current.delta)
+            delta.add_with_ids(vectors, labels)
+            self._swap(current.main, delta, current.labels, tombstones)
+            self._dirty = True
+            self._maybe_compact()
+            return self._snapshot
+
+    update = add
+
+    def delete(self, doc_ids):
+        with self._lock:
+            current = self.get_snapshot()
+            tombstones = set(current.tombstones)
+            for doc_id in doc_ids:
+                label = self._doc_labels.pop(doc_id, None)
+                if label is not None:
+                    tombstones.add(label)
+                    if self.snapshot_path:
+                        self._pending[doc_id] = None
+            if len(tombstones) != len(current.tombstones):
+                self._swap(current.main, current.delta, current.labels, tombstones)
+                self._dirty = True
+                self._maybe_compact()
+            return self._snapshot
+
+    def compact(self):
+        """Fold the delta into the main index and drop tombstoned vectors."""
+        with self._lock:
+            current = self.get_snapshot()
+            if not current.delta.ntotal and not current.tombstones:
+                return current
+            delta = faiss.clone_index(current.delta)
+            delta_labels, _ = _id_index_contents(delta)
+            dead_in_delta = current.tombstones.intersection(delta_labels.tolist())
+            dead_in_main = np.fromiter(current.tombstones - dead_in_delta, dtype="int64")
+            if dead_in_delta:
+                delta.remove_ids(np.fromiter(dead_in_delta, dtype="int64"))
+            try:
+                main = faiss.clone_index(current.main)
+                if len(dead_in_main):
+                    main.remove_ids(dead_in_main)
+            except RuntimeError as e:
+                # HNSW cannot remove vectors and mmap'd IVF lists cannot be
+                # cloned; rebuild from the corpus instead.
+                print(f"[INDEX DEBUG] Compacting by full rebuild: {e}")
+                self._publish(*self._build())
+                return self._snapshot
+            delta_labels, delta_vectors = _id_index_contents(delta)
+            if len(delta_labels):
+                main.add_with_ids(delta_vectors, delta_labels)
+            labels = {
+                label: doc_id for label, doc_id in current.labels.items()
+                if label not in current.tombstones
+            }
+            self._swap(main, _empty_id_index(self.dim), labels, ())
+            self._main_saved = False
+            print(f"[INDEX DEBUG] Compacted index ({main.ntotal} vectors)")
+            return self._snapshot
+
+    def rebuild(self, persist=True):
+        with self._lock:
+            self._publish(*self._build())
+            if persist and self.snapshot_path:
+                self.save()
+            return self._snapshot.main
+
+    def reload(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            raise FileNotFoundError(f"No index snapshot at {self.snapshot_path}")
+        with self._lock:
+            self._publish_file()
+            return self._snapshot.main
+
+    def refresh(self):
+        """Load the snapshot files if another process has replaced them. Returns True if it had.
+
+        Changes of this process that the files lack are applied on top. An
+        index built from the corpus since it was last saved is rebuilt
+        instead, which has both.
+        """
+        if not self.snapshot_path or self._snapshot is None:
+            return False
+        signature = self._stat_snapshot()
+        if signature is None or signature == self._file_signature:
+            return False
+        with self._lock:
+            if self._built:
+                print(f"[INDEX DEBUG] {self.snapshot_path} changed; rebuilding to keep local updates")
+                self._publish(*self._build())
+                self._file_signature = signature
+            else:
+                print(f"[INDEX DEBUG] {self.snapshot_path} changed; reloading")
+                self._merge_file()
+        return True
+
+    def save(self):
+        """Write the index to ``snapshot_path``: the delta and tombstones only, unless the main index changed."""
+        if not self.snapshot_path:
+            raise ValueError("snapshot_path is not configured")
+        with self._lock, self._file_lock():
+            snapshot = self.get_snapshot()
+            signature = self._stat_snapshot()
+            if not self._built and signature is not None and signature != self._file_signature:
+                # Another process saved since we last read the files
+                self._merge_file()
+                snapshot = self._snapshot
+            if self._main_saved:
+                self._write_delta(snapshot)
+            else:
+                snapshot = self.compact()
+                self._write_snapshot(snapshot.main, snapshot.labels)
+
+    def _merge_file(self):
+        """Load the snapshot files and apply this process's pending changes on top."""
+        pending = self._pending
+        self._publish_file()
+        upserts = [(doc_id, vector) for doc_id, vector in pending.items() if vector is not None]
+        deletes = [doc_id for doc_id, vector in pending.items() if vector is None]
+        if upserts:
+            self.add([doc_id for doc_id, _ in upserts], np.stack([vector for _, vector in upserts]))
+        if deletes:
+            self.delete(deletes)
+        if pending:
+            print(f"[INDEX DEBUG] Merged {len(pending)} local changes into {self.snapshot_path}")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock, across processes, for writing the snapshot files."""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.snapshot_path}.lock", "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _maybe_compact(self):
+        snapshot = self._snapshot
+        if (
+            snapshot.delta.ntotal >= self.max_delta
+            or len(snapshot.tombstones) > self.max_tombstone_ratio * max(snapshot.ntotal, 1)
+        ):
+            self.compact()
+
+    def _swap(self, main, delta, labels, tombstones):
+        self._snapshot = IndexSnapshot(main, delta, labels, frozenset(tombstones), self._snapshot.version + 1)
+
+    def _publish(self, main, labels, from_file=False, delta=None, tombstones=frozenset()):
+        """Swap in a freshly built or loaded index and reset the writer state.
+
+        ``labels`` covers both ``main`` and ``delta``.
+        """
+        self._dirty = not from_file
+        self._built = not from_file
+        self._main_saved = from_file and self._generation is not None
+        self._pending = {}
+        self._doc_labels = {doc_id: label for label, doc_id in labels.items() if label not in tombstones}
+        self._next_label = max(labels, default=-1) + 1
+        if delta is None:
+            delta = _empty_id_index(self.dim)
+        self._snapshot = IndexSnapshot(main, delta, labels, frozenset(tombstones), self.version + 1)
+
+    def _publish_file(self):
+        main, labels, delta, tombstones = self._read_snapshot()
+        self._publish(main, labels, True, delta, tombstones)
+
+    def _build(self):
+        doc_ids, vectors = self._load_corpus()
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        main = create_index(self.dim, vectors, **self.index_params)
+        labels = np.arange(len(doc_ids), dtype="int64")
+        if len(doc_ids):
+            main.add_with_ids(vectors, labels)
+        return main, dict(zip(labels.tolist(), doc_ids))
+
+    @property
+    def _delta_path(self):
+        return f"{self.snapshot_path}.delta.json"
+
+    def _write_snapshot(self, main, labels):
+        # Write next to the targets and rename so readers never see a partial
+        # file; temporary names are per process so concurrent writers cannot mix
+        ids_path = f"{self.snapshot_path}.ids.json"
+        tmp = f"tmp.{os.getpid()}"
+        generation = uuid.uuid4().hex
+        with open(f"{ids_path}.{tmp}", "w") as f:
+            json.dump({"generation": generation, "labels": [[label, doc_id] for label, doc_id in labels.items()]}, f)
+        faiss.write_index(main, f"{self.snapshot_path}.{tmp}")
+        os.replace(f"{ids_path}.{tmp}", ids_path)
+        os.replace(f"{self.snapshot_path}.{tmp}", self.snapshot_path)
+        # A delta of the previous main index no longer applies
+        try:
+            os.remove(self._delta_path)
+        except FileNotFoundError:
+            pass
+        self._generation = generation
+        self._main_saved = True
+        self._built = False
+        self._pending = {}
+        self._file_signature = self._stat_snapshot()
+        self._dirty = False
+
+    def _write_delta(self, snapshot):
+        delta_labels, delta_vectors = _id_index_contents(snapshot.delta)
+        tmp = f"{self._delta_path}.tmp.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump({
+                "generation": self._generation,
+                "labels": [[label, snapshot.labels[label]] for label in delta_labels.tolist()],
+                "vectors": delta_vectors.tolist(),
+                "tombstones": sorted(snapshot.tombstones),
+            }, f)
+        os.replace(tmp, self._delta_path)
+        self._pending = {}
+        self._file_signature = self._stat_snapshot()
+        self._dirty = False
+
+    def _stat_snapshot(self):
+        signature = []
+        for path in (self.snapshot_path, self._delta_path):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if path == self.snapshot_path:
+                    return None
+                signature.append(None)
+                continue
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def _read_snapshot(self):
+        """(main, labels, delta, tombstones) from the snapshot files."""
+        # Stat first: if the file is replaced while reading, the next refresh loads it again
+        self._file_signature = self._stat_snapshot()
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if self.mmap else 0
+        main = set_search_params(faiss.read_index(self.snapshot_path, flags), **self.index_params)
+        with open(f"{self.snapshot_path}.ids.json") as f:
+            data = json.load(f)
+        labels = {int(label): doc_id for label, doc_id in data["labels"]}
+        if len(labels) != main.ntotal:
+            raise ValueError(f"{len(labels)} ids for {main.ntotal} vectors")
+        # Snapshots written before deltas existed have no generation
+        self._generation = data.get("generation")
+        delta = _empty_id_index(self.dim)
+        tombstones = frozenset()
+        try:
+            with open(self._delta_path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = None
+        if saved and self._generation and saved["generation"] == self._generation:
+            if saved["labels"]:
+                delta_labels = np.array([label for label, _ in saved["labels"]], dtype="int64")
+                delta.add_with_ids(np.array(saved["vectors"], dtype="float32").reshape(-1, self.dim), delta_labels)
+                labels.update((int(label), doc_id) for label, doc_id in saved["labels"])
+            tombstones = frozenset(saved["tombstones"])
+        return main, labels, delta, tombstones
+
+    def _load_or_build(self):
+        """(main, labels, whether they match the snapshot file[, delta, tombstones])."""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            try:
+                main, labels, delta, tombstones = self._read_snapshot()
+                print(
+                    f"[INDEX DEBUG] Loaded index snapshot from {self.snapshot_path} "
+                    f"({main.ntotal} vectors, {delta.ntotal} in delta, {len(tombstones)} deleted)"
+                )
+                return main, labels, True, delta, tombstones
+            except Exception as e:
+                print(f"[INDEX DEBUG] Failed to load snapshot {self.snapshot_path}: {e}")
+        main, labels = self._build()
+        print(f"[INDEX DEBUG] Built index ({main.ntotal} vectors)")
+        if self.snapshot_path:
+            try:
+                self._write_snapshot(main, labels)
+                return main, labels, True
+            except Exception as e:
+                print(f"[INDEX DEBUG] Failed to write snapshot {self.snapshot_path}: {e}")
+        return main, labels, False
@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import uuid
+from itertools import islice
+from sqlalchemy import insert
+from database import SessionLocal
+from models import Document
+
+DEFAULT_BATCH_SIZE = 500
+EMBEDDING_STORAGE_DTYPE = os.environ.get("EMBEDDING_STORAGE_DTYPE", "float32")
+DEFAULT_COLLECTION = "default"
+# Collection names end up in index snapshot file names
+COLLECTION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class IngestError(ValueError):
+    def __init__(self, message, counts=None):
+        super().__init__(message)
+        self.counts = counts
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_ndjson(lines, collection=DEFAULT_COLLECTION):
+    """Parse NDJSON lines into ``{"id", "text", "collection"}`` records, one at a time.
+
+    ``id`` is optional and defaults to a fresh UUID; ``collection`` defaults
+    to the one given here.
+    """
+    for line_no, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise IngestError(f"Line {line_no}: invalid JSON ({e.msg})")
+        if not isinstance(record, dict) or not isinstance(record.get("text"), str) or not record["text"]:
+            raise IngestError(f"Line {line_no}: expected an object with a non-empty 'text' field")
+        record_collection = record.get("collection") or collection
+        if not isinstance(record_collection, str) or not COLLECTION_NAME.match(record_collection):
+            raise IngestError(f"Line {line_no}: collection must match {COLLECTION_NAME.pattern}")
+        yield {"id": str(record.get("id") or uuid.uuid4()), "text": record["text"], "collection": record_collection}
+
+
+def ingest_documents(db, records, batch_size=DEFAULT_BATCH_SIZE):
+    """Embed, store and index ``records`` batch by batch.
+
+    Each batch is embedded as one matrix, written with a single multi-row
+    INSERT and committed before being added to the live index, so memory
+    stays bounded by ``batch_size`` whatever the size of the input. Ids that
+    are already stored or indexed are skipped; use ``update_document`` to
+    change an existing one.
+    """
+    from embedding_codec import encode_embedding
+    from vector_search_demo import embed_batch, index_manager, document_store
+
+    counts = {"inserted": 0, "skipped": 0}
+    try:
+        for batch in batched(records, batch_size):
+            unique = {}
+            for record in batch:
+                unique.setdefault(record["id"], record)
+            stored = {
+                row.id for row in db.query(Document.id).filter(Document.id.in_(list(unique)))
+            }
+            new_docs = [
+                record for doc_id, record in unique.items()
+                if doc_id not in stored and doc_id not in index_manager
+            ]
+            counts["skipped"] += len(batch) - len(new_docs)
+            if not new_docs:
+                continue
+            vectors = embed_batch([doc["text"] for doc in new_docs], dim=8)
+            db.execute(
+                insert(Document),
+                [
+                    {
+                        "id": doc["id"],
+                        "text": doc["text"],
+                        "embedding": encode_embedding(vector, EMBEDDING_STORAGE_DTYPE),
+                        "embedding_dtype": EMBEDDING_STORAGE_DTYPE,
+                        "collection": doc.get("collection", DEFAULT_COLLECTION),
+                    }
+                    for doc, vector in zip(new_docs, vectors)
+                ],
+            )
+            db.commit()
+            by_collection = {}
+            for row, doc in enumerate(new_docs):
+                by_collection.setdefault(doc.get("collection", DEFAULT_COLLECTION), []).append(row)
+            for collection, rows in by_collection.items():
+                index_manager.add([new_docs[row]["id"] for row in rows], vectors[rows], collection=collection)
+            document_store.add(new_docs)
+            counts["inserted"] += len(new_docs)
+    except IngestError as e:
+        e.counts = counts
+        raise
+    finally:
+        if counts["inserted"] and index_manager.snapshot_path:
+            index_manager.save(dirty_only=True)
+    return counts
+
+
+def update_document(db, doc_id, text):
+    """Replace a stored document's text and re-index it. Returns False if it does not exist."""
+    from embedding_codec import encode_embedding
+    from vector_search_demo import embed_batch, index_manager, document_store
+
+    document = db.query(Document).filter(Document.id == doc_id).first()
+    if not document:
+        return False
+    vectors = embed_batch([text], dim=8)
+    document.text = text
+    document.embedding = encode_embedding(vectors[0], EMBEDDING_STORAGE_DTYPE)
+    document.embedding_dtype = EMBEDDING_STORAGE_DTYPE
+    db.commit()
+    index_manager.update([doc_id], vectors, collection=document.collection)
+    document_store.discard([doc_id])
+    # Otherwise the next process to load the snapshot gets the old vector back
+    if index_manager.snapshot_path:
+        index_manager.save(dirty_only=True)
+    return True
+
+
+def delete_documents(db, doc_ids):
+    """Delete stored documents and tombstone them in the live index. Returns the number deleted."""
+    from vector_search_demo import index_manager, document_store
+
+    # Seed documents and unknown ids have no row and must stay searchable
+    existing = [doc_id for (doc_id,) in db.query(Document.id).filter(Document.id.in_(doc_ids))]
+    if not existing:
+        return 0
+    deleted = db.query(Document).filter(Document.id.in_(existing)).delete(synchronize_session=False)
+    db.commit()
+    index_manager.delete(existing)
+    document_store.discard(existing)
+    # Otherwise the next process to load the snapshot gets the deleted vectors back
+    if index_manager.snapshot_path:
+        index_manager.save(dirty_only=True)
+    return deleted
+
+
+def stored_collections():
+    db = SessionLocal()
+    try:
+        return [collection for (collection,) in db.query(Document.collection).distinct()]
+    finally:
+        db.close()
+
+
+def iter_stored_texts(batch_size=DEFAULT_BATCH_SIZE):
+    """Stream ``(doc_id, text)`` for every stored Document."""
+    db = SessionLocal()
+    try:
+        yield from db.query(Document.id, Document.text).yield_per(batch_size)
+    finally:
+        db.close()
+
+
+def iter_stored_embeddings(batch_size=DEFAULT_BATCH_SIZE, collection=None):
+    """Stream ``(doc_ids, float32 matrix)`` batches of stored Document embeddings."""
+    import numpy as np
+    from embedding_codec import decode_embedding
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Document.id, Document.embedding, Document.embedding_dtype)
+        if collection is not None:
+            rows = rows.filter(Document.collection == collection)
+        rows = rows.yield_per(batch_size)
+        for batch in batched(rows, batch_size):
+            yield [row.id for row in batch], np.vstack(
+                [decode_embedding(row.embedding, row.embedding_dtype) for row in batch]
+            )
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Bulk-load NDJSON documents into the documents table and index")
+    parser.add_argument("path", help="NDJSON file with one {\"id\", \"text\"} object per line, or - for stdin")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--collection", default=DEFAULT_COLLECTION, help="Collection for lines that do not name one")
+    args = parser.parse_args()
+
+    from database import init_schema
+
+    init_schema()
+    source = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+    db = SessionLocal()
+    try:
+        counts = ingest_documents(db, iter_ndjson(source, args.collection), args.batch_size)
+    except IngestError as e:
+        print(f"Error: {e} (inserted {e.counts['inserted']}, skipped {e.counts['skipped']})")
+        sys.exit(1)
+    finally:
+        db.close()
+        source.close()
+    print(f"Inserted {counts['inserted']} documents, skipped {counts['skipped']}")
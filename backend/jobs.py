@@ -0,0 +1,303 @@
+"""Background jobs without an external broker.
+
+Every job is a row in the ``jobs`` table, so any process can report its
+status. ``JobQueue`` runs jobs on a small pool of worker threads:
+
+* ``memory`` backend: each process keeps a priority heap of the jobs it
+  accepted. Jobs still queued when the process exits are not picked up again.
+* ``database`` backend: workers claim the next queued row from the table,
+  so all processes share one queue and queued jobs survive restarts.
+
+A running job holds a lease of ``lease_seconds``, renewed while it runs.
+When a worker dies mid-job its lease expires: the ``database`` backend
+queues the job again (so a job may run more than once), and the
+``memory`` backend, which cannot recover the payload's owner, marks it
+failed when a process starts.
+
+Lower priority values run first (see ``PRIORITIES``). ``submit`` raises
+``QueueFull`` once ``maxsize`` jobs are waiting. Handlers are registered per
+job kind with ``@handler(kind)``, take the JSON payload and return a
+JSON-serializable result; they run outside any request context.
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+PRIORITIES = {"interactive": 0, "normal": 5, "batch": 9}
+
+_handlers = {}
+
+
+class QueueFull(Exception):
+    pass
+
+
+def handler(kind):
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def job_status(job):
+    """Public JSON form of a Job row."""
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "priority": job.priority,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result": json.loads(job.result_json) if job.result_json else None,
+        "error": job.error,
+    }
+
+
+class JobQueue:
+    def __init__(self, backend="memory", workers=2, maxsize=1000, poll_interval=0.5, lease_seconds=60):
+        if backend not in ("memory", "database"):
+            raise ValueError(f"Unknown job queue backend: {backend}")
+        self.backend = backend
+        self.workers = workers
+        self.maxsize = maxsize
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._heap = []
+        self._reserved = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            if self.backend == "memory":
+                self._fail_expired()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind, payload, priority=PRIORITIES["normal"]):
+        """Queue a job and return its id; raises QueueFull when the queue is at ``maxsize``."""
+        from database import SessionLocal
+        from models import Job
+
+        if kind not in _handlers:
+            raise ValueError(f"No handler for job kind: {kind}")
+        self.start()
+        job_id = str(uuid.uuid4())
+
+        if self.backend == "memory":
+            with self._cond:
+                if len(self._heap) + self._reserved >= self.maxsize:
+                    raise QueueFull()
+                self._reserved += 1
+
+        db = SessionLocal()
+        try:
+            if self.backend == "database" and self.depth(db) >= self.maxsize:
+                raise QueueFull()
+            db.add(Job(id=job_id, kind=kind, status="queued", priority=priority,
+                       payload_json=json.dumps(payload), created_at=datetime.utcnow()))
+            db.commit()
+        except BaseException:
+            if self.backend == "memory":
+                with self._cond:
+                    self._reserved -= 1
+            raise
+        finally:
+            db.close()
+
+        with self._cond:
+            if self.backend == "memory":
+                self._reserved -= 1
+                heapq.heappush(self._heap, (priority, next(self._seq), job_id, kind, payload))
+            self._cond.notify()
+        return job_id
+
+    def depth(self, db=None):
+        """Number of queued jobs (this process's heap for the memory backend)."""
+        if self.backend == "memory":
+            return len(self._heap)
+        from database import SessionLocal
+        from models import Job
+
+        session = db or SessionLocal()
+        try:
+            return session.query(Job).filter(Job.status == "queued").count()
+        finally:
+            if db is None:
+                session.close()
+
+    def stats(self):
+        try:
+            queued = self.depth()
+        except Exception as e:
+            print(f"[JOBS DEBUG] Counting queued jobs failed: {e}")
+            queued = None
+        return {
+            "backend": self.backend,
+            "workers": self.workers,
+            "maxsize": self.maxsize,
+            "queued": queued,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def _work(self):
+        while True:
+            job_id, kind, payload = self._next()
+            self._run(job_id, kind, payload)
+
+    def _next(self):
+        if self.backend == "memory":
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job_id, kind, payload = heapq.heappop(self._heap)
+            self._mark_running(job_id)
+            return job_id, kind, payload
+        while True:
+            claimed = self._claim()
+            if claimed:
+                return claimed
+            with self._cond:
+                self._cond.wait(self.poll_interval)
+
+    def _lease_end(self):
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+    def _claimable(self, now):
+        from sqlalchemy import and_, or_
+        from models import Job
+
+        return or_(
+            Job.status == "queued",
+            and_(Job.status == "running", or_(
+                Job.lease_until < now,
+                # Claimed before leases existed
+                and_(Job.lease_until.is_(None), Job.started_at < now - timedelta(seconds=self.lease_seconds)),
+            )),
+        )
+
+    def _claim(self):
+        """Claim the next queued or abandoned row; None if there is none (or another process won)."""
+        from database import SessionLocal
+        from models import Job
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            candidates = (
+                db.query(Job.id, Job.kind, Job.payload_json, Job.status)
+                .filter(self._claimable(now))
+                .order_by(Job.priority, Job.created_at)
+                .limit(self.workers)
+                .all()
+            )
+            for job_id, kind, payload_json, status in candidates:
+                # Conditional update: only one worker across processes gets the row
+                claimed = db.query(Job).filter(Job.id == job_id, self._claimable(now)).update(
+                    {"status": "running", "started_at": now, "lease_until": self._lease_end()},
+                    synchronize_session=False,
+                )
+                db.commit()
+                if claimed:
+                    if status == "running":
+                        print(f"[JOBS DEBUG] Job {job_id} ({kind}) lost its worker; running it again")
+                    return job_id, kind, json.loads(payload_json)
+            return None
+        except Exception as e:
+            db.rollback()
+            print(f"[JOBS DEBUG] Claiming a job failed: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _fail_expired(self):
+        """Mark running jobs whose worker is gone as failed (memory backend)."""
+        from database import SessionLocal
+        from models import Job
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            failed = db.query(Job).filter(Job.status == "running", self._claimable(now)).update(
+                {"status": "failed", "error": "Worker exited before the job finished", "finished_at": now},
+                synchronize_session=False,
+            )
+            db.commit()
+            if failed:
+                print(f"[JOBS DEBUG] Marked {failed} abandoned jobs as failed")
+        except Exception as e:
+            db.rollback()
+            print(f"[JOBS DEBUG] Checking for abandoned jobs failed: {e}")
+        finally:
+            db.close()
+
+    def _mark_running(self, job_id):
+        self._update(job_id, status="running", started_at=datetime.utcnow(), lease_until=self._lease_end())
+
+    def _renew_lease(self, job_id, done):
+        while not done.wait(self.lease_seconds / 3):
+            self._update(job_id, lease_until=self._lease_end())
+
+    def _run(self, job_id, kind, payload):
+        with self._cond:
+            self.running += 1
+        succeeded = False
+        done = threading.Event()
+        threading.Thread(target=self._renew_lease, args=(job_id, done), name=f"job-lease-{job_id}", daemon=True).start()
+        try:
+            result = _handlers[kind](payload)
+            self._update(job_id, status="succeeded", result_json=json.dumps(result), finished_at=datetime.utcnow())
+            succeeded = True
+        except Exception as e:
+            print(f"[JOBS DEBUG] Job {job_id} ({kind}) failed: {e}")
+            self._update(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+        finally:
+            done.set()
+            with self._cond:
+                self.running -= 1
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _update(self, job_id, **values):
+        from database import SessionLocal
+        from models import Job
+
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(Job.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[JOBS DEBUG] Updating job {job_id} failed: {e}")
+        finally:
+            db.close()
+
+
+def job_queue_from_env():
+    return JobQueue(
+        backend=os.environ.get("JOB_QUEUE_BACKEND", "memory").lower(),
+        workers=int(os.environ.get("JOB_WORKERS", 2)),
+        maxsize=int(os.environ.get("JOB_QUEUE_MAXSIZE", 1000)),
+        poll_interval=float(os.environ.get("JOB_POLL_INTERVAL", 0.5)),
+        lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", 60)),
+    )
+
+
+job_queue = job_queue_from_env()
@@ -1,117 +1,265 @@
+import asyncio
+import json
 import os
+import time
+from answer_stream import AnswerStreamParser
+from answer_cache import AnswerCache, answer_cache_key
+from context_builder import context_builder_from_env
+from llm_gateway import gateway_from_env
+from metrics import llm_errors, llm_parse_fallbacks, prompt_tokens, stage, stage_seconds, timed
 
-try:
-    from openai import OpenAI
-    openai_api_key = os.environ.get("OPENAI_API_KEY")
-    if openai_api_key:
-        client = OpenAI(api_key=openai_api_key)
-    else:
-        client = None
-        print("[LLM DEBUG] No OpenAI API key found")
-except ImportError as e:
-    print(f"[LLM DEBUG] OpenAI import error: {e}")
-    client = None
-except Exception as e:
-    print(f"[LLM DEBUG] OpenAI client initialization error: {e}")
-    client = None
+# One pooled client per process; None falls back to mock answers
+gateway = gateway_from_env()
 
-def build_prompt(context, question):
-    return f"""CONTEXT:
-{context}
+# Bump whenever SYSTEM_PROMPT, build_prompt or the cache key changes so cached
+# answers are not reused (and rows under the old version get pruned)
+PROMPT_VERSION = "3"
+# Everything that does not vary per request goes first, in the system
+# message, so providers that cache identical prompt prefixes can reuse it
+SYSTEM_PROMPT = """You are an insights assistant. Always respond with valid JSON in the exact format requested. Do not include any text before or after the JSON object.
 
-QUESTION: {question}
-
-Please analyze the context and provide insights about the question. Format your response as a valid JSON object with this exact structure:
-{{
+Analyze the CONTEXT and provide insights about the QUESTION. Format your response as a valid JSON object with this exact structure:
+{
   "summary": ["key insight 1", "key insight 2"],
   "facts": ["fact 1 with source citation", "fact 2 with source citation"]
-}}
+}
 
 IMPORTANT: When citing sources, use the exact format [Source: doc_id] (not parentheses).
 
 Only use information from the provided context. If the answer is not found in the context, return:
-{{
+{
   "summary": ["Insufficient information available"],
   "facts": ["No relevant facts found in the provided context"]
-}}"""
+}"""
+
+PARSE_ERROR_ANSWER = {
+    "summary": ["Error parsing LLM response"],
+    "facts": ["The AI response could not be properly formatted"]
+}
+
+# USD per 1K tokens, used to estimate the spend the answer cache saves
+LLM_INPUT_COST_PER_1K = float(os.environ.get("LLM_INPUT_COST_PER_1K", 0.00015))
+LLM_OUTPUT_COST_PER_1K = float(os.environ.get("LLM_OUTPUT_COST_PER_1K", 0.0006))
+
+context_builder = context_builder_from_env()
+
+answer_cache = AnswerCache(
+    maxsize=int(os.environ.get("ANSWER_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 3600)) or None,
+    persistent=os.environ.get("ANSWER_CACHE_PERSISTENT", "true").lower() == "true",
+    db_ttl=float(os.environ.get("ANSWER_CACHE_DB_TTL", 0)) or None,
+    prune_interval=float(os.environ.get("ANSWER_CACHE_PRUNE_INTERVAL", 300)),
+)
+
+def build_prompt(context, question):
+    return f"""CONTEXT:
+{context}
 
-def format_context(context_docs):
-    return '\n'.join([f"{i+1}. {doc['id']}: {doc['text']}" for i, doc in enumerate(context_docs)])
+QUESTION: {question}"""
 
-def get_llm_answer(context_docs, question):
-    context = format_context(context_docs)
+def format_context(context_docs, question):
+    """Token-budgeted CONTEXT block, see context_builder."""
+    context = context_builder.build(context_docs, question)
+    prompt_tokens.observe(context.tokens)
+    return context.text
+
+def select_context_docs(context_docs, question):
+    """The documents that fit the context budget, in rank order."""
+    used = set(context_builder.build(context_docs, question).doc_ids)
+    return [doc for doc in context_docs if doc['id'] in used]
+
+@timed("prompt_build")
+def build_messages(context_docs, question):
+    context = format_context(context_docs, question)
     prompt = build_prompt(context, question)
     print("[LLM DEBUG] Context Docs:", context_docs)
     print("[LLM DEBUG] Prompt:", prompt)
-    if client and openai_api_key:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+@timed("parse")
+def parse_answer(content):
+    # A refusal or tool call can arrive with no text content
+    content = (content or "").strip()
+    print("[LLM DEBUG] Raw content:", content)
+    try:
+        # Try to parse the entire content as JSON first
+        answer_json = json.loads(content)
+        print("[LLM DEBUG] Parsed LLM answer:", answer_json)
+        return answer_json
+    except json.JSONDecodeError:
+        # If that fails, try to extract JSON from the content
         try:
-            print("[LLM DEBUG] Using OpenAI model: gpt-4o-mini")
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": "You are an insights assistant. Always respond with valid JSON in the exact format requested. Do not include any text before or after the JSON object."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=400,
-                temperature=0.1,
-            )
-            print("[LLM DEBUG] Raw OpenAI response:", response)
-            content = response.choices[0].message.content.strip()
-            print("[LLM DEBUG] Raw content:", content)
-            
-            import json
-            try:
-                # Try to parse the entire content as JSON first
-                answer_json = json.loads(content)
-                print("[LLM DEBUG] Parsed LLM answer:", answer_json)
+            json_start = content.find('{')
+            json_end = content.rfind('}') + 1
+            if json_start != -1 and json_end > json_start:
+                json_str = content[json_start:json_end]
+                answer_json = json.loads(json_str)
+                print("[LLM DEBUG] Extracted and parsed JSON:", answer_json)
+                llm_parse_fallbacks.inc(outcome="extracted")
                 return answer_json
-            except json.JSONDecodeError:
-                # If that fails, try to extract JSON from the content
-                try:
-                    json_start = content.find('{')
-                    json_end = content.rfind('}') + 1
-                    if json_start != -1 and json_end > json_start:
-                        json_str = content[json_start:json_end]
-                        answer_json = json.loads(json_str)
-                        print("[LLM DEBUG] Extracted and parsed JSON:", answer_json)
-                        return answer_json
-                    else:
-                        raise ValueError("No JSON found in response")
-                except Exception as parse_exc:
-                    print("[LLM DEBUG] JSON parse error:", parse_exc)
-                    print("[LLM DEBUG] Content that failed to parse:", content)
-                    return {
-                        "summary": ["Error parsing LLM response"],
-                        "facts": ["The AI response could not be properly formatted"]
-                    }
-        except Exception as e:
-            print("[LLM DEBUG] OpenAI call error:", e)
-            return {"summary": [f"Error: {str(e)}"], "facts": ["Insufficient information."]}
+            else:
+                raise ValueError("No JSON found in response")
+        except Exception as parse_exc:
+            print("[LLM DEBUG] JSON parse error:", parse_exc)
+            llm_parse_fallbacks.inc(outcome="failed")
+            print("[LLM DEBUG] Content that failed to parse:", content)
+            return dict(PARSE_ERROR_ANSWER)
+
+def estimate_cost(usage):
+    if usage is None:
+        return 0.0
+    return (
+        (usage.prompt_tokens or 0) * LLM_INPUT_COST_PER_1K
+        + (usage.completion_tokens or 0) * LLM_OUTPUT_COST_PER_1K
+    ) / 1000
+
+def cache_key(context_docs, question):
+    return answer_cache_key(question, context_docs, gateway.model, PROMPT_VERSION)
+
+def cache_answer(key, usage, answer_json):
+    # Parse failures are not cached so the next ask gets another chance
+    if answer_json != PARSE_ERROR_ANSWER:
+        answer_cache.set(key, answer_json, gateway.model, PROMPT_VERSION, estimate_cost(usage))
+
+def get_llm_answer(context_docs, question, deadline=None, bypass_cache=False):
+    """Answer ``question`` from ``context_docs``.
+
+    Answers are cached on the question, the ordered docs and their text,
+    the model and PROMPT_VERSION; ``bypass_cache`` forces a fresh call (and
+    refreshes the cached entry), which is what /revalidate uses.
+    """
+    messages = build_messages(context_docs, question)
+    if gateway is None:
+        return mock_answer(question)
+    key = cache_key(context_docs, question)
+    if not bypass_cache:
+        with stage("answer_cache"):
+            cached = answer_cache.get(key)
+        if cached is not None:
+            print("[LLM DEBUG] Answer cache hit")
+            return cached
+    try:
+        print(f"[LLM DEBUG] Using OpenAI model: {gateway.model}")
+        with stage("llm_call"):
+            response = gateway.chat(messages, deadline=deadline, max_tokens=400, temperature=0.1)
+        answer_json = parse_answer(response.choices[0].message.content)
+    # Besides LLMError, an unexpected response shape must not fail the request
+    except Exception as e:
+        print("[LLM DEBUG] OpenAI call error:", e)
+        llm_errors.inc()
+        return {"summary": [f"Error: {str(e)}"], "facts": ["Insufficient information."]}
+    cache_answer(key, response.usage, answer_json)
+    return answer_json
+
+async def get_llm_answer_async(context_docs, question, deadline=None, bypass_cache=False):
+    """Async variant of get_llm_answer for callers running an event loop."""
+    messages = build_messages(context_docs, question)
+    if gateway is None:
+        return mock_answer(question)
+    key = cache_key(context_docs, question)
+    if not bypass_cache:
+        # The persistent tier does blocking DB I/O
+        with stage("answer_cache"):
+            cached = await asyncio.to_thread(answer_cache.get, key)
+        if cached is not None:
+            print("[LLM DEBUG] Answer cache hit")
+            return cached
+    try:
+        print(f"[LLM DEBUG] Using OpenAI model: {gateway.model}")
+        with stage("llm_call"):
+            response = await gateway.achat(messages, deadline=deadline, max_tokens=400, temperature=0.1)
+        answer_json = parse_answer(response.choices[0].message.content)
+    except Exception as e:
+        print("[LLM DEBUG] OpenAI call error:", e)
+        llm_errors.inc()
+        return {"summary": [f"Error: {str(e)}"], "facts": ["Insufficient information."]}
+    await asyncio.to_thread(cache_answer, key, response.usage, answer_json)
+    return answer_json
+
+def stream_llm_answer(context_docs, question, deadline=None, bypass_cache=False):
+    """Streaming variant of get_llm_answer.
+
+    Yields ``(field, item)`` for each ``summary``/``facts`` item as soon as
+    the model has finished writing it, then ``("answer", answer_json)``
+    with the fully parsed answer. Cached and mock answers are replayed
+    through the same events.
+    """
+    messages = build_messages(context_docs, question)
+    if gateway is None:
+        yield from replay_answer(mock_answer(question))
+        return
+    key = cache_key(context_docs, question)
+    if not bypass_cache:
+        with stage("answer_cache"):
+            cached = answer_cache.get(key)
+        if cached is not None:
+            print("[LLM DEBUG] Answer cache hit")
+            yield from replay_answer(cached)
+            return
+    parser = AnswerStreamParser()
+    content = []
+    usage = None
+    start = time.perf_counter()
+    try:
+        print(f"[LLM DEBUG] Streaming from OpenAI model: {gateway.model}")
+        for chunk in gateway.stream_chat(
+            messages,
+            deadline=deadline,
+            max_tokens=400,
+            temperature=0.1,
+            stream_options={"include_usage": True},
+        ):
+            usage = chunk.usage or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                if not content:
+                    stage_seconds.observe(time.perf_counter() - start, stage="llm_first_token")
+                content.append(delta)
+                yield from parser.feed(delta)
+        stage_seconds.observe(time.perf_counter() - start, stage="llm_stream")
+    except Exception as e:
+        print("[LLM DEBUG] OpenAI stream error:", e)
+        llm_errors.inc()
+        yield "answer", {"summary": [f"Error: {str(e)}"], "facts": ["Insufficient information."]}
+        return
+    answer_json = parse_answer("".join(content))
+    cache_answer(key, usage, answer_json)
+    yield "answer", answer_json
+
+def replay_answer(answer_json):
+    for field in ("summary", "facts"):
+        for item in answer_json.get(field, []):
+            yield field, item
+    yield "answer", answer_json
+
+def mock_answer(question):
+    print("[LLM DEBUG] Using mock answer (no OpenAI or API key)")
+    # Check if the query is about Tesla and provide relevant mock data
+    if "tesla" in question.lower() or "telsa" in question.lower():
+        return {
+            "summary": [
+                "Tesla faces supply chain challenges in 2024",
+                "Battery supply shortages are affecting production",
+                "Regulatory issues may impact product launches"
+            ],
+            "facts": [
+                "Tesla faces battery supply shortages in Q1 2024. [Source: doc_01]",
+                "Cybertruck production delayed due to regulatory issues. [Source: doc_02]"
+            ]
+        }
     else:
-        print("[LLM DEBUG] Using mock answer (no OpenAI or API key)")
-        # Check if the query is about Tesla and provide relevant mock data
-        if "tesla" in question.lower() or "telsa" in question.lower():
-            return {
-                "summary": [
-                    "Tesla faces supply chain challenges in 2024",
-                    "Battery supply shortages are affecting production",
-                    "Regulatory issues may impact product launches"
-                ],
-                "facts": [
-                    "Tesla faces battery supply shortages in Q1 2024. [Source: doc_01]",
-                    "Cybertruck production delayed due to regulatory issues. [Source: doc_02]"
-                ]
-            }
-        else:
-            return {
-                "summary": [
-                    "Based on the available context, here are the key insights",
-                    "Multiple companies are advancing in technology and AI",
-                    "Supply chain and regulatory challenges are common themes"
-                ],
-                "facts": [
-                    "Amazon expands drone delivery service in the US. [Source: doc_08]",
-                    "Adobe introduces AI tools for creative professionals. [Source: doc_19]",
-                    "Zoom adds real-time translation to video calls. [Source: doc_17]"
-                ]
-            } 
\ No newline at end of file
+        return {
+            "summary": [
+                "Based on the available context, here are the key insights",
+                "Multiple companies are advancing in technology and AI",
+                "Supply chain and regulatory challenges are common themes"
+            ],
+            "facts": [
+                "Amazon expands drone delivery service in the US. [Source: doc_08]",
+                "Adobe introduces AI tools for creative professionals. [Source: doc_19]",
+                "Zoom adds real-time translation to video calls. [Source: doc_17]"
+            ]
+        } 
\ No newline at end of file
@@ -0,0 +1,251 @@
+import asyncio
+import importlib.util
+import os
+import random
+import threading
+import time
+from metrics import llm_retries
+
+# The openai SDK takes most of a second to import, so it is only imported
+# when the first client is created (see LLMGateway.client and startup.warm_up)
+openai = None
+
+
+def _import_openai():
+    global openai
+    if openai is None:
+        import openai as module
+        openai = module
+    return openai
+
+
+class LLMError(Exception):
+    """Raised when an LLM call fails after retries or runs past its deadline."""
+
+
+class LLMGateway:
+    """Shared entry point for chat completions.
+
+    One sync and one async client are created lazily per process and reused,
+    so HTTP connections stay pooled and kept alive. Every call gets a
+    deadline covering all of its attempts; 429s, 5xx responses and
+    connection errors are retried with jittered exponential backoff
+    (honouring ``Retry-After``), and a process-wide semaphore caps the number
+    of calls in flight.
+    """
+
+    def __init__(
+        self,
+        api_key,
+        base_url=None,
+        model="gpt-4o-mini",
+        timeout=30.0,
+        max_retries=3,
+        backoff_base=0.5,
+        backoff_max=8.0,
+        max_concurrency=16,
+        max_connections=32,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._client = None
+        self._async_client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = _import_openai().OpenAI(**self._client_kwargs(async_=False))
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            with self._client_lock:
+                if self._async_client is None:
+                    self._async_client = _import_openai().AsyncOpenAI(**self._client_kwargs(async_=True))
+        return self._async_client
+
+    def _client_kwargs(self, async_):
+        # Retries are handled here so they share the call deadline
+        kwargs = {"api_key": self.api_key, "max_retries": 0, "timeout": self.timeout}
+        if self.base_url:
+            kwargs["base_url"] = self.base_url
+        if importlib.util.find_spec("httpx") is not None:
+            import httpx
+
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            )
+            http_client_cls = openai.DefaultAsyncHttpxClient if async_ else openai.DefaultHttpxClient
+            kwargs["http_client"] = http_client_cls(limits=limits, timeout=self.timeout)
+        return kwargs
+
+    def chat(self, messages, deadline=None, **params):
+        """Run a chat completion and return the response object."""
+        deadline_at = time.monotonic() + (deadline or self.timeout * (self.max_retries + 1))
+        if not self._slots.acquire(timeout=self._remaining(deadline_at)):
+            raise LLMError("Timed out waiting for an LLM slot")
+        try:
+            model = params.pop("model", self.model)
+            attempt = 0
+            while True:
+                try:
+                    return self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        timeout=min(self.timeout, self._remaining(deadline_at)),
+                        **params,
+                    )
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, deadline_at)
+                    if delay is None:
+                        raise LLMError(str(e)) from e
+                    print(f"[LLM DEBUG] Retrying in {delay:.2f}s after: {e}")
+                    llm_retries.inc()
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            self._slots.release()
+
+    def stream_chat(self, messages, deadline=None, **params):
+        """Stream a chat completion, yielding response chunks as they arrive.
+
+        Failures before the first delta are retried like ``chat``; once
+        output has started an error is raised as LLMError.
+        """
+        deadline_at = time.monotonic() + (deadline or self.timeout * (self.max_retries + 1))
+        if not self._slots.acquire(timeout=self._remaining(deadline_at)):
+            raise LLMError("Timed out waiting for an LLM slot")
+        try:
+            model = params.pop("model", self.model)
+            attempt = 0
+            while True:
+                try:
+                    stream = self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        timeout=min(self.timeout, self._remaining(deadline_at)),
+                        **params,
+                    )
+                    break
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, deadline_at)
+                    if delay is None:
+                        raise LLMError(str(e)) from e
+                    print(f"[LLM DEBUG] Retrying in {delay:.2f}s after: {e}")
+                    llm_retries.inc()
+                    time.sleep(delay)
+                    attempt += 1
+            try:
+                yield from stream
+            except Exception as e:
+                raise LLMError(str(e)) from e
+            finally:
+                stream.close()
+        finally:
+            self._slots.release()
+
+    async def achat(self, messages, deadline=None, **params):
+        """Async variant of ``chat``; shares the same concurrency cap."""
+        deadline_at = time.monotonic() + (deadline or self.timeout * (self.max_retries + 1))
+        while not self._slots.acquire(blocking=False):
+            if self._remaining(deadline_at) <= 0:
+                raise LLMError("Timed out waiting for an LLM slot")
+            await asyncio.sleep(0.01)
+        try:
+            model = params.pop("model", self.model)
+            attempt = 0
+            while True:
+                try:
+                    return await self.async_client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        timeout=min(self.timeout, self._remaining(deadline_at)),
+                        **params,
+                    )
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, deadline_at)
+                    if delay is None:
+                        raise LLMError(str(e)) from e
+                    print(f"[LLM DEBUG] Retrying in {delay:.2f}s after: {e}")
+                    llm_retries.inc()
+                    await asyncio.sleep(delay)
+                    attempt += 1
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _remaining(deadline_at):
+        return max(deadline_at - time.monotonic(), 0.0)
+
+    def _retry_delay(self, error, attempt, deadline_at):
+        """Seconds to wait before retrying ``error``, or None if it should not be retried."""
+        if attempt >= self.max_retries or not self._is_retryable(error):
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        if delay >= self._remaining(deadline_at):
+            return None
+        return delay
+
+    @staticmethod
+    def _is_retryable(error):
+        if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def gateway_from_env():
+    """Build the process gateway from the environment, or None when no LLM is configured.
+
+    ``LLM_STUB=true`` starts the local stub server (llm_stub_server.py) in a
+    background thread and points the gateway at it, so the real client code
+    path runs without network access or an API key.
+    """
+    if importlib.util.find_spec("openai") is None:
+        print("[LLM DEBUG] OpenAI import error: No module named 'openai'")
+        return None
+    api_key = os.environ.get("OPENAI_API_KEY")
+    base_url = os.environ.get("OPENAI_BASE_URL")
+    if os.environ.get("LLM_STUB", "false").lower() == "true":
+        from llm_stub_server import start_stub_server
+
+        base_url = start_stub_server(
+            latency=float(os.environ.get("LLM_STUB_LATENCY", 0)),
+            token_delay=float(os.environ.get("LLM_STUB_TOKEN_DELAY", 0)),
+        )
+        api_key = api_key or "stub"
+        print(f"[LLM DEBUG] Using stub LLM server at {base_url}")
+    if not api_key:
+        print("[LLM DEBUG] No OpenAI API key found")
+        return None
+    return LLMGateway(
+        api_key=api_key,
+        base_url=base_url,
+        model=os.environ.get("LLM_MODEL", "gpt-4o-mini"),
+        timeout=float(os.environ.get("LLM_TIMEOUT", 30)),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 3)),
+        backoff_base=float(os.environ.get("LLM_BACKOFF_BASE", 0.5)),
+        backoff_max=float(os.environ.get("LLM_BACKOFF_MAX", 8)),
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 16)),
+        max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 32)),
+    )
@@ -0,0 +1,142 @@
+"""Offline stand-in for the OpenAI chat completions endpoint.
+
+Answers ``POST /v1/chat/completions`` with a well-formed insights JSON that
+cites the doc ids found in the prompt (streamed in small chunks when the
+request sets ``stream``), after an optional injected latency and with an
+optional rate of 429/503 failures:
+
+    python llm_stub_server.py --port 8089 --latency 0.8 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub python app.py
+
+or set ``LLM_STUB=true`` to have llm_gateway start one in-process.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DOC_ID_PATTERN = re.compile(r"^\d+\. (\S+):", re.MULTILINE)
+
+
+def stub_answer(messages):
+    prompt = messages[-1]["content"] if messages else ""
+    doc_ids = DOC_ID_PATTERN.findall(prompt)
+    if not doc_ids:
+        return {
+            "summary": ["Insufficient information available"],
+            "facts": ["No relevant facts found in the provided context"],
+        }
+    return {
+        "summary": [f"Stub insight drawn from {doc_id}" for doc_id in doc_ids[:2]],
+        "facts": [f"Stub fact. [Source: {doc_id}]" for doc_id in doc_ids],
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send_json(404, {"error": {"message": "Not found"}})
+        request = json.loads(body or b"{}")
+        time.sleep(self.server.latency)
+        if random.random() < self.server.error_rate:
+            status = random.choice((429, 503))
+            return self._send_json(status, {"error": {"message": "Injected stub failure"}}, {"Retry-After": "0"})
+        messages = request.get("messages", [])
+        content = json.dumps(stub_answer(messages))
+        # Rough 4-characters-per-token estimate so cost accounting has something to count
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            return self._send_stream(request.get("model", "stub"), content, usage if include_usage else None)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _send_stream(self, model, content, usage):
+        """Send ``content`` as chat.completion.chunk events, ~one token per chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk = {"id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+        def send(choices, **extra):
+            event = json.dumps({**chunk, "choices": choices, **extra})
+            self.wfile.write(f"data: {event}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        for start in range(0, len(content), 4):
+            time.sleep(self.server.token_delay)
+            send([{"index": 0, "delta": {"content": content[start:start + 4]}, "finish_reason": None}])
+        send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage:
+            send([], usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, token_delay=0.0):
+    """Serve the stub from a daemon thread and return its OpenAI-style base URL."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.token_delay = token_delay
+    server.error_rate = error_rate
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return f"http://{host}:{server.server_port}/v1"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered 429/503")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.daemon_threads = True
+    server.latency = args.latency
+    server.token_delay = args.token_delay
+    server.error_rate = args.error_rate
+    print(f"Stub LLM listening on http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,203 @@
+"""In-process metrics with Prometheus text exposition.
+
+Counters and histograms are plain objects registered at import time and
+rendered by ``render()`` for the ``/metrics`` endpoint. Histograms keep the
+usual cumulative buckets (aggregate across workers with
+``histogram_quantile``) plus a window of recent observations from which
+p50/p95/p99 are exported directly. Each worker process keeps its own
+values.
+"""
+import functools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import g, has_request_context
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_WINDOW = int(os.environ.get("METRICS_WINDOW", 1024))
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_label_str(labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    "counts": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                    "recent": deque(maxlen=METRICS_WINDOW),
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+            series["recent"].append(value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        import numpy as np
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        quantile_lines = []
+        with self._lock:
+            items = [
+                (labels, list(s["counts"]), s["sum"], s["count"], list(s["recent"]))
+                for labels, s in self._series.items()
+            ]
+        for labels, counts, total, count, recent in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_label_str(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_label_str(labels)} {total!r}")
+            lines.append(f"{self.name}_count{_label_str(labels)} {count}")
+            if recent:
+                for q, value in zip(QUANTILES, np.quantile(recent, QUANTILES).tolist()):
+                    quantile_lines.append(f"{self.name}_recent{_label_str(labels, [('quantile', q)])} {value!r}")
+        if quantile_lines:
+            lines += [
+                f"# HELP {self.name}_recent Quantiles over the last {METRICS_WINDOW} observations",
+                f"# TYPE {self.name}_recent gauge",
+            ] + quantile_lines
+        return lines
+
+
+class Collector:
+    """Metric whose samples are read from ``collect()`` at scrape time.
+
+    ``collect`` returns ``{((label, value), ...): sample}``; used to export
+    counters and gauges other modules already keep (cache stats, pool size).
+    """
+
+    def __init__(self, name, help, type, collect):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.collect = collect
+        _registry.append(self)
+
+    def render(self):
+        try:
+            samples = self.collect()
+        except Exception as e:
+            print(f"[METRICS DEBUG] Collecting {self.name} failed: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in samples.items():
+            lines.append(f"{self.name}{_label_str(labels)} {_format_value(value)}")
+        return lines
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+stage_seconds = Histogram("genai_stage_duration_seconds", "Time spent in each stage of request handling")
+request_seconds = Histogram("genai_request_duration_seconds", "HTTP request latency by endpoint")
+prompt_tokens = Histogram(
+    "genai_prompt_context_tokens", "Estimated tokens in the CONTEXT block of each prompt",
+    buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192),
+)
+shard_timeouts = Counter("genai_index_shard_timeouts_total", "Shard searches abandoned at SHARD_SEARCH_TIMEOUT, by shard")
+llm_errors = Counter("genai_llm_errors_total", "LLM calls that failed after retries")
+llm_retries = Counter("genai_llm_retries_total", "LLM call attempts that were retried")
+llm_shed = Counter("genai_llm_shed_total", "Requests refused by LLM admission control, by reason")
+rate_limited = Counter("genai_rate_limited_total", "Requests refused by the per-user rate limiter, by endpoint")
+llm_parse_fallbacks = Counter("genai_llm_parse_fallbacks_total", "LLM outputs that were not plain JSON, by outcome")
+
+
+@contextmanager
+def stage(name):
+    """Time a stage into ``stage_seconds`` and the request's Server-Timing header."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=name)
+        if has_request_context():
+            timings = g.setdefault("stage_timings", {})
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """Decorator form of ``stage``."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing_header():
+    timings = g.get("stage_timings") if has_request_context() else None
+    if not timings:
+        return None
+    return ", ".join(f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in timings.items())
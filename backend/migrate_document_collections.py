@@ -0,0 +1,48 @@
+"""One-off migration adding ``documents.collection`` and its index.
+
+Databases created before collections existed get the column with a
+``'default'`` server default, so every existing document lands in the
+default collection. Safe to re-run:
+
+    python migrate_document_collections.py [--dry-run]
+
+Index snapshots written before the migration stay valid: the single shard
+of the default collection keeps the ``FAISS_INDEX_PATH`` file name. Rebuild
+them (``python vector_search_demo.py --rebuild``) after changing
+``INDEX_SHARDS``.
+"""
+import argparse
+from sqlalchemy import inspect, text
+from database import engine
+from models import Document
+
+
+def add_collection_column():
+    columns = {column["name"] for column in inspect(engine).get_columns("documents")}
+    if "collection" in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN collection VARCHAR(64) NOT NULL DEFAULT 'default'"))
+    return True
+
+
+def migrate(dry_run=False):
+    if dry_run:
+        column_added = "collection" not in {c["name"] for c in inspect(engine).get_columns("documents")}
+    else:
+        column_added = add_collection_column()
+    existing = {index["name"] for index in inspect(engine).get_indexes("documents")}
+    missing = [index for index in Document.__table__.indexes if index.name not in existing]
+    if not dry_run:
+        for index in missing:
+            index.create(engine)
+    return {"column_added": column_added, "indexes": [index.name for index in missing]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    counts = migrate(args.dry_run)
+    print(f"Added column: {counts['column_added']}, created indexes: {', '.join(counts['indexes']) or 'none'}")
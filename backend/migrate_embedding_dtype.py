@@ -0,0 +1,114 @@
+"""One-off migration to a binary ``documents.embedding`` plus ``embedding_dtype``.
+
+Adds ``embedding_dtype`` with a ``'float32'`` server default, so existing
+binary rows decode as raw float32. Databases created before bulk ingestion
+also stored ``embedding`` as text: on PostgreSQL the column becomes
+``BYTEA`` (SQLite keeps its declared type, as its columns hold blobs
+whatever they are declared as). Text embeddings holding a JSON array of
+``EMBEDDING_DIM`` numbers are re-encoded as float32 bytes; any others are
+re-embedded from the document text. Safe to re-run:
+
+    python migrate_embedding_dtype.py [--dry-run]
+"""
+import argparse
+import json
+from sqlalchemy import LargeBinary, bindparam, inspect, text
+from database import engine
+from embedding_codec import encode_embedding
+
+# Dimension ingest.py embeds documents with
+EMBEDDING_DIM = 8
+
+
+def _columns():
+    return {column["name"]: column for column in inspect(engine).get_columns("documents")}
+
+
+def add_embedding_dtype_column():
+    if "embedding_dtype" in _columns():
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE documents ADD COLUMN embedding_dtype VARCHAR(16) NOT NULL DEFAULT 'float32'"))
+    return True
+
+
+def _text_embeddings(conn, is_sqlite):
+    if is_sqlite:
+        return conn.execute(text(
+            "SELECT id, text, embedding FROM documents WHERE typeof(embedding) = 'text'"
+        ))
+    # Every row still holds its old text (as bytes once the type has changed)
+    return conn.execute(text("SELECT id, text, embedding FROM documents"))
+
+
+def _parse_vector(value):
+    if isinstance(value, (bytes, memoryview)):
+        value = bytes(value).decode("utf-8", errors="replace")
+    try:
+        vector = json.loads(value)
+    except ValueError:
+        return None
+    if (
+        not isinstance(vector, list)
+        or len(vector) != EMBEDDING_DIM
+        or not all(isinstance(x, (int, float)) for x in vector)
+    ):
+        return None
+    return vector
+
+
+def make_embedding_binary(dry_run=False):
+    """Convert a text ``embedding`` column and its rows. Returns ``(column_changed, counts)``."""
+    counts = {"converted": 0, "reembedded": 0}
+    is_sqlite = engine.dialect.name == "sqlite"
+    binary = isinstance(_columns()["embedding"]["type"], LargeBinary)
+    if binary and not is_sqlite:
+        return False, counts
+    with engine.begin() as conn:
+        if not is_sqlite and not dry_run:
+            conn.execute(text(
+                "ALTER TABLE documents ALTER COLUMN embedding TYPE BYTEA USING convert_to(embedding, 'UTF8')"
+            ))
+        update = text(
+            "UPDATE documents SET embedding = :embedding, embedding_dtype = 'float32' WHERE id = :id"
+        ).bindparams(bindparam("embedding", type_=LargeBinary))
+        stale = []
+        for doc_id, doc_text, value in _text_embeddings(conn, is_sqlite).all():
+            vector = _parse_vector(value)
+            if vector is None:
+                stale.append((doc_id, doc_text))
+                continue
+            if not dry_run:
+                conn.execute(update, {"id": doc_id, "embedding": encode_embedding(vector, "float32")})
+            counts["converted"] += 1
+        if stale and not dry_run:
+            from vector_search_demo import embed_batch
+
+            vectors = embed_batch([doc_text for _, doc_text in stale], dim=EMBEDDING_DIM)
+            conn.execute(update, [
+                {"id": doc_id, "embedding": encode_embedding(vector, "float32")}
+                for (doc_id, _), vector in zip(stale, vectors)
+            ])
+        counts["reembedded"] = len(stale)
+    return not binary and not is_sqlite, counts
+
+
+def migrate(dry_run=False):
+    if dry_run:
+        column_added = "embedding_dtype" not in _columns()
+    else:
+        column_added = add_embedding_dtype_column()
+    column_changed, counts = make_embedding_binary(dry_run)
+    return {"column_added": column_added, "column_changed": column_changed, **counts}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    counts = migrate(args.dry_run)
+    print(
+        f"Added embedding_dtype: {counts['column_added']}, made embedding binary: {counts['column_changed']}, "
+        f"converted {counts['converted']} text embeddings, re-embedded {counts['reembedded']}"
+    )
@@ -0,0 +1,57 @@
+"""One-off migration adding the unique (user_id, response_id) feedback index.
+
+Databases created before /feedback became a native upsert can hold more
+than one feedback row per user and response. This keeps the most recent
+row of each pair, deletes the rest, and then creates the indexes the upsert
+and /feedback/aggregate rely on. Safe to re-run:
+
+    python migrate_feedback_unique.py [--dry-run]
+"""
+import argparse
+from sqlalchemy import inspect
+from database import SessionLocal, engine
+from models import Feedback
+
+
+def duplicate_feedback_ids(db):
+    """Ids of every feedback row that is not the newest for its (user_id, response_id)."""
+    rows = (
+        db.query(Feedback.id, Feedback.user_id, Feedback.response_id)
+        .order_by(Feedback.user_id, Feedback.response_id, Feedback.created_at.desc(), Feedback.id.desc())
+    )
+    seen = set()
+    duplicates = []
+    for feedback_id, user_id, response_id in rows:
+        if (user_id, response_id) in seen:
+            duplicates.append(feedback_id)
+        else:
+            seen.add((user_id, response_id))
+    return duplicates
+
+
+def migrate(dry_run=False):
+    db = SessionLocal()
+    try:
+        duplicates = duplicate_feedback_ids(db)
+        if not dry_run:
+            for start in range(0, len(duplicates), 1000):
+                db.query(Feedback).filter(Feedback.id.in_(duplicates[start:start + 1000])).delete(synchronize_session=False)
+            db.commit()
+    finally:
+        db.close()
+
+    existing = {index["name"] for index in inspect(engine).get_indexes("feedback")}
+    missing = sorted((index for index in Feedback.__table__.indexes if index.name not in existing), key=lambda index: index.name)
+    if not dry_run:
+        for index in missing:
+            index.create(engine)
+    return len(duplicates), [index.name for index in missing]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    removed, created = migrate(args.dry_run)
+    print(f"Removed {removed} duplicate feedback rows, created indexes: {', '.join(created) or 'none'}")
@@ -0,0 +1,33 @@
+"""One-off migration adding ``jobs.lease_until``.
+
+Job tables created before leases existed get the nullable column. Jobs
+already running keep a NULL lease and count as abandoned once they started
+more than ``JOB_LEASE_SECONDS`` ago. Safe to re-run:
+
+    python migrate_job_lease.py [--dry-run]
+"""
+import argparse
+from sqlalchemy import inspect, text
+from database import engine
+
+
+def add_lease_column(dry_run=False):
+    inspector = inspect(engine)
+    if "jobs" not in inspector.get_table_names():
+        # Created with the column at app startup
+        return False
+    if "lease_until" in {column["name"] for column in inspector.get_columns("jobs")}:
+        return False
+    if not dry_run:
+        timestamp = "DATETIME" if engine.dialect.name == "sqlite" else "TIMESTAMP"
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE jobs ADD COLUMN lease_until {timestamp}"))
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    print(f"Added column: {add_lease_column(args.dry_run)}")
@@ -0,0 +1,103 @@
+"""One-off migration adding ``queries.query_hash`` and its unique index.
+
+Adds the column on databases created before it existed and fills it in
+batches. Queries of one user that normalize to the same text (case and
+whitespace differences) are merged into the oldest of them: their responses
+and feedback are moved over and the duplicate rows deleted. Finally the
+unique ``(user_id, query_hash)`` index is created. Safe to re-run:
+
+    python migrate_query_hash.py [--batch-size 1000] [--dry-run]
+"""
+import argparse
+from sqlalchemy import inspect, text
+from answer_cache import question_hash
+from database import SessionLocal, engine
+from models import Feedback, Query, Response
+
+
+def add_query_hash_column():
+    columns = {column["name"] for column in inspect(engine).get_columns("queries")}
+    if "query_hash" in columns:
+        return False
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE queries ADD COLUMN query_hash VARCHAR(64)"))
+    return True
+
+
+def backfill(db, batch_size):
+    filled = 0
+    last_id = ""
+    while True:
+        batch = (
+            db.query(Query)
+            .filter(Query.query_hash.is_(None), Query.id > last_id)
+            .order_by(Query.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return filled
+        last_id = batch[-1].id
+        for query in batch:
+            query.query_hash = question_hash(query.query)
+        filled += len(batch)
+        db.flush()
+
+
+def merge_duplicates(db):
+    """Point responses and feedback of duplicate queries at the oldest one and delete the rest."""
+    rows = (
+        db.query(Query.id, Query.user_id, Query.query_hash)
+        .filter(Query.user_id.isnot(None))
+        .order_by(Query.user_id, Query.query_hash, Query.created_at, Query.id)
+    )
+    keep = {}
+    duplicates = {}
+    for query_id, user_id, digest in rows:
+        kept = keep.setdefault((user_id, digest), query_id)
+        if kept != query_id:
+            duplicates[query_id] = kept
+    for duplicate_id, kept_id in duplicates.items():
+        db.query(Response).filter(Response.query_id == duplicate_id).update({"query_id": kept_id}, synchronize_session=False)
+        db.query(Feedback).filter(Feedback.query_id == duplicate_id).update({"query_id": kept_id}, synchronize_session=False)
+    ids = list(duplicates)
+    for start in range(0, len(ids), 1000):
+        db.query(Query).filter(Query.id.in_(ids[start:start + 1000])).delete(synchronize_session=False)
+    return len(duplicates)
+
+
+def migrate(batch_size=1000, dry_run=False):
+    if dry_run and "query_hash" not in {c["name"] for c in inspect(engine).get_columns("queries")}:
+        return {"column_added": True, "backfilled": None, "merged": None, "indexes": ["uq_queries_user_id_query_hash"]}
+    counts = {"column_added": False if dry_run else add_query_hash_column()}
+    db = SessionLocal()
+    try:
+        counts["backfilled"] = backfill(db, batch_size)
+        counts["merged"] = merge_duplicates(db)
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    finally:
+        db.close()
+
+    existing = {index["name"] for index in inspect(engine).get_indexes("queries")}
+    missing = [index for index in Query.__table__.indexes if index.name not in existing]
+    if not dry_run:
+        for index in missing:
+            index.create(engine)
+    counts["indexes"] = [index.name for index in missing]
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    counts = migrate(args.batch_size, args.dry_run)
+    print(
+        f"Added column: {counts['column_added']}, hashed {counts['backfilled']} queries, "
+        f"merged {counts['merged']} duplicates, created indexes: {', '.join(counts['indexes']) or 'none'}"
+    )
@@ -0,0 +1,98 @@
+"""One-off migration from ``responses.docs_json`` to ``response_documents``.
+
+Makes ``docs_json`` nullable, then walks the responses that still carry a
+full-text copy of their documents in batches, writes their ordered doc ids
+and scores to ``response_documents`` and clears ``docs_json``. Responses
+citing a document that is in neither the seed set nor the ``documents``
+table keep their copy, since its text could not be hydrated otherwise.
+Safe to re-run:
+
+    python migrate_response_docs.py [--batch-size 1000] [--dry-run]
+"""
+import argparse
+import json
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+from database import SessionLocal, engine
+from models import Response, ResponseDocument
+from response_docs import document_refs
+
+
+def make_docs_json_nullable():
+    """Drop NOT NULL from responses.docs_json on databases created before it was relaxed."""
+    columns = {column["name"]: column for column in inspect(engine).get_columns("responses")}
+    if columns["docs_json"]["nullable"]:
+        return False
+    with engine.begin() as conn:
+        if engine.dialect.name != "sqlite":
+            conn.execute(text("ALTER TABLE responses ALTER COLUMN docs_json DROP NOT NULL"))
+            return True
+        # SQLite cannot alter a column: copy into a table with the current schema
+        ddl = str(CreateTable(Response.__table__).compile(engine))
+        conn.execute(text(ddl.replace("CREATE TABLE responses", "CREATE TABLE responses_new", 1)))
+        names = ", ".join(column.name for column in Response.__table__.columns)
+        conn.execute(text(f"INSERT INTO responses_new ({names}) SELECT {names} FROM responses"))
+        conn.execute(text("DROP TABLE responses"))
+        conn.execute(text("ALTER TABLE responses_new RENAME TO responses"))
+        for index in Response.__table__.indexes:
+            index.create(conn)
+    return True
+
+
+def migrate(batch_size=1000, dry_run=False):
+    from document_store import document_store
+
+    counts = {"converted": 0, "kept": 0}
+    last_id = ""
+    db = SessionLocal()
+    try:
+        while True:
+            batch = (
+                db.query(Response)
+                .filter(Response.docs_json.isnot(None), Response.id > last_id)
+                .order_by(Response.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+            stored_docs = {response.id: json.loads(response.docs_json) for response in batch}
+            doc_ids = list(dict.fromkeys(doc["id"] for docs in stored_docs.values() for doc in docs))
+            known = {doc["id"] for doc in document_store.get_many(doc_ids)}
+            already_linked = {
+                response_id for (response_id,) in
+                db.query(ResponseDocument.response_id)
+                .filter(ResponseDocument.response_id.in_(list(stored_docs)))
+                .distinct()
+            }
+            for response in batch:
+                docs = stored_docs[response.id]
+                if not all(doc["id"] in known for doc in docs):
+                    counts["kept"] += 1
+                    continue
+                if response.id not in already_linked:
+                    response.documents = document_refs(docs)
+                response.docs_json = None
+                counts["converted"] += 1
+            if dry_run:
+                db.rollback()
+            else:
+                db.commit()
+            db.expunge_all()
+            print(f"[MIGRATE DEBUG] {counts} (through response {last_id})")
+    finally:
+        db.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    if not args.dry_run and make_docs_json_nullable():
+        print("Made responses.docs_json nullable")
+    counts = migrate(args.batch_size, args.dry_run)
+    print(f"Converted {counts['converted']} responses, kept the stored copy for {counts['kept']}")
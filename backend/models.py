@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Text, ForeignKey, Index
+from sqlalchemy import Column, String, DateTime, Text, LargeBinary, Float, Integer, ForeignKey, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
@@ -9,6 +9,9 @@ class Query(Base):
     id = Column(String, primary_key=True, index=True)
     user_id = Column(String)
     query = Column(Text, nullable=False)
+    # sha256 of the normalized query text, see query_hash(); indexed lookups
+    # instead of comparing the unindexed text column
+    query_hash = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     responses = relationship("Response", back_populates="query")
 
@@ -17,18 +20,83 @@ class Response(Base):
     id = Column(String, primary_key=True, index=True)
     query_id = Column(String, ForeignKey("queries.id"))
     answer_json = Column(Text, nullable=False)
-    docs_json = Column(Text, nullable=False)
+    # Legacy full-text copy of the retrieved docs; new rows reference them
+    # through ``documents`` instead (see migrate_response_docs.py)
+    docs_json = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     parent_response_id = Column(String, ForeignKey("responses.id"), nullable=True)
     query = relationship("Query", back_populates="responses")
+    documents = relationship(
+        "ResponseDocument",
+        order_by="ResponseDocument.rank",
+        cascade="all, delete-orphan",
+    )
+
+class ResponseDocument(Base):
+    """Retrieved document ``rank`` of a response, by id; text lives in the document store."""
+    __tablename__ = "response_documents"
+    response_id = Column(String, ForeignKey("responses.id"), primary_key=True)
+    rank = Column(Integer, primary_key=True, autoincrement=False)
+    doc_id = Column(String, nullable=False)
+    score = Column(Float, nullable=True)
 
 class Document(Base):
     __tablename__ = "documents"
     id = Column(String, primary_key=True, index=True)
     text = Column(Text, nullable=False)
-    embedding = Column(Text, nullable=False)
+    # Binary vector in the format named by embedding_dtype, see embedding_codec
+    embedding = Column(LargeBinary, nullable=False)
+    embedding_dtype = Column(String(16), nullable=False, default="float32", server_default="float32")
+    # Named collection the document is searched in, see sharded_index
+    collection = Column(String(64), nullable=False, default="default", server_default="default")
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class CachedAnswer(Base):
+    __tablename__ = "answer_cache"
+    # sha256 of normalized question, ordered doc ids, model and prompt version
+    key = Column(String(64), primary_key=True)
+    answer_json = Column(Text, nullable=False)
+    model = Column(String, nullable=False)
+    prompt_version = Column(String, nullable=False)
+    # Estimated USD cost of the LLM call this entry saves on every hit
+    cost = Column(Float, nullable=False, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class InflightQuery(Base):
+    """Cross-process single-flight lease, see singleflight.DatabaseSingleFlight."""
+    __tablename__ = "inflight_queries"
+    key = Column(String(64), primary_key=True)
+    owner = Column(String, nullable=False)
+    # Set by the leader when it finishes; followers poll for it
+    result_json = Column(Text, nullable=True)
+    # Lease end while running, result expiry once finished
+    expires_at = Column(DateTime, nullable=False)
+
+class Job(Base):
+    """Background job run by jobs.JobQueue; status is queued, running, succeeded or failed."""
+    __tablename__ = "jobs"
+    id = Column(String, primary_key=True)
+    kind = Column(String, nullable=False)
+    status = Column(String(16), nullable=False, default="queued")
+    # Lower runs first, see jobs.PRIORITIES
+    priority = Column(Integer, nullable=False, default=5)
+    payload_json = Column(Text, nullable=False)
+    result_json = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    # A running job whose lease has passed lost its worker, see jobs.JobQueue
+    lease_until = Column(DateTime, nullable=True)
+
+class RateLimitBucket(Base):
+    """Token bucket shared by all processes, see ratelimit.DatabaseRateLimiter."""
+    __tablename__ = "rate_limit_buckets"
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # Unix time of the last refill
+    updated_at = Column(Float, nullable=False)
+
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(String, primary_key=True, index=True)
@@ -39,7 +107,42 @@ class Feedback(Base):
     comment = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class ResponseArchiveChunk(Base):
+    """Compressed NDJSON of archived responses from one month, see archive.py."""
+    __tablename__ = "response_archive_chunks"
+    id = Column(String, primary_key=True)
+    # YYYY-MM of the responses' created_at
+    partition = Column(String(7), nullable=False)
+    # zstd or gzip
+    codec = Column(String(16), nullable=False)
+    count = Column(Integer, nullable=False)
+    min_created_at = Column(DateTime, nullable=False)
+    max_created_at = Column(DateTime, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedResponse(Base):
+    """Where an archived response is stored, so it can be rehydrated by id."""
+    __tablename__ = "archived_responses"
+    response_id = Column(String, primary_key=True)
+    query_id = Column(String, nullable=False, index=True)
+    chunk_id = Column(String, ForeignKey("response_archive_chunks.id"), nullable=False, index=True)
+
 Index('ix_queries_user_id_created_at', Query.user_id, Query.created_at)
+# One stored query per user and normalized text; the conflict target of the /query insert
+Index('uq_queries_user_id_query_hash', Query.user_id, Query.query_hash, unique=True)
 Index('ix_responses_query_id_created_at', Response.query_id, Response.created_at)
+# Keyset pagination for /history and /responses/<id>/history
+Index('ix_responses_parent_response_id_created_at', Response.parent_response_id, Response.created_at, Response.id)
 Index('ix_documents_created_at', Document.created_at)
-Index('ix_feedback_user_id_created_at', Feedback.user_id, Feedback.created_at) 
\ No newline at end of file
+Index('ix_documents_collection', Document.collection)
+# /history/export reads archived chunks oldest first
+Index('ix_response_archive_chunks_min_created_at', ResponseArchiveChunk.min_created_at)
+Index('ix_answer_cache_created_at', CachedAnswer.created_at)
+# Next queued job to claim, in priority order
+Index('ix_jobs_status_priority_created_at', Job.status, Job.priority, Job.created_at)
+Index('ix_feedback_user_id_created_at', Feedback.user_id, Feedback.created_at)
+# One vote per user and response; the conflict target of the /feedback upsert
+Index('uq_feedback_user_id_response_id', Feedback.user_id, Feedback.response_id, unique=True)
+# Covers the GROUP BY behind /feedback/aggregate
+Index('ix_feedback_response_id_rating', Feedback.response_id, Feedback.rating) 
\ No newline at end of file
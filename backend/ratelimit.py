@@ -0,0 +1,128 @@
+"""Per-client, per-endpoint token-bucket rate limiting.
+
+Limits come from ``RATE_LIMITS``, a comma-separated list of
+``<endpoint>=<requests>/<second|minute|hour>`` rules such as
+``/query=60/minute,/revalidate=20/minute``. Each (endpoint, identity) pair
+has a bucket holding up to ``<requests>`` tokens that refills evenly over the
+period, so short bursts are allowed but the sustained rate is capped.
+
+The ``memory`` backend keeps buckets per process, so the effective limit
+is multiplied by the number of worker processes. The ``database`` backend
+keeps them in ``rate_limit_buckets``, which all processes share.
+"""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+PERIODS = {"second": 1, "sec": 1, "s": 1, "minute": 60, "min": 60, "m": 60, "hour": 3600, "h": 3600}
+
+
+def parse_rules(spec):
+    """``{endpoint: (capacity, tokens_per_second)}`` from a RATE_LIMITS string."""
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            endpoint, limit = item.rsplit("=", 1)
+            count, period = limit.split("/")
+            rules[endpoint.strip()] = (float(count), float(count) / PERIODS[period.strip().lower()])
+        except (ValueError, KeyError):
+            raise ValueError(f"Bad RATE_LIMITS rule {item!r}; expected <endpoint>=<requests>/<second|minute|hour>")
+    return rules
+
+
+class RateLimiter(ABC):
+    def __init__(self, rules):
+        self.rules = rules
+
+    def check(self, endpoint, identity):
+        """``(allowed, retry_after_seconds)`` for one request; endpoints without a rule are always allowed."""
+        rule = self.rules.get(endpoint)
+        if rule is None:
+            return True, 0.0
+        capacity, rate = rule
+        return self._take(f"{endpoint}|{identity}", capacity, rate)
+
+    @abstractmethod
+    def _take(self, key, capacity, rate):
+        """Take one token from bucket ``key``; returns ``(allowed, retry_after_seconds)``."""
+
+
+class MemoryRateLimiter(RateLimiter):
+    def __init__(self, rules, max_keys=100000):
+        super().__init__(rules)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # Forgetting the least recently seen key only refills its bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class DatabaseRateLimiter(RateLimiter):
+    """Buckets in the database, updated with optimistic compare-and-set."""
+
+    def __init__(self, rules, attempts=5):
+        super().__init__(rules)
+        self.attempts = attempts
+
+    def _take(self, key, capacity, rate):
+        from database import SessionLocal, insert_for
+        from models import RateLimitBucket
+
+        db = SessionLocal()
+        try:
+            for _ in range(self.attempts):
+                now = time.time()
+                row = db.query(RateLimitBucket.tokens, RateLimitBucket.updated_at).filter(RateLimitBucket.key == key).first()
+                if row is None:
+                    inserted = db.execute(
+                        insert_for(db)(RateLimitBucket)
+                        .values(key=key, tokens=capacity - 1, updated_at=now)
+                        .on_conflict_do_nothing(index_elements=[RateLimitBucket.key])
+                    ).rowcount
+                    db.commit()
+                    if inserted:
+                        return True, 0.0
+                    continue
+                tokens = min(capacity, row.tokens + max(0.0, now - row.updated_at) * rate)
+                if tokens < 1:
+                    db.rollback()
+                    return False, (1 - tokens) / rate
+                updated = db.query(RateLimitBucket).filter(
+                    RateLimitBucket.key == key, RateLimitBucket.updated_at == row.updated_at
+                ).update({"tokens": tokens - 1, "updated_at": now}, synchronize_session=False)
+                db.commit()
+                if updated:
+                    return True, 0.0
+            # Lost every race: the bucket is under heavy concurrent use
+            return False, 1 / rate
+        except Exception as e:
+            db.rollback()
+            # Fail open; a database problem should not lock every user out
+            print(f"[RATELIMIT DEBUG] Bucket {key} check failed, allowing request: {e}")
+            return True, 0.0
+        finally:
+            db.close()
+
+
+def rate_limiter_from_env():
+    """Limiter for RATE_LIMITS, or None when no limits are configured."""
+    rules = parse_rules(os.environ.get("RATE_LIMITS", ""))
+    if not rules:
+        return None
+    if os.environ.get("RATE_LIMIT_BACKEND", "memory").lower() == "database":
+        return DatabaseRateLimiter(rules)
+    return MemoryRateLimiter(rules, int(os.environ.get("RATE_LIMIT_MAX_KEYS", 100000)))
@@ -0,0 +1,61 @@
+import json
+from models import ResponseDocument
+
+
+def document_refs(docs):
+    """``ResponseDocument`` rows for ``docs`` (in rank order), to assign to ``Response.documents``."""
+    return [
+        ResponseDocument(rank=rank, doc_id=doc["id"], score=doc.get("score"))
+        for rank, doc in enumerate(docs)
+    ]
+
+
+def load_response_docs(db, responses):
+    """Return ``{response_id: docs}`` for rows exposing ``id`` and ``docs_json``.
+
+    Document references for all the responses are read in one query and
+    their text is hydrated in one ``document_store.get_many`` call (seed and
+    cached documents never touch the database). Rows still carrying a legacy
+    ``docs_json`` copy are returned from it unchanged.
+    """
+    docs_by_response = {}
+    ref_ids = []
+    for response in responses:
+        if response.docs_json is not None:
+            docs_by_response[response.id] = json.loads(response.docs_json)
+        else:
+            ref_ids.append(response.id)
+    if not ref_ids:
+        return docs_by_response
+
+    refs = (
+        db.query(ResponseDocument.response_id, ResponseDocument.doc_id, ResponseDocument.score)
+        .filter(ResponseDocument.response_id.in_(ref_ids))
+        .order_by(ResponseDocument.response_id, ResponseDocument.rank)
+        .all()
+    )
+    docs_by_response.update(hydrate_refs(refs, ref_ids))
+    return docs_by_response
+
+
+def hydrate_refs(refs, response_ids=()):
+    """Return ``{response_id: docs}`` for rank-ordered refs with ``response_id``, ``doc_id`` and ``score``.
+
+    Every id in ``response_ids`` gets an entry, if only an empty list.
+    """
+    from document_store import document_store
+
+    texts = {
+        doc["id"]: doc["text"]
+        for doc in document_store.get_many(list(dict.fromkeys(ref.doc_id for ref in refs)))
+    }
+    docs_by_response = {response_id: [] for response_id in response_ids}
+    for ref in refs:
+        docs = docs_by_response.setdefault(ref.response_id, [])
+        # Documents deleted since the response was stored are skipped
+        if ref.doc_id in texts:
+            doc = {"id": ref.doc_id, "text": texts[ref.doc_id]}
+            if ref.score is not None:
+                doc["score"] = ref.score
+            docs.append(doc)
+    return docs_by_response
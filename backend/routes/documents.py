@@ -0,0 +1,65 @@
+from flask import Blueprint, request, jsonify
+from database import get_db
+from ingest import (
+    COLLECTION_NAME,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_COLLECTION,
+    IngestError,
+    delete_documents,
+    ingest_documents,
+    iter_ndjson,
+    update_document,
+)
+
+documents_bp = Blueprint('documents_bp', __name__)
+
+@documents_bp.route('/documents/bulk', methods=['POST'])
+def bulk_documents():
+    batch_size = request.args.get('batch_size', DEFAULT_BATCH_SIZE, type=int)
+    if batch_size <= 0:
+        return jsonify({"error": "batch_size must be positive", "code": 400}), 400
+    collection = request.args.get('collection', DEFAULT_COLLECTION)
+    if not COLLECTION_NAME.match(collection):
+        return jsonify({"error": f"collection must match {COLLECTION_NAME.pattern}", "code": 400}), 400
+
+    db = get_db()
+    try:
+        counts = ingest_documents(db, iter_ndjson(request.stream, collection), batch_size)
+    except IngestError as e:
+        db.rollback()
+        return jsonify({"error": str(e), "code": 400, **(e.counts or {})}), 400
+
+    return jsonify({"status": "success", **counts}), 201
+
+@documents_bp.route('/documents/<string:doc_id>', methods=['PUT'])
+def put_document(doc_id):
+    data = request.json or {}
+    text = data.get('text')
+    if not text:
+        return jsonify({"error": "Missing text", "code": 400}), 400
+
+    updated = update_document(get_db(), doc_id, text)
+
+    if not updated:
+        return jsonify({"error": "Document not found", "code": 404}), 404
+    return jsonify({"status": "success", "id": doc_id})
+
+@documents_bp.route('/documents/<string:doc_id>', methods=['DELETE'])
+def remove_document(doc_id):
+    deleted = delete_documents(get_db(), [doc_id])
+
+    if not deleted:
+        return jsonify({"error": "Document not found", "code": 404}), 404
+    return jsonify({"status": "success", "id": doc_id})
+
+@documents_bp.route('/collections', methods=['GET'])
+def list_collections():
+    from vector_search_demo import index_manager
+
+    shards = index_manager.stats()
+    collections = {}
+    for name, vectors in shards.items():
+        collection = collections.setdefault(name.rsplit(":", 1)[0], {"vectors": 0, "shards": {}})
+        collection["vectors"] += vectors
+        collection["shards"][name] = vectors
+    return jsonify({"collections": collections})
@@ -1,10 +1,15 @@
 from flask import Blueprint, request, jsonify
+import os
 import uuid
-from database import SessionLocal
+from datetime import datetime
+from sqlalchemy import case, func
+from database import get_db, insert_for
 from models import Feedback
 
 feedback_bp = Blueprint('feedback_bp', __name__)
 
+FEEDBACK_BULK_MAX = int(os.environ.get("FEEDBACK_BULK_MAX", 1000))
+
 @feedback_bp.route('/feedback', methods=['POST'])
 def feedback():
     data = request.json
@@ -17,44 +22,72 @@ def feedback():
     if not all([user_id, query_id, response_id, rating]):
         return jsonify({"error": "Missing required fields"}), 400
 
-    db = SessionLocal()
-    
-    existing_feedback = db.query(Feedback).filter(
-        Feedback.user_id == user_id,
-        Feedback.response_id == response_id
-    ).first()
-
-    if existing_feedback:
-        existing_feedback.rating = rating
-        existing_feedback.comment = comment if comment else existing_feedback.comment
-        feedback_id = existing_feedback.id
-        status_code = 200
-    else:
-        feedback_id = str(uuid.uuid4())
-        new_feedback = Feedback(
-            id=feedback_id,
-            user_id=user_id,
-            query_id=query_id,
-            response_id=response_id,
-            rating=rating,
-            comment=comment
-        )
-        db.add(new_feedback)
-        status_code = 201
-
+    db = get_db()
+    new_id = str(uuid.uuid4())
+    feedback_id = _upsert_feedback(db, {
+        "id": new_id,
+        "user_id": user_id,
+        "query_id": query_id,
+        "response_id": response_id,
+        "rating": rating,
+        "comment": comment,
+        "created_at": datetime.utcnow(),
+    })
     db.commit()
-    db.close()
-    
+
+    status_code = 201 if feedback_id == new_id else 200
     return jsonify({"status": "success", "feedback_id": feedback_id}), status_code
 
+def _upsert_feedback(db, values):
+    """Insert or update the (user_id, response_id) feedback row in one statement.
+
+    Relies on the unique ``uq_feedback_user_id_response_id`` index. Returns
+    the row id, which is ``values["id"]`` only if the row was inserted.
+    """
+    stmt = insert_for(db)(Feedback).values(**values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Feedback.user_id, Feedback.response_id],
+        set_={
+            "rating": stmt.excluded.rating,
+            # An empty comment keeps the previous one
+            "comment": func.coalesce(func.nullif(stmt.excluded.comment, ''), Feedback.comment),
+        },
+    ).returning(Feedback.id)
+    return db.execute(stmt).scalar_one()
+
+def _feedback_counts(db, response_ids):
+    """Like/dislike counts for ``response_ids`` in a single GROUP BY query."""
+    counts = {response_id: {"likes": 0, "dislikes": 0} for response_id in response_ids}
+    rows = (
+        db.query(
+            Feedback.response_id,
+            func.count(case((Feedback.rating == 'like', 1))),
+            func.count(case((Feedback.rating == 'dislike', 1))),
+        )
+        .filter(Feedback.response_id.in_(list(counts)))
+        .group_by(Feedback.response_id)
+    )
+    for response_id, likes, dislikes in rows:
+        counts[response_id] = {"likes": likes, "dislikes": dislikes}
+    return counts
+
 @feedback_bp.route('/feedback/aggregate', methods=['GET'])
 def feedback_aggregate():
     response_id = request.args.get('response_id')
     if not response_id:
         return jsonify({"error": "Missing response_id"}), 400
 
-    db = SessionLocal()
-    likes = db.query(Feedback).filter(Feedback.response_id == response_id, Feedback.rating == 'like').count()
-    dislikes = db.query(Feedback).filter(Feedback.response_id == response_id, Feedback.rating == 'dislike').count()
-    db.close()
-    return jsonify({"likes": likes, "dislikes": dislikes})
+    counts = _feedback_counts(get_db(), [response_id])
+    return jsonify(counts[response_id])
+
+@feedback_bp.route('/feedback/aggregate/bulk', methods=['POST'])
+def feedback_aggregate_bulk():
+    data = request.json or {}
+    response_ids = data.get('response_ids')
+    if not isinstance(response_ids, list) or not all(isinstance(r, str) and r for r in response_ids):
+        return jsonify({"error": "response_ids must be a list of strings"}), 400
+    if len(response_ids) > FEEDBACK_BULK_MAX:
+        return jsonify({"error": f"At most {FEEDBACK_BULK_MAX} response_ids per request"}), 400
+
+    counts = _feedback_counts(get_db(), response_ids)
+    return jsonify(counts)
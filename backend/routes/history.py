@@ -1,60 +1,313 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response as FlaskResponse, jsonify, request
+import base64
 import json
-from database import SessionLocal
-from models import Response, Feedback
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+from archive import ARCHIVE_BATCH_SIZE, archived_regenerations, is_archived, iter_archived, rehydrate
+from database import SessionLocal, get_db
+from ingest import batched
+from jobs import PRIORITIES, QueueFull, job_queue
+from models import Query, Response, Feedback
+from response_docs import load_response_docs
 
 history_bp = Blueprint('history_bp', __name__)
 
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+HISTORY_PAGE_MAX = int(os.environ.get("HISTORY_PAGE_MAX", 500))
+# Rows fetched per server-side cursor round trip by /history/export
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+
+
+def _encode_cursor(created_at, response_id):
+    raw = json.dumps([created_at.isoformat(), response_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def _decode_cursor(cursor):
+    created_at, response_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return datetime.fromisoformat(created_at), response_id
+
+
+def _page_args():
+    """Parse ``limit`` and ``cursor``; raises ValueError on bad input."""
+    limit = int(request.args.get('limit', HISTORY_PAGE_SIZE))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    cursor = request.args.get('cursor')
+    return min(limit, HISTORY_PAGE_MAX), _decode_cursor(cursor) if cursor else None
+
+
+def _rating(db, feedback_user):
+    """Correlated subquery for the latest rating of a response by ``feedback_user`` (a value or column)."""
+    return (
+        db.query(Feedback.rating)
+        .filter(Feedback.response_id == Response.id, Feedback.user_id == feedback_user)
+        .order_by(Feedback.created_at.desc())
+        .limit(1)
+        .correlate(Response, Query)
+        .scalar_subquery()
+    )
+
+
+def _history_page(db, base_filter, descending, limit, cursor, feedback_user, user_id=None):
+    """Run one keyset-paginated query for a page of responses.
+
+    Responses are joined to their query text and the feedback rating is
+    fetched with a correlated subquery, so a page is a single SQL
+    round-trip (plus one for the page's document references). Returns
+    ``(items, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    q = (
+        db.query(
+            Response.id,
+            Response.query_id,
+            Response.answer_json,
+            Response.docs_json,
+            Response.created_at,
+            Query.query,
+            _rating(db, feedback_user).label("rating"),
+        )
+        .join(Query, Response.query_id == Query.id)
+        .filter(base_filter)
+    )
+    if user_id is not None:
+        q = q.filter(Query.user_id == user_id)
+    if cursor:
+        created_at, response_id = cursor
+        if descending:
+            q = q.filter(or_(
+                Response.created_at < created_at,
+                and_(Response.created_at == created_at, Response.id < response_id)
+            ))
+        else:
+            q = q.filter(or_(
+                Response.created_at > created_at,
+                and_(Response.created_at == created_at, Response.id > response_id)
+            ))
+    if descending:
+        q = q.order_by(Response.created_at.desc(), Response.id.desc())
+    else:
+        q = q.order_by(Response.created_at.asc(), Response.id.asc())
+
+    rows = q.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1].created_at, rows[-1].id)
+    docs = load_response_docs(db, rows)
+    return [_history_item(row, docs[row.id]) for row in rows], next_cursor
+
+
+def _history_item(row, docs):
+    return {
+        "query_id": row.query_id,
+        "response_id": row.id,
+        "query": row.query,
+        "answer": json.loads(row.answer_json),
+        "timestamp": row.created_at.isoformat(),
+        "docs": docs,
+        "feedback": {"rating": row.rating} if row.rating else None
+    }
+
+
+def _page_response(items, next_cursor):
+    # The body stays a plain list; the cursor for the next page goes in a header
+    response = jsonify(items)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
 @history_bp.route('/history', methods=['GET'])
 def history():
-    db = SessionLocal()
-    results = []
-    
-    # Get all initial responses (not regenerations)
-    initial_responses = db.query(Response).filter(Response.parent_response_id.is_(None)).order_by(Response.created_at.desc()).all()
-    
-    for resp in initial_responses:
-        feedback = db.query(Feedback).filter(
-            Feedback.response_id == resp.id,
-            Feedback.user_id == 'anonymous'
-        ).first()
-
-        results.append({
-            "query_id": resp.query.id,
-            "response_id": resp.id,
-            "query": resp.query.query,
-            "answer": json.loads(resp.answer_json),
-            "timestamp": resp.created_at.isoformat(),
-            "docs": json.loads(resp.docs_json),
-            "feedback": {"rating": feedback.rating} if feedback else None
-        })
-
-    db.close()
-    return jsonify(results)
+    user_id = request.args.get('user_id')
+    try:
+        limit, cursor = _page_args()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid limit or cursor: {e}", "code": 400}), 400
+    # Initial responses only (not regenerations), newest first
+    items, next_cursor = _history_page(
+        get_db(),
+        Response.parent_response_id.is_(None),
+        descending=True,
+        limit=limit,
+        cursor=cursor,
+        feedback_user=user_id or 'anonymous',
+        user_id=user_id,
+    )
+    return _page_response(items, next_cursor)
+
 
 @history_bp.route('/responses/<string:response_id>/history', methods=['GET'])
 def get_response_history(response_id):
-    db = SessionLocal()
-    
-    # Find all responses that are children of the given response_id
-    child_responses = db.query(Response).filter(Response.parent_response_id == response_id).order_by(Response.created_at.asc()).all()
-    
-    results = []
-    for r in child_responses:
-        feedback = db.query(Feedback).filter(
-            Feedback.response_id == r.id,
-            Feedback.user_id == 'anonymous'
-        ).first()
-
-        results.append({
-            "response_id": r.id,
-            "query_id": r.query_id,
-            "query": r.query.query,
-            "answer": json.loads(r.answer_json),
-            "docs": json.loads(r.docs_json),
-            "timestamp": r.created_at.isoformat(),
-            "feedback": {"rating": feedback.rating} if feedback else None
-        })
-    
-    db.close()
-    return jsonify(results)
+    try:
+        limit, cursor = _page_args()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid limit or cursor: {e}", "code": 400}), 400
+    db = get_db()
+    feedback_user = request.args.get('user_id', 'anonymous')
+    # Archived chains are read from their chunks; POST /history/rehydrate moves them back
+    if is_archived(db, response_id):
+        return _page_response(*_archived_page(db, response_id, limit, cursor, feedback_user))
+    # Regenerations of the given response, oldest first
+    items, next_cursor = _history_page(
+        db,
+        Response.parent_response_id == response_id,
+        descending=False,
+        limit=limit,
+        cursor=cursor,
+        feedback_user=feedback_user,
+    )
+    return _page_response(items, next_cursor)
+
+
+def _archived_page(db, response_id, limit, cursor, feedback_user):
+    """``_history_page`` for the regenerations of an archived response."""
+    records = [
+        (datetime.fromisoformat(record["created_at"]), record)
+        for record in archived_regenerations(db, response_id)
+    ]
+    if cursor:
+        records = [(created_at, record) for created_at, record in records if (created_at, record["id"]) > cursor]
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        created_at, record = records[-1]
+        next_cursor = _encode_cursor(created_at, record["id"])
+    return [_archived_item(record, feedback_user) for _, record in records], next_cursor
+
+
+def _archived_item(record, feedback_user):
+    """``_history_item`` for an archived record, with ``feedback_user``'s latest rating."""
+    ratings = sorted(
+        (row for row in record["feedback"] if row["user_id"] == feedback_user),
+        key=lambda row: row["created_at"] or "",
+    )
+    return {
+        "query_id": record["query_id"],
+        "response_id": record["id"],
+        "query": record["query"],
+        "answer": json.loads(record["answer_json"]),
+        "timestamp": record["created_at"],
+        "docs": record["docs"],
+        "feedback": {"rating": ratings[-1]["rating"]} if ratings else None,
+    }
+
+
+def _export_item(item, user_id, parent_response_id, archived):
+    return {**item, "user_id": user_id, "parent_response_id": parent_response_id, "archived": archived}
+
+
+def _export_archived(db, user_id, since, until):
+    for record in iter_archived(db, since, until):
+        if user_id is not None and record["user_id"] != user_id:
+            continue
+        # The asker's own rating, as /history shows it
+        item = _archived_item(record, record["user_id"] or 'anonymous')
+        yield _export_item(item, record["user_id"], record["parent_response_id"], True)
+
+
+def _export_hot(db, user_id, since, until):
+    q = (
+        db.query(
+            Response.id,
+            Response.query_id,
+            Response.answer_json,
+            Response.docs_json,
+            Response.parent_response_id,
+            Response.created_at,
+            Query.query,
+            Query.user_id,
+            # The asker's own rating, as /history shows it
+            _rating(db, func.coalesce(Query.user_id, 'anonymous')).label("rating"),
+        )
+        .join(Query, Response.query_id == Query.id)
+        .order_by(Response.created_at.asc(), Response.id.asc())
+    )
+    if user_id is not None:
+        q = q.filter(Query.user_id == user_id)
+    if since is not None:
+        q = q.filter(Response.created_at >= since)
+    if until is not None:
+        q = q.filter(Response.created_at < until)
+    # yield_per streams through a server-side cursor where the driver has one
+    for rows in batched(q.yield_per(EXPORT_BATCH_SIZE), EXPORT_BATCH_SIZE):
+        docs = load_response_docs(db, rows)
+        for row in rows:
+            yield _export_item(_history_item(row, docs[row.id]), row.user_id, row.parent_response_id, False)
+
+
+@history_bp.route('/history/export', methods=['GET'])
+def export_history():
+    """Every response (initial and regenerated) as NDJSON, oldest first.
+
+    Optional ``user_id``, ``since`` and ``until`` (ISO timestamps, ``until``
+    exclusive) filter the export. With ``include_archived=true`` archived
+    responses are streamed first, ordered within each archive chunk. Rows
+    are read ``EXPORT_BATCH_SIZE`` at a time, so memory stays flat however
+    large the export.
+    """
+    user_id = request.args.get('user_id')
+    try:
+        since, until = (
+            datetime.fromisoformat(request.args[name]) if request.args.get(name) else None
+            for name in ('since', 'until')
+        )
+    except ValueError as e:
+        return jsonify({"error": f"Invalid since or until: {e}", "code": 400}), 400
+    include_archived = request.args.get('include_archived', 'false').lower() in ('1', 'true')
+
+    def generate():
+        # The request session closes at teardown, before the body is streamed
+        db = SessionLocal()
+        try:
+            if include_archived:
+                for item in _export_archived(db, user_id, since, until):
+                    yield json.dumps(item) + "\n"
+            for item in _export_hot(db, user_id, since, until):
+                yield json.dumps(item) + "\n"
+        finally:
+            db.close()
+
+    return FlaskResponse(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={"Content-Disposition": "attachment; filename=history.ndjson"},
+    )
+
+
+@history_bp.route('/history/archive', methods=['POST'])
+def archive_history():
+    """Queue a job archiving queries with no response since ``before`` (or ``older_than_days`` ago)."""
+    data = request.json or {}
+    try:
+        if data.get('before'):
+            before = datetime.fromisoformat(data['before'])
+        else:
+            before = datetime.utcnow() - timedelta(days=float(data['older_than_days']))
+        batch_size = int(data.get('batch_size', ARCHIVE_BATCH_SIZE))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Provide before (ISO timestamp) or older_than_days", "code": 400}), 400
+    if batch_size < 1:
+        return jsonify({"error": "batch_size must be positive", "code": 400}), 400
+    try:
+        job_id = job_queue.submit(
+            "archive", {"before": before.isoformat(), "batch_size": batch_size}, PRIORITIES["batch"]
+        )
+    except QueueFull:
+        return jsonify({"error": "Job queue is full, try again later", "code": 503}), 503, {"Retry-After": "5"}
+    status_url = f"/jobs/{job_id}"
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+
+@history_bp.route('/history/rehydrate', methods=['POST'])
+def rehydrate_history():
+    """Move archived queries, given by ``query_ids`` or ``response_ids``, back to the hot tables."""
+    data = request.json or {}
+    query_ids = data.get('query_ids') or []
+    response_ids = data.get('response_ids') or []
+    if not isinstance(query_ids, list) or not isinstance(response_ids, list) or not (query_ids or response_ids):
+        return jsonify({"error": "Provide query_ids or response_ids as a list", "code": 400}), 400
+    restored = rehydrate(get_db(), query_ids=query_ids, response_ids=response_ids)
+    return jsonify({"rehydrated": restored})
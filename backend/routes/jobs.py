@@ -0,0 +1,46 @@
+from flask import Blueprint, current_app, jsonify, request
+import json
+import time
+from database import SessionLocal, get_db
+from jobs import job_queue, job_status
+from models import Job
+
+jobs_bp = Blueprint('jobs_bp', __name__)
+
+FINISHED = ("succeeded", "failed")
+
+@jobs_bp.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_db().get(Job, job_id)
+    if job is None:
+        return jsonify({"error": "Job not found", "code": 404}), 404
+
+    wants_stream = request.args.get('stream', '').lower() in ('sse', '1', 'true') \
+        or 'text/event-stream' in request.headers.get('Accept', '')
+    if not wants_stream or job.status in FINISHED:
+        return jsonify(job_status(job))
+
+    # Release the pooled connection; each poll below opens its own session
+    get_db().close()
+    return current_app.response_class(
+        _status_events(job_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _status_events(job_id):
+    """SSE ``status`` event whenever the job's status changes, then ``done`` with the full job."""
+    last_status = None
+    while True:
+        db = SessionLocal()
+        try:
+            status = job_status(db.get(Job, job_id))
+        finally:
+            db.close()
+        if status["status"] in FINISHED:
+            yield f"event: done\ndata: {json.dumps(status)}\n\n"
+            return
+        if status["status"] != last_status:
+            last_status = status["status"]
+            yield f"event: status\ndata: {json.dumps({'status': last_status})}\n\n"
+        time.sleep(job_queue.poll_interval)
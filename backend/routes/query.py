@@ -1,99 +1,393 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, stream_with_context
+import os
 import uuid
 import json
-from vector_search_demo import retrieve_top_k_faiss
-from llm import get_llm_answer
-from database import SessionLocal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from llm import get_llm_answer, select_context_docs, stream_llm_answer
+from admission import llm_admission
+from answer_cache import question_hash
+from archive import rehydrate
+from database import SessionLocal, get_db, insert_for
+from jobs import PRIORITIES, QueueFull, handler, job_queue
 from models import Query, Response
+from metrics import stage
+from response_docs import document_refs, load_response_docs
+from singleflight import singleflight_from_env
 
 query_bp = Blueprint('query_bp', __name__)
 
+QUERY_BATCH_MAX = int(os.environ.get("QUERY_BATCH_MAX", 500))
+# Candidates retrieved per question; only those that fit CONTEXT_TOKEN_BUDGET
+# are sent to the model and returned
+RETRIEVAL_K = int(os.environ.get("RETRIEVAL_K", 3))
+# Queue /revalidate as a background job unless the request says otherwise
+REVALIDATE_ASYNC = os.environ.get("REVALIDATE_ASYNC", "false").lower() == "true"
+# Shared by all batch requests so concurrent batches cannot multiply LLM fan-out
+llm_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("LLM_BATCH_CONCURRENCY", 8)),
+    thread_name_prefix="llm-batch",
+)
+
+# Concurrent identical questions share one retrieval and LLM call
+query_flight = singleflight_from_env()
+
+STREAM_MIMETYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+def _collections_filter(data):
+    """Collections named by ``collections`` (list) or ``collection`` (string), or None for all.
+
+    Raises ValueError if the value is malformed.
+    """
+    collections = data.get('collections', data.get('collection'))
+    if collections is None:
+        return None
+    if isinstance(collections, str):
+        collections = [collections]
+    if not isinstance(collections, list) or not collections or not all(isinstance(c, str) and c for c in collections):
+        raise ValueError("collections must be a non-empty list of collection names")
+    return sorted(set(collections))
+
+def _stream_format():
+    """Streaming format asked for via ``?stream=sse|ndjson`` or the Accept header, else None."""
+    fmt = request.args.get('stream', '').lower()
+    if fmt in STREAM_MIMETYPES:
+        return fmt
+    if fmt in ('1', 'true'):
+        return 'sse'
+    accept = request.headers.get('Accept', '')
+    for fmt, mimetype in STREAM_MIMETYPES.items():
+        if mimetype in accept:
+            return fmt
+    return None
+
+def _format_event(fmt, event, data):
+    if fmt == 'sse':
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+def _stream_answer(fmt, top_docs, question, query_id, parent_response_id=None, bypass_cache=False):
+    """Stream an answer: ``docs`` first, then one ``summary``/``facts`` event per item
+    as the model writes it, then ``done`` with the usual response body once the
+    Response row is stored. The caller must hold an ``llm_admission`` slot,
+    which is released when the stream closes."""
+    response_id = str(uuid.uuid4())
+
+    def generate():
+        yield _format_event(fmt, "docs", {
+            "query_id": query_id,
+            "response_id": response_id,
+            "query": question,
+            "docs": top_docs
+        })
+        answer_json = None
+        for field, item in stream_llm_answer(top_docs, question, bypass_cache=bypass_cache):
+            if field == "answer":
+                answer_json = item
+            else:
+                yield _format_event(fmt, field, {"item": item})
+
+        created_at = datetime.utcnow()
+        db = get_db()
+        db.add(Response(
+            id=response_id,
+            query_id=query_id,
+            answer_json=json.dumps(answer_json),
+            documents=document_refs(top_docs),
+            parent_response_id=parent_response_id,
+            created_at=created_at
+        ))
+        with stage("db_write"):
+            db.commit()
+
+        yield _format_event(fmt, "done", {
+            "answer": answer_json,
+            "query_id": query_id,
+            "response_id": response_id,
+            "query": question,
+            "timestamp": created_at.isoformat(),
+            "docs": top_docs
+        })
+
+    response = current_app.response_class(
+        stream_with_context(generate()),
+        mimetype=STREAM_MIMETYPES[fmt],
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # The caller took an admission slot; hold it until the stream is closed
+    start = time.perf_counter()
+    response.call_on_close(lambda: llm_admission.release(time.perf_counter() - start))
+    return response
+
 @query_bp.route('/query', methods=['POST'])
 def query():
     data = request.json
     query_text = data.get('query', '')
-    user_id = data.get('user_id') 
-    db = SessionLocal()
+    user_id = data.get('user_id')
+    try:
+        collections = _collections_filter(data)
+    except ValueError as e:
+        return jsonify({"error": str(e), "code": 400}), 400
 
-    query_record = db.query(Query).filter(
-        Query.query == query_text, 
-        Query.user_id == user_id
-    ).first()
-    
-    if not query_record:
-        query_id = str(uuid.uuid4())
-        query_record = Query(id=query_id, user_id=user_id, query=query_text)
-        db.add(query_record)
-        db.commit()
-        db.refresh(query_record)
-    
-    query_id = query_record.id
+    stream_format = _stream_format()
+    if stream_format:
+        llm_admission.acquire()
+        try:
+            top_docs = _retrieve(query_text, collections)
+            query_id = _get_or_create_query_id(user_id, query_text)
+            db = get_db()
+            with stage("db_write"):
+                db.commit()
+            # Release the pooled connection while the model streams
+            db.close()
+            return _stream_answer(stream_format, top_docs, query_text, query_id)
+        except BaseException:
+            llm_admission.release()
+            raise
 
-    top_docs = retrieve_top_k_faiss(query_text, k=3)
-    answer_json = get_llm_answer(top_docs, query_text)
+    # Ask the model before touching the database so no connection is held
+    # while waiting on it; the query and response are then written together.
+    if query_flight is not None:
+        flight_key = question_hash(query_text)
+        if collections is not None:
+            flight_key = f"{flight_key}|{','.join(collections)}"
+        top_docs, answer_json = query_flight.do(flight_key, lambda: _retrieve_and_answer(query_text, collections))
+    else:
+        top_docs, answer_json = _retrieve_and_answer(query_text, collections)
 
+    db = get_db()
+    query_id = _get_or_create_query_id(user_id, query_text)
     response_id = str(uuid.uuid4())
-    response_record = Response(
+    created_at = datetime.utcnow()
+    db.add(Response(
         id=response_id,
         query_id=query_id,
         answer_json=json.dumps(answer_json),
-        docs_json=json.dumps(top_docs),
-        parent_response_id=None
-    )
-    db.add(response_record)
-    db.commit()
-    db.refresh(response_record)
-    
-    db.close()
-    
+        documents=document_refs(top_docs),
+        parent_response_id=None,
+        created_at=created_at
+    ))
+    with stage("db_write"):
+        db.commit()
+
     return jsonify({
         "answer": answer_json,
         "query_id": query_id,
         "response_id": response_id,
         "query": query_text,
-        "timestamp": response_record.created_at.isoformat(),
+        "timestamp": created_at.isoformat(),
         "docs": top_docs
     })
 
-@query_bp.route('/revalidate', methods=['POST'])
-def revalidate():
-    data = request.json
-    response_id = data.get('response_id')
-    
-    db = SessionLocal()
-    
-    original_response = db.query(Response).filter(Response.id == response_id).first()
-    
-    if not original_response:
-        db.close()
-        return jsonify({"error": "Response not found", "code": 404}), 404
-        
-    query_id = original_response.query_id
-    question = original_response.query.query
-    docs_to_use = json.loads(original_response.docs_json)
-    
-    answer_json = get_llm_answer(docs_to_use, question)
-    
+def _retrieve(query_text, collections=None):
+    # faiss and numpy load on the warmup thread, not when the app is imported
+    from vector_search_demo import retrieve_top_k_faiss
+
+    return select_context_docs(retrieve_top_k_faiss(query_text, k=RETRIEVAL_K, collections=collections), query_text)
+
+def _retrieve_and_answer(query_text, collections=None):
+    # Shed (503) before any work when the LLM path is saturated
+    with llm_admission.slot():
+        top_docs = _retrieve(query_text, collections)
+        return top_docs, get_llm_answer(top_docs, query_text)
+
+def _admitted_llm_answer(top_docs, query_text):
+    with llm_admission.slot(shed=False):
+        return get_llm_answer(top_docs, query_text)
+
+def _get_or_create_query_id(user_id, query_text):
+    """Id of the user's stored query, inserting (not committing) a new one if needed.
+
+    The insert is a no-op if a concurrent request stored the same query first.
+    """
+    db = get_db()
+    lookup = db.query(Query.id).filter(
+        Query.user_id == user_id,
+        Query.query_hash == question_hash(query_text)
+    ).limit(1)
+    with stage("db_lookup"):
+        query_id = lookup.scalar()
+    if query_id is None:
+        _insert_queries(db, user_id, [query_text], datetime.utcnow())
+        query_id = lookup.scalar()
+    return query_id
+
+def _insert_queries(db, user_id, query_texts, created_at):
+    """Insert Query rows for ``query_texts``, skipping any the user already has."""
+    stmt = insert_for(db)(Query).values([
+        {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "query": query_text,
+            "query_hash": question_hash(query_text),
+            "created_at": created_at,
+        }
+        for query_text in query_texts
+    ])
+    db.execute(stmt.on_conflict_do_nothing(index_elements=[Query.user_id, Query.query_hash]))
+
+@query_bp.route('/query/batch', methods=['POST'])
+def query_batch():
+    data = request.json or {}
+    queries = data.get('queries')
+    user_id = data.get('user_id')
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of strings", "code": 400}), 400
+    if len(queries) > QUERY_BATCH_MAX:
+        return jsonify({"error": f"At most {QUERY_BATCH_MAX} queries per batch", "code": 400}), 400
+    try:
+        collections = _collections_filter(data)
+    except ValueError as e:
+        return jsonify({"error": str(e), "code": 400}), 400
+
+    # The batch is accepted only while the LLM wait queue has room; its
+    # calls then wait for slots like everyone else
+    llm_admission.check()
+    from vector_search_demo import retrieve_top_k_faiss_batch
+
+    all_docs = [
+        select_context_docs(candidates, query_text)
+        for candidates, query_text in zip(retrieve_top_k_faiss_batch(queries, k=RETRIEVAL_K, collections=collections), queries)
+    ]
+    answers = list(llm_pool.map(_admitted_llm_answer, all_docs, queries))
+
+    db = get_db()
+    hashes = {query_text: question_hash(query_text) for query_text in queries}
+
+    def stored_query_ids():
+        return {
+            q.query_hash: q.id
+            for q in db.query(Query.id, Query.query_hash).filter(
+                Query.query_hash.in_(set(hashes.values())),
+                Query.user_id == user_id
+            )
+        }
+
+    now = datetime.utcnow()
+    with stage("db_lookup"):
+        ids_by_hash = stored_query_ids()
+    missing = {hashes[q]: q for q in queries if hashes[q] not in ids_by_hash}
+    if missing:
+        _insert_queries(db, user_id, list(missing.values()), now)
+        ids_by_hash = stored_query_ids()
+    query_ids = {query_text: ids_by_hash[digest] for query_text, digest in hashes.items()}
+
+    records = []
+    results = []
+    for query_text, top_docs, answer_json in zip(queries, all_docs, answers):
+        response_id = str(uuid.uuid4())
+        records.append(Response(
+            id=response_id,
+            query_id=query_ids[query_text],
+            answer_json=json.dumps(answer_json),
+            documents=document_refs(top_docs),
+            parent_response_id=None,
+            created_at=now
+        ))
+        results.append({
+            "answer": answer_json,
+            "query_id": query_ids[query_text],
+            "response_id": response_id,
+            "query": query_text,
+            "timestamp": now.isoformat(),
+            "docs": top_docs
+        })
+    db.add_all(records)
+    with stage("db_write"):
+        db.commit()
+
+    return jsonify({"results": results})
+
+def _load_for_revalidation(db, response_id):
+    """(query_id, question, docs) of a stored response, or None if it does not exist."""
+    with stage("db_lookup"):
+        original_response = db.query(Response).filter(Response.id == response_id).first()
+        # Revalidating an archived response brings its query back to the hot tables
+        if not original_response and rehydrate(db, response_ids=[response_id]):
+            original_response = db.query(Response).filter(Response.id == response_id).first()
+        if not original_response:
+            return None
+        docs = load_response_docs(db, [original_response])[response_id]
+        return original_response.query_id, original_response.query.query, docs
+
+def _regenerate(db, response_id, query_id, question, docs_to_use, shed=True):
+    """Ask the model again and store the answer as a child of ``response_id``."""
+    # Revalidation must re-ask the model, not replay the cached answer
+    with llm_admission.slot(shed=shed):
+        answer_json = get_llm_answer(docs_to_use, question, bypass_cache=True)
+
     new_response_id = str(uuid.uuid4())
-    new_response_record = Response(
+    created_at = datetime.utcnow()
+    db.add(Response(
         id=new_response_id,
         query_id=query_id,
         answer_json=json.dumps(answer_json),
-        docs_json=json.dumps(docs_to_use),
-        parent_response_id=response_id
-    )
-    db.add(new_response_record)
-    db.commit()
-    db.refresh(new_response_record)
-    
-    response = {
+        documents=document_refs(docs_to_use),
+        parent_response_id=response_id,
+        created_at=created_at
+    ))
+    with stage("db_write"):
+        db.commit()
+
+    return {
         "answer": answer_json,
         "query_id": query_id,
         "response_id": new_response_id,
         "query": question,
-        "timestamp": new_response_record.created_at.isoformat(),
+        "timestamp": created_at.isoformat(),
         "docs": docs_to_use
     }
-    
+
+@handler("revalidate")
+def _revalidate_job(payload):
+    db = SessionLocal()
+    try:
+        original = _load_for_revalidation(db, payload["response_id"])
+        if original is None:
+            raise LookupError("Response not found")
+        db.close()
+        # Queued jobs wait for a slot instead of being shed
+        return _regenerate(db, payload["response_id"], *original, shed=False)
+    finally:
+        db.close()
+
+@query_bp.route('/revalidate', methods=['POST'])
+def revalidate():
+    data = request.json
+    response_id = data.get('response_id')
+    run_async = request.args.get('async', str(data.get('async', REVALIDATE_ASYNC))).lower() in ('1', 'true')
+    priority = data.get('priority', 'normal')
+    if run_async and priority not in PRIORITIES:
+        return jsonify({"error": f"priority must be one of {', '.join(PRIORITIES)}", "code": 400}), 400
+
+    db = get_db()
+    original = _load_for_revalidation(db, response_id)
+    if original is None:
+        return jsonify({"error": "Response not found", "code": 404}), 404
+    # Release the pooled connection while waiting on the model
     db.close()
-    return jsonify(response)
+
+    stream_format = _stream_format()
+    if stream_format:
+        query_id, question, docs_to_use = original
+        llm_admission.acquire()
+        try:
+            return _stream_answer(
+                stream_format, docs_to_use, question, query_id,
+                parent_response_id=response_id, bypass_cache=True
+            )
+        except BaseException:
+            llm_admission.release()
+            raise
+
+    if run_async:
+        try:
+            job_id = job_queue.submit("revalidate", {"response_id": response_id}, PRIORITIES[priority])
+        except QueueFull:
+            return jsonify({"error": "Job queue is full, try again later", "code": 503}), 503, {"Retry-After": "5"}
+        status_url = f"/jobs/{job_id}"
+        return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+    return jsonify(_regenerate(db, response_id, *original))
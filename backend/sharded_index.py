@@ -0,0 +1,204 @@
+"""Named document collections, each split into one or more index shards.
+
+Every shard is an ``IndexManager`` of its own, named ``<collection>:<n>``.
+A document's shard within its collection is a stable hash of its id, so
+every process agrees on it. Searches can be limited to some collections or
+shards. When more than one shard is searched, the shards run in parallel on
+a shared thread pool (FAISS releases the GIL while searching). Their
+per-shard top-k lists are then merged with a heap. A shard that misses the
+``search_timeout`` is left out, and the search reports a partial result
+instead of waiting for it.
+
+Collections are discovered on first use through ``list_collections`` and
+created on demand when documents are added to a new one. ``refresh`` finds
+the ones other processes have created since, and reloads shard snapshots
+they have rewritten.
+"""
+import hashlib
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from index_manager import IndexManager
+from metrics import shard_timeouts
+
+DEFAULT_COLLECTION = "default"
+
+
+def shard_of(doc_id, n_shards):
+    if n_shards == 1:
+        return 0
+    return int(hashlib.sha1(doc_id.encode("utf-8")).hexdigest()[:8], 16) % n_shards
+
+
+class ShardedIndex:
+    def __init__(
+        self,
+        load_shard,
+        list_collections=lambda: [DEFAULT_COLLECTION],
+        shards_per_collection=1,
+        dim=8,
+        snapshot_path=None,
+        search_workers=4,
+        search_timeout=None,
+        **manager_options,
+    ):
+        """``load_shard(collection, shard, n_shards)`` returns the shard's (doc ids, vectors)."""
+        self._load_shard = load_shard
+        self._list_collections = list_collections
+        self.shards_per_collection = shards_per_collection
+        self.dim = dim
+        self.snapshot_path = snapshot_path
+        self.search_timeout = search_timeout
+        self._manager_options = manager_options
+        self._shards = {}
+        self._collections = None
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="shard-search")
+
+    def collections(self):
+        self._discover()
+        return sorted(self._collections)
+
+    def shard_names(self, collections=None, shards=None):
+        self._discover()
+        names = [
+            name for name in self._shards
+            if (collections is None or name.rsplit(":", 1)[0] in collections)
+            and (shards is None or name in shards)
+        ]
+        return sorted(names)
+
+    @property
+    def version(self):
+        # Shard versions only grow, so the sum changes whenever any shard does
+        self._discover()
+        return sum(manager.version for manager in list(self._shards.values()))
+
+    def warm(self):
+        """Build or load every shard now, in parallel, rather than on its first search."""
+        list(self._pool.map(lambda name: self._shards[name].get_snapshot(), self.shard_names()))
+
+    def __len__(self):
+        return sum(len(self._shards[name]) for name in self.shard_names())
+
+    def __contains__(self, doc_id):
+        return any(doc_id in self._shards[name] for name in self.shard_names())
+
+    def stats(self, loaded_only=False):
+        """Vectors per shard; ``loaded_only`` skips shards not built yet instead of building them."""
+        return {
+            name: len(self._shards[name]) for name in self.shard_names()
+            if not loaded_only or self._shards[name].loaded
+        }
+
+    def search(self, query_vectors, k, collections=None, shards=None):
+        """Return (distance lists, doc id lists, partial), one list per query row, best first.
+
+        ``partial`` is True when a shard timed out and its results are missing.
+        """
+        names = self.shard_names(collections, shards)
+        empty = [[] for _ in range(len(query_vectors))]
+        if not names:
+            return empty, empty, False
+        if len(names) == 1:
+            D, ids = self._shards[names[0]].search(query_vectors, k)
+            return D, ids, False
+
+        futures = {self._pool.submit(self._shards[name].search, query_vectors, k): name for name in names}
+        done, not_done = wait(futures, timeout=self.search_timeout)
+        for future in not_done:
+            future.cancel()
+            shard_timeouts.inc(shard=futures[future])
+            print(f"[INDEX DEBUG] Shard {futures[future]} timed out; returning partial results")
+        results = [future.result() for future in done]
+
+        all_distances, all_doc_ids = [], []
+        for row in range(len(query_vectors)):
+            # Each shard's list is sorted, so a heap merge yields the global order
+            merged = heapq.merge(*(zip(D[row], ids[row]) for D, ids in results), key=lambda hit: hit[0])
+            top = list(itertools.islice(merged, k))
+            all_distances.append([distance for distance, _ in top])
+            all_doc_ids.append([doc_id for _, doc_id in top])
+        return all_distances, all_doc_ids, bool(not_done)
+
+    def add(self, doc_ids, vectors, collection=DEFAULT_COLLECTION):
+        """Insert or replace vectors, routing each document to its shard in ``collection``."""
+        self._ensure_collection(collection)
+        groups = {}
+        for row, doc_id in enumerate(doc_ids):
+            groups.setdefault(shard_of(doc_id, self.shards_per_collection), []).append(row)
+        for shard, rows in groups.items():
+            self._shards[f"{collection}:{shard}"].add([doc_ids[row] for row in rows], vectors[rows])
+
+    update = add
+
+    def delete(self, doc_ids):
+        for name in self.shard_names():
+            self._shards[name].delete(doc_ids)
+
+    def rebuild(self, persist=True):
+        for name in self.shard_names():
+            self._shards[name].rebuild(persist)
+
+    def reload(self):
+        for name in self.shard_names():
+            self._shards[name].reload()
+
+    def save(self, dirty_only=False):
+        """Write shard snapshots; with ``dirty_only``, only shards changed since they were saved."""
+        for name in self.shard_names():
+            shard = self._shards[name]
+            if not dirty_only or shard.dirty:
+                shard.save()
+
+    def refresh(self):
+        """Pick up collections and shard snapshots written by other processes.
+
+        Returns the names of the shards that were reloaded.
+        """
+        if self._collections is None:
+            return []
+        for collection in set(self._list_collections()) - self._collections:
+            self._ensure_collection(collection)
+        return [name for name in self.shard_names() if self._shards[name].refresh()]
+
+    def _discover(self):
+        if self._collections is None:
+            with self._lock:
+                if self._collections is None:
+                    collections = set(self._list_collections()) | {DEFAULT_COLLECTION}
+                    shards = {}
+                    for collection in collections:
+                        shards.update(self._new_shards(collection))
+                    self._shards = shards
+                    self._collections = collections
+
+    def _ensure_collection(self, collection):
+        self._discover()
+        if collection not in self._collections:
+            with self._lock:
+                if collection not in self._collections:
+                    # Copy-on-write so concurrent readers never see the dict change
+                    self._shards = {**self._shards, **self._new_shards(collection)}
+                    self._collections = self._collections | {collection}
+
+    def _new_shards(self, collection):
+        n = self.shards_per_collection
+        return {
+            f"{collection}:{shard}": IndexManager(
+                lambda collection=collection, shard=shard: self._load_shard(collection, shard, n),
+                dim=self.dim,
+                snapshot_path=self._shard_path(collection, shard),
+                **self._manager_options,
+            )
+            for shard in range(n)
+        }
+
+    def _shard_path(self, collection, shard):
+        if not self.snapshot_path:
+            return None
+        # The single default shard keeps the unsharded file name
+        if collection == DEFAULT_COLLECTION and self.shards_per_collection == 1:
+            return self.snapshot_path
+        return f"{self.snapshot_path}.{collection}.{shard}"
@@ -0,0 +1,202 @@
+"""Coalesce concurrent identical work into a single call.
+
+``SingleFlight.do(key, fn)`` runs ``fn`` once for every group of callers
+that ask for the same key while it is running; the others wait and get the
+same result (or exception). Nothing is kept once the call finishes, so this
+is not a cache.
+
+``DatabaseSingleFlight`` extends that across processes: the one caller per
+process that would run ``fn`` first takes a lease row in
+``inflight_queries``. Only the lease holder runs ``fn`` and stores its JSON
+result on the row, which the other processes poll for. If the holder dies,
+its lease expires and a waiting process takes over.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, fn):
+        return fn()
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers}
+
+
+class DatabaseSingleFlight(SingleFlight):
+    """SingleFlight coordinated through the database; results must be JSON-serializable.
+
+    ``lease_seconds`` bounds how long other processes wait on a leader that
+    stopped responding; ``result_ttl`` is how long a finished result stays
+    readable by processes that are still polling.
+    """
+
+    def __init__(self, lease_seconds=120, poll_interval=0.05, result_ttl=5):
+        super().__init__()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.result_ttl = result_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.remote_results = 0
+
+    def _run(self, key, fn):
+        while True:
+            state, result = self._acquire(key)
+            if state == "done":
+                with self._lock:
+                    self.remote_results += 1
+                return result
+            if state in ("leader", "local"):
+                break
+            time.sleep(self.poll_interval)
+
+        try:
+            result = fn()
+        except BaseException:
+            if state == "leader":
+                self._release(key)
+            raise
+        if state == "leader":
+            self._publish(key, result)
+        return result
+
+    def _acquire(self, key):
+        """("leader", None), ("done", result), ("wait", None), or ("local", None) if the database failed."""
+        from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+        from database import SessionLocal
+        from models import InflightQuery
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            lease_end = now + timedelta(seconds=self.lease_seconds)
+            row = db.get(InflightQuery, key)
+            if row is None:
+                db.add(InflightQuery(key=key, owner=self.owner, expires_at=lease_end))
+                try:
+                    db.commit()
+                    return "leader", None
+                except IntegrityError:
+                    db.rollback()
+                    return "wait", None
+            if row.expires_at > now:
+                if row.result_json is not None:
+                    return "done", json.loads(row.result_json)
+                return "wait", None
+            # Stale result or a leader that died: take the lease over, unless
+            # another process got there first
+            taken = db.query(InflightQuery).filter(
+                InflightQuery.key == key,
+                InflightQuery.owner == row.owner,
+                InflightQuery.expires_at == row.expires_at,
+            ).update({"owner": self.owner, "result_json": None, "expires_at": lease_end}, synchronize_session=False)
+            db.commit()
+            return ("leader" if taken else "wait"), None
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"[SINGLEFLIGHT DEBUG] Lease for {key} failed, running locally: {e}")
+            return "local", None
+        finally:
+            db.close()
+
+    def _publish(self, key, result):
+        from database import SessionLocal
+        from models import InflightQuery
+
+        db = SessionLocal()
+        try:
+            now = datetime.utcnow()
+            db.query(InflightQuery).filter(
+                InflightQuery.key == key, InflightQuery.owner == self.owner
+            ).update({
+                "result_json": json.dumps(result),
+                "expires_at": now + timedelta(seconds=self.result_ttl),
+            }, synchronize_session=False)
+            # Finished flights are only read while followers poll; drop old ones
+            db.query(InflightQuery).filter(
+                InflightQuery.result_json.isnot(None), InflightQuery.expires_at < now
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[SINGLEFLIGHT DEBUG] Publishing result for {key} failed: {e}")
+        finally:
+            db.close()
+
+    def _release(self, key):
+        """Drop the lease after a failure so a waiting process retries at once."""
+        from database import SessionLocal
+        from models import InflightQuery
+
+        db = SessionLocal()
+        try:
+            db.query(InflightQuery).filter(
+                InflightQuery.key == key, InflightQuery.owner == self.owner
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[SINGLEFLIGHT DEBUG] Releasing lease for {key} failed: {e}")
+        finally:
+            db.close()
+
+    def stats(self):
+        return {**super().stats(), "remote_results": self.remote_results}
+
+
+def singleflight_from_env():
+    """SingleFlight configured from SINGLEFLIGHT* env vars, or None when disabled."""
+    if os.environ.get("SINGLEFLIGHT", "true").lower() != "true":
+        return None
+    if os.environ.get("SINGLEFLIGHT_DB", "false").lower() == "true":
+        return DatabaseSingleFlight(
+            lease_seconds=float(os.environ.get("SINGLEFLIGHT_LEASE_SECONDS", 120)),
+            poll_interval=float(os.environ.get("SINGLEFLIGHT_POLL_INTERVAL", 0.05)),
+            result_ttl=float(os.environ.get("SINGLEFLIGHT_RESULT_TTL", 5)),
+        )
+    return SingleFlight()
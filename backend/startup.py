@@ -0,0 +1,167 @@
+"""Boot-time warmup and readiness.
+
+Importing the app only wires up routes. The slow parts of getting ready run
+in ``warm_up``:
+
+* ``database`` creates missing tables (unless ``DB_CREATE_SCHEMA=false``)
+  and opens ``DB_POOL_WARM`` pooled connections;
+* ``index`` imports faiss and loads (or builds) every index shard;
+* ``llm`` imports the OpenAI SDK and creates the shared client.
+
+With ``WARMUP=background`` (the default) this runs on a daemon thread, so
+the process starts serving ``/health`` at once. ``/ready`` answers 503 until
+the database pool and the index are warm. A failed step is retried every
+``WARMUP_RETRY_INTERVAL`` seconds, e.g. while the database is still
+starting. ``WARMUP=sync`` warms before the app finishes importing, and
+``WARMUP=off`` only creates the schema at once, leaving the rest to the
+first requests.
+
+When several processes share snapshot files (``FAISS_INDEX_PATH``), a
+watcher thread checks every ``INDEX_RELOAD_INTERVAL`` seconds whether
+another process has rewritten them and reloads the ones that changed.
+``SIGUSR2`` makes it check at once.
+"""
+import os
+import signal
+import threading
+import time
+
+WARMUP = os.environ.get("WARMUP", "background").lower()
+DB_POOL_WARM = int(os.environ.get("DB_POOL_WARM", 4))
+WARMUP_RETRY_INTERVAL = float(os.environ.get("WARMUP_RETRY_INTERVAL", 5))
+# Deployments that manage the schema with migrations can skip the catalog checks
+DB_CREATE_SCHEMA = os.environ.get("DB_CREATE_SCHEMA", "true").lower() == "true"
+# 0 checks only when signalled
+INDEX_RELOAD_INTERVAL = float(os.environ.get("INDEX_RELOAD_INTERVAL", 10))
+# Steps that must finish before /ready reports ready
+REQUIRED = ("database", "index")
+
+
+class Readiness:
+    def __init__(self, steps):
+        self._started = time.monotonic()
+        self.checks = {name: {"status": "pending"} for name in steps}
+        self._lock = threading.Lock()
+
+    def update(self, name, status, **details):
+        with self._lock:
+            self.checks = {**self.checks, name: {"status": status, **details}}
+
+    @property
+    def ready(self):
+        return all(self.checks[name]["status"] in ("ready", "skipped") for name in REQUIRED)
+
+    def snapshot(self):
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.monotonic() - self._started, 3),
+            "checks": self.checks,
+        }
+
+
+def _warm_database():
+    from database import init_schema, warm_pool
+
+    if DB_CREATE_SCHEMA:
+        init_schema()
+    return {"connections": warm_pool(DB_POOL_WARM)}
+
+
+def _warm_index():
+    from vector_search_demo import index_manager
+
+    index_manager.warm()
+    return {"shards": len(index_manager.shard_names()), "vectors": len(index_manager)}
+
+
+def _warm_llm():
+    from llm import gateway
+
+    if gateway is None:
+        return {"client": "mock"}
+    gateway.client
+    return {"client": gateway.model}
+
+
+STEPS = {"database": _warm_database, "index": _warm_index, "llm": _warm_llm}
+readiness = Readiness(STEPS)
+
+
+def warm_up(retry_interval=None):
+    """Run every warmup step, recording each in ``readiness``.
+
+    With a ``retry_interval`` failed steps are retried until they succeed.
+    """
+    pending = list(STEPS)
+    while pending:
+        for name in list(pending):
+            readiness.update(name, "warming")
+            start = time.perf_counter()
+            try:
+                details = STEPS[name]()
+            except Exception as e:
+                print(f"[STARTUP DEBUG] Warmup step {name} failed: {e}")
+                readiness.update(name, "failed", error=str(e))
+                continue
+            elapsed = round(time.perf_counter() - start, 3)
+            readiness.update(name, "ready", seconds=elapsed, **details)
+            print(f"[STARTUP DEBUG] Warmed {name} in {elapsed}s")
+            pending.remove(name)
+        if pending and retry_interval is None:
+            return
+        if pending:
+            time.sleep(retry_interval)
+
+
+def start_warmup():
+    if WARMUP == "sync":
+        warm_up()
+    elif WARMUP == "background":
+        threading.Thread(
+            target=warm_up, args=(WARMUP_RETRY_INTERVAL,), name="warmup", daemon=True
+        ).start()
+    else:
+        if DB_CREATE_SCHEMA:
+            from database import init_schema
+
+            init_schema()
+        for name in STEPS:
+            readiness.update(name, "skipped")
+        print("[STARTUP DEBUG] Warmup disabled; index and connections load on first use")
+
+
+_reload_requested = threading.Event()
+
+
+def refresh_snapshots():
+    """Reload index shards and the document snapshot if other processes rewrote them."""
+    from document_store import document_store
+    from vector_search_demo import index_manager
+
+    shards = index_manager.refresh()
+    documents = document_store.refresh()
+    if shards or documents:
+        print(f"[STARTUP DEBUG] Reloaded shards {shards or 'none'}, document snapshot: {documents}")
+    return shards, documents
+
+
+def _watch_snapshots(interval):
+    while True:
+        _reload_requested.wait(interval or None)
+        _reload_requested.clear()
+        try:
+            refresh_snapshots()
+        except Exception as e:
+            print(f"[STARTUP DEBUG] Snapshot reload failed: {e}")
+
+
+def start_snapshot_watcher():
+    if not os.environ.get("FAISS_INDEX_PATH"):
+        return
+    threading.Thread(
+        target=_watch_snapshots, args=(INDEX_RELOAD_INTERVAL,), name="snapshot-watcher", daemon=True
+    ).start()
+    # Handlers can only be installed from the main thread (true for gunicorn
+    # workers and the dev server); the handler just wakes the watcher
+    if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2, lambda signum, frame: _reload_requested.set())
@@ -0,0 +1,53 @@
+"""Shared test setup.
+
+The app reads its configuration when modules are imported, so the
+environment is fixed here, before any test imports them: a throwaway SQLite
+database, mock LLM answers, no warmup thread and no shared snapshots.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+_tmp = tempfile.mkdtemp(prefix="genai-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp}/test.db",
+    "OPENAI_API_KEY": "",
+    "LLM_STUB": "false",
+    "WARMUP": "off",
+    "FAISS_INDEX_PATH": "",
+    "DOCUMENT_SNAPSHOT_PATH": "",
+    "RATE_LIMITS": "",
+    "JOB_QUEUE_BACKEND": "memory",
+    "JOB_POLL_INTERVAL": "0.05",
+})
+
+
+@pytest.fixture(scope="session")
+def flask_app():
+    # Importing the app creates the schema (WARMUP=off) and starts job workers
+    from app import app
+
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def db(flask_app):
+    from database import SessionLocal
+
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def user_id():
+    """A fresh user, so tests sharing the database do not see each other's history."""
+    return f"test-{uuid.uuid4().hex[:12]}"
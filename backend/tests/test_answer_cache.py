@@ -0,0 +1,19 @@
+from answer_cache import answer_cache_key
+
+DOCS = [{"id": "doc_01", "text": "Tesla faces battery supply shortages."}, {"id": "doc_02", "text": "Cybertruck delayed."}]
+
+
+def test_key_normalizes_the_question():
+    assert answer_cache_key("Tesla  supply", DOCS, "m", "1") == answer_cache_key(" tesla supply", DOCS, "m", "1")
+
+
+def test_key_changes_with_doc_order_model_and_prompt():
+    key = answer_cache_key("Tesla", DOCS, "m", "1")
+    assert answer_cache_key("Tesla", DOCS[::-1], "m", "1") != key
+    assert answer_cache_key("Tesla", DOCS, "other", "1") != key
+    assert answer_cache_key("Tesla", DOCS, "m", "2") != key
+
+
+def test_key_changes_when_a_document_is_edited():
+    edited = [{**DOCS[0], "text": "Tesla resolved its battery shortages."}, DOCS[1]]
+    assert answer_cache_key("Tesla", edited, "m", "1") != answer_cache_key("Tesla", DOCS, "m", "1")
@@ -0,0 +1,50 @@
+import json
+
+from answer_stream import AnswerStreamParser
+
+ANSWER = {
+    "summary": ["Tesla faces \"supply\" issues", "Batteries are short"],
+    "facts": ["Production slowed. [Source: doc_01]"],
+}
+
+
+def feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def expected_items(answer):
+    return [(field, item) for field in ("summary", "facts") for item in answer[field]]
+
+
+def test_whole_answer_in_one_chunk():
+    assert feed_all(AnswerStreamParser(), [json.dumps(ANSWER)]) == expected_items(ANSWER)
+
+
+def test_one_character_at_a_time():
+    assert feed_all(AnswerStreamParser(), list(json.dumps(ANSWER))) == expected_items(ANSWER)
+
+
+def test_items_are_emitted_as_soon_as_they_close():
+    parser = AnswerStreamParser()
+    assert parser.feed('{"summary": ["first", "sec') == [("summary", "first")]
+    assert parser.feed('ond"') == [("summary", "second")]
+    assert parser.feed("]}") == []
+
+
+def test_preamble_and_escapes():
+    text = 'Here you go: {"summary": ["line\\nbreak", "caf\\u00e9"], "facts": []}'
+    assert feed_all(AnswerStreamParser(), [text]) == [("summary", "line\nbreak"), ("summary", "café")]
+
+
+def test_other_keys_and_nested_values_are_ignored():
+    text = '{"note": "x", "extra": ["skip"], "meta": {"summary": ["nested"]}, "facts": ["kept"]}'
+    assert feed_all(AnswerStreamParser(), [text]) == [("facts", "kept")]
+
+
+def test_custom_fields():
+    assert feed_all(AnswerStreamParser(fields=("facts",)), [json.dumps(ANSWER)]) == [
+        ("facts", ANSWER["facts"][0])
+    ]
@@ -0,0 +1,273 @@
+"""Response contracts of the HTTP endpoints, through the Flask test client."""
+import json
+import time
+import uuid
+
+import pytest
+
+ANSWER_KEYS = {"answer", "query_id", "response_id", "query", "timestamp", "docs"}
+
+
+def wait_for_job(client, status_url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"{status_url} did not finish")
+
+
+def test_health_and_ready(client):
+    health = client.get("/health")
+    assert health.status_code == 200 and health.get_json()["database"] == "connected"
+    ready = client.get("/ready")
+    assert ready.status_code == 200
+    body = ready.get_json()
+    assert body["ready"] is True
+    assert set(body["checks"]) == {"database", "index", "llm"}
+
+
+def test_metrics_and_cache_stats(client):
+    client.post("/query", json={"query": "Tesla supply", "user_id": "metrics"})
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert "genai_" in metrics.get_data(as_text=True)
+    stats = client.get("/cache/stats").get_json()
+    assert "answers" in stats and {"hits", "misses"} <= set(stats["answers"])
+
+
+def test_unknown_route_is_json_404(client):
+    response = client.get("/no-such-route")
+    assert response.status_code == 404
+    assert response.get_json() == {"error": "Not found", "code": 404}
+
+
+def test_trace_id_is_propagated(client):
+    response = client.get("/health", headers={"X-Trace-Id": "abc-123"})
+    assert response.headers["X-Trace-Id"] == "abc-123"
+    generated = client.get("/health", headers={"X-Trace-Id": "not valid!"}).headers["X-Trace-Id"]
+    assert generated != "not valid!" and len(generated) == 32
+
+
+def test_query(client, user_id):
+    response = client.post("/query", json={"query": "Tesla battery supply", "user_id": user_id})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body) == ANSWER_KEYS
+    assert body["answer"]["summary"] and body["docs"]
+    assert {"id", "text"} <= set(body["docs"][0])
+    # The same question from the same user reuses the stored query
+    again = client.post("/query", json={"query": "tesla battery supply ", "user_id": user_id}).get_json()
+    assert again["query_id"] == body["query_id"] and again["response_id"] != body["response_id"]
+
+
+def test_query_rejects_bad_collections(client):
+    response = client.post("/query", json={"query": "Tesla", "collections": []})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("fmt, mimetype", [("ndjson", "application/x-ndjson"), ("sse", "text/event-stream")])
+def test_query_stream(client, user_id, fmt, mimetype):
+    response = client.post(f"/query?stream={fmt}", json={"query": "Tesla supply", "user_id": user_id})
+    assert response.status_code == 200 and response.mimetype == mimetype
+    body = response.get_data(as_text=True)
+    if fmt == "ndjson":
+        events = [json.loads(line) for line in body.splitlines()]
+    else:
+        events = [
+            {"event": block.split("\n")[0][len("event: "):], "data": json.loads(block.split("\n")[1][len("data: "):])}
+            for block in body.strip().split("\n\n")
+        ]
+    names = [event["event"] for event in events]
+    assert names[0] == "docs" and names[-1] == "done"
+    assert set(names[1:-1]) <= {"summary", "facts"}
+    done = events[-1]["data"]
+    assert set(done) == ANSWER_KEYS
+    assert [e["data"]["item"] for e in events if e["event"] == "summary"] == done["answer"]["summary"]
+
+
+def test_query_batch(client, user_id):
+    response = client.post("/query/batch", json={"queries": ["Tesla supply", "AI chips"], "user_id": user_id})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [result["query"] for result in results] == ["Tesla supply", "AI chips"]
+    assert all(set(result) == ANSWER_KEYS for result in results)
+
+
+@pytest.mark.parametrize("payload", [{}, {"queries": []}, {"queries": ["ok", ""]}, {"queries": "Tesla"}])
+def test_query_batch_rejects_bad_input(client, payload):
+    response = client.post("/query/batch", json=payload)
+    assert response.status_code == 400 and response.get_json()["code"] == 400
+
+
+def test_revalidate(client, user_id):
+    original = client.post("/query", json={"query": "Tesla supply", "user_id": user_id}).get_json()
+    response = client.post("/revalidate", json={"response_id": original["response_id"]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert set(body) == ANSWER_KEYS
+    assert body["query_id"] == original["query_id"] and body["response_id"] != original["response_id"]
+    assert [doc["id"] for doc in body["docs"]] == [doc["id"] for doc in original["docs"]]
+
+
+def test_revalidate_unknown_response(client):
+    response = client.post("/revalidate", json={"response_id": "missing"})
+    assert response.status_code == 404
+
+
+
+def test_revalidate_stream_releases_slot_on_error(client, user_id, monkeypatch):
+    import routes.query
+    from admission import llm_admission
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("stream setup failed")
+
+    original = client.post("/query", json={"query": "Tesla supply", "user_id": user_id}).get_json()
+    monkeypatch.setattr(routes.query, "_stream_answer", broken)
+    before = llm_admission.stats()["in_flight"]
+    with pytest.raises(RuntimeError):
+        client.post("/revalidate?stream=ndjson", json={"response_id": original["response_id"]})
+    assert llm_admission.stats()["in_flight"] == before
+
+def test_revalidate_async_job(client, user_id):
+    original = client.post("/query", json={"query": "Tesla supply", "user_id": user_id}).get_json()
+    response = client.post("/revalidate?async=true", json={"response_id": original["response_id"]})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status"] == "queued" and response.headers["Location"] == body["status_url"]
+    job = wait_for_job(client, body["status_url"])
+    assert job["status"] == "succeeded" and job["kind"] == "revalidate"
+    assert job["result"]["query_id"] == original["query_id"]
+
+
+def test_revalidate_rejects_unknown_priority(client):
+    response = client.post("/revalidate?async=true", json={"response_id": "x", "priority": "urgent"})
+    assert response.status_code == 400
+
+
+def test_unknown_job(client):
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_feedback_upsert_and_aggregates(client, user_id):
+    answer = client.post("/query", json={"query": "Tesla supply", "user_id": user_id}).get_json()
+    feedback = {"user_id": user_id, "query_id": answer["query_id"], "response_id": answer["response_id"]}
+    first = client.post("/feedback", json={**feedback, "rating": "like", "comment": "good"})
+    assert first.status_code == 201
+    # One row per user and response: a second rating updates it
+    second = client.post("/feedback", json={**feedback, "rating": "dislike"})
+    assert second.status_code == 200
+    assert second.get_json()["feedback_id"] == first.get_json()["feedback_id"]
+    client.post("/feedback", json={**feedback, "user_id": f"{user_id}-2", "rating": "dislike"})
+
+    aggregate = client.get("/feedback/aggregate", query_string={"response_id": answer["response_id"]})
+    assert aggregate.get_json() == {"likes": 0, "dislikes": 2}
+    bulk = client.post("/feedback/aggregate/bulk", json={"response_ids": [answer["response_id"], "none"]})
+    assert bulk.get_json() == {answer["response_id"]: {"likes": 0, "dislikes": 2}, "none": {"likes": 0, "dislikes": 0}}
+
+
+def test_feedback_rejects_bad_input(client):
+    assert client.post("/feedback", json={"user_id": "u"}).status_code == 400
+    assert client.get("/feedback/aggregate").status_code == 400
+    assert client.post("/feedback/aggregate/bulk", json={"response_ids": "x"}).status_code == 400
+
+
+def test_documents_lifecycle(client):
+    from document_store import document_store
+
+    def vectors():
+        return client.get("/collections").get_json()["collections"]["default"]["vectors"]
+
+    doc_id = f"test-{uuid.uuid4().hex[:8]}"
+    lines = [
+        {"id": doc_id, "text": "Zeppelin airships return for cargo routes."},
+        {"id": "doc_01", "text": "Seed documents are skipped."},
+    ]
+    before = vectors()
+    response = client.post(
+        "/documents/bulk",
+        data="".join(json.dumps(line) + "\n" for line in lines),
+        content_type="application/x-ndjson",
+    )
+    assert response.status_code == 201
+    assert response.get_json() == {"status": "success", "inserted": 1, "skipped": 1}
+    assert vectors() == before + 1
+
+    text = "Zeppelin airships now carry tourists."
+    updated = client.put(f"/documents/{doc_id}", json={"text": text})
+    assert updated.get_json() == {"status": "success", "id": doc_id}
+    assert document_store.get_many([doc_id]) == [{"id": doc_id, "text": text}]
+    assert vectors() == before + 1
+
+    assert client.delete(f"/documents/{doc_id}").status_code == 200
+    assert client.delete(f"/documents/{doc_id}").status_code == 404
+    assert client.put(f"/documents/{doc_id}", json={"text": "x"}).status_code == 404
+    assert client.put(f"/documents/{doc_id}", json={}).status_code == 400
+    assert vectors() == before
+    assert document_store.get_many([doc_id]) == []
+
+
+def test_documents_bulk_rejects_bad_input(client):
+    assert client.post("/documents/bulk?batch_size=0", data="").status_code == 400
+    assert client.post("/documents/bulk?collection=bad%20name", data="").status_code == 400
+    response = client.post("/documents/bulk", data="not json\n", content_type="application/x-ndjson")
+    assert response.status_code == 400 and response.get_json()["inserted"] == 0
+
+
+def test_collections(client):
+    collections = client.get("/collections").get_json()["collections"]
+    assert collections["default"]["vectors"] >= 20
+    assert sum(collections["default"]["shards"].values()) == collections["default"]["vectors"]
+
+
+def test_history_archive_job(client):
+    response = client.post("/history/archive", json={"before": "2000-01-01T00:00:00"})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()["status_url"])
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"queries": 0, "responses": 0, "chunks": 0}
+
+
+@pytest.mark.parametrize("payload", [{}, {"older_than_days": "soon"}, {"older_than_days": 1, "batch_size": 0}])
+def test_history_archive_rejects_bad_input(client, payload):
+    assert client.post("/history/archive", json=payload).status_code == 400
+
+
+def test_history_rehydrate(client):
+    assert client.post("/history/rehydrate", json={}).status_code == 400
+    assert client.post("/history/rehydrate", json={"query_ids": "q"}).status_code == 400
+    response = client.post("/history/rehydrate", json={"response_ids": ["not-archived"]})
+    assert response.get_json() == {"rehydrated": 0}
+
+
+def test_rate_limit(client, monkeypatch):
+    import app as app_module
+    from ratelimit import MemoryRateLimiter, parse_rules
+
+    monkeypatch.setattr(app_module, "rate_limiter", MemoryRateLimiter(parse_rules("/feedback/aggregate=1/minute")))
+    path = "/feedback/aggregate?response_id=r"
+
+    def get(addr, user=None):
+        return client.get(path, headers={"X-User-Id": user} if user else {}, environ_base={"REMOTE_ADDR": addr})
+
+    assert get("10.0.0.1", "alice").status_code == 200
+    limited = get("10.0.0.1", "bob")
+    # A fresh user id does not buy a fresh bucket
+    assert limited.status_code == 429
+    assert limited.get_json()["code"] == 429 and int(limited.headers["Retry-After"]) >= 1
+    assert get("10.0.0.2").status_code == 200
+    # ...but an exhausted one still limits from another address
+    assert get("10.0.0.3", "alice").status_code == 429
+    # Endpoints without a rule are not limited
+    assert all(client.get("/health", environ_base={"REMOTE_ADDR": "10.0.0.1"}).status_code == 200 for _ in range(3))
+
+def test_deleting_a_seed_document_changes_nothing(client):
+    from vector_search_demo import index_manager
+
+    before = len(index_manager)
+    response = client.delete("/documents/doc_01")
+    assert response.status_code == 404
+    assert "doc_01" in index_manager and len(index_manager) == before
@@ -0,0 +1,136 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import archive
+from answer_cache import question_hash
+from models import ArchivedResponse, Feedback, Query, Response, ResponseArchiveChunk, ResponseDocument
+from response_docs import document_refs
+
+# Older than anything the other tests write, so only these rows are archived
+CREATED = datetime(2020, 1, 15, 12, 0)
+CUTOFF = datetime(2020, 3, 1)
+
+
+@pytest.mark.parametrize("codec", ["gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    archive.zstandard is None, reason="zstandard is not installed"))])
+def test_compress_round_trip(codec):
+    data = b'{"id": "r1"}\n' * 100
+    compressed = archive.compress(data, codec)
+    assert len(compressed) < len(data)
+    assert archive.decompress(compressed, codec) == data
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        archive.compress(b"", "lz4")
+
+
+@pytest.fixture
+def old_chain(db, user_id):
+    """A query from 2020 with a response, its regeneration a month later, doc refs and feedback."""
+    query_id = str(uuid.uuid4())
+    parent_id, child_id = str(uuid.uuid4()), str(uuid.uuid4())
+    db.add(Query(id=query_id, user_id=user_id, query="Tesla supply", query_hash=question_hash("Tesla supply"),
+                 created_at=CREATED))
+    db.flush()
+    db.add(Response(id=parent_id, query_id=query_id, answer_json=json.dumps({"summary": ["a"], "facts": []}),
+                    documents=document_refs([{"id": "doc_01", "score": 0.9}, {"id": "doc_02", "score": 0.5}]),
+                    created_at=CREATED))
+    db.flush()
+    db.add(Response(id=child_id, query_id=query_id, answer_json=json.dumps({"summary": ["b"], "facts": []}),
+                    documents=document_refs([{"id": "doc_01", "score": 0.8}]),
+                    parent_response_id=parent_id, created_at=CREATED + timedelta(days=31)))
+    db.add(Feedback(id=str(uuid.uuid4()), user_id=user_id, query_id=query_id, response_id=parent_id,
+                    rating="like", comment="useful", created_at=CREATED))
+    db.commit()
+    return query_id, parent_id, child_id
+
+
+def test_archive_and_rehydrate_round_trip(db, old_chain, user_id):
+    query_id, parent_id, child_id = old_chain
+    counts = archive.archive_responses(CUTOFF, codec="gzip")
+    assert counts == {"queries": 1, "responses": 2, "chunks": 2}
+
+    db.expire_all()
+    assert db.query(Response).filter(Response.query_id == query_id).count() == 0
+    assert db.query(ResponseDocument).filter(ResponseDocument.response_id.in_([parent_id, child_id])).count() == 0
+    assert db.query(Feedback).filter(Feedback.response_id == parent_id).count() == 0
+    assert archive.is_archived(db, parent_id) and archive.is_archived(db, child_id)
+    # One chunk per month
+    chunk_ids = {row.chunk_id for row in db.query(ArchivedResponse).filter(ArchivedResponse.query_id == query_id)}
+    assert {db.get(ResponseArchiveChunk, chunk_id).partition for chunk_id in chunk_ids} == {"2020-01", "2020-02"}
+
+    records = {record["id"]: record for record in archive.iter_archived(db, until=CUTOFF)}
+    assert records[parent_id]["user_id"] == user_id
+    assert [doc["id"] for doc in records[parent_id]["docs"]] == ["doc_01", "doc_02"]
+    assert records[parent_id]["docs"][0]["text"]
+    assert records[parent_id]["feedback"][0]["rating"] == "like"
+    assert records[child_id]["parent_response_id"] == parent_id
+
+    # Asking for one response brings the whole query back
+    assert archive.rehydrate(db, response_ids=[child_id]) == 2
+    db.expire_all()
+    restored = {row.id: row for row in db.query(Response).filter(Response.query_id == query_id)}
+    assert set(restored) == {parent_id, child_id}
+    assert restored[child_id].parent_response_id == parent_id
+    assert [(ref.rank, ref.doc_id, ref.score) for ref in restored[parent_id].documents] == [
+        (0, "doc_01", 0.9), (1, "doc_02", 0.5)
+    ]
+    feedback = db.query(Feedback).filter(Feedback.response_id == parent_id).one()
+    assert (feedback.user_id, feedback.rating, feedback.comment) == (user_id, "like", "useful")
+    assert not archive.is_archived(db, parent_id)
+    # Emptied chunks are deleted
+    assert all(db.get(ResponseArchiveChunk, chunk_id) is None for chunk_id in chunk_ids)
+
+
+def test_queries_with_recent_responses_stay_hot(db, old_chain):
+    query_id, parent_id, _ = old_chain
+    db.add(Response(id=str(uuid.uuid4()), query_id=query_id, answer_json="{}", parent_response_id=parent_id,
+                    created_at=datetime.utcnow()))
+    db.commit()
+    archive.archive_responses(CUTOFF, codec="gzip")
+    assert not archive.is_archived(db, parent_id)
+    assert db.query(Response).filter(Response.query_id == query_id).count() == 3
+
+
+def test_archived_response_history_is_read_in_place(client, db, old_chain):
+    _, parent_id, child_id = old_chain
+    archive.archive_responses(CUTOFF, codec="gzip")
+    response = client.get(f"/responses/{parent_id}/history")
+    assert response.status_code == 200
+    [item] = response.get_json()
+    assert item["response_id"] == child_id and item["answer"]["summary"] == ["b"]
+    assert [doc["id"] for doc in item["docs"]] == ["doc_01"]
+    # A GET does not move the chain back
+    db.expire_all()
+    assert archive.is_archived(db, parent_id) and db.get(Response, child_id) is None
+
+
+def test_regeneration_during_archival_keeps_the_query_hot(db, old_chain, monkeypatch):
+    from database import SessionLocal
+
+    query_id, parent_id, child_id = old_chain
+    fill_chunk = archive._fill_chunk
+    raced = []
+
+    def regenerate_then_fill(*args):
+        # Between reading the batch and deleting it, a regeneration lands
+        if not raced:
+            other = SessionLocal()
+            other.add(Response(id=str(uuid.uuid4()), query_id=query_id, answer_json="{}",
+                               parent_response_id=child_id, created_at=datetime.utcnow()))
+            other.commit()
+            other.close()
+            raced.append(True)
+        return fill_chunk(*args)
+
+    monkeypatch.setattr(archive, "_fill_chunk", regenerate_then_fill)
+    counts = archive.archive_responses(CUTOFF, codec="gzip")
+    assert raced and counts["responses"] == 0
+    db.expire_all()
+    assert not archive.is_archived(db, parent_id) and not archive.is_archived(db, child_id)
+    assert db.query(Response).filter(Response.query_id == query_id).count() == 3
+    assert db.query(Feedback).filter(Feedback.response_id == parent_id).count() == 1
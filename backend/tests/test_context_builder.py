@@ -0,0 +1,60 @@
+from context_builder import ContextBuilder, count_chars, terms
+
+DOCS = [
+    {"id": "doc_a", "text": "Tesla faces battery supply shortages. The weather was mild. Cybertruck output slowed."},
+    {"id": "doc_b", "text": "Nvidia ships new AI chips. Demand for data center GPUs keeps growing."},
+    {"id": "doc_c", "text": "Tesla faces battery supply shortages this quarter."},
+]
+
+
+def test_terms_drop_stopwords_and_plurals():
+    assert terms("What are the latest Tesla batteries?") == {"tesla", "batterie"}
+    assert terms("chips and GPUs") == {"chip", "gpu"}
+
+
+def test_keeps_relevant_sentences_in_rank_order():
+    context = ContextBuilder().build(DOCS[:2], "Tesla battery supply")
+    lines = context.text.splitlines()
+    assert lines[0] == "1. doc_a: Tesla faces battery supply shortages."
+    # No sentence of doc_b matches, so its lead sentence stands in
+    assert lines[1] == "2. doc_b: Nvidia ships new AI chips."
+    assert context.doc_ids == ["doc_a", "doc_b"]
+    assert context.tokens == sum(count_chars(line) + 1 for line in lines)
+
+
+def test_drops_near_duplicate_passages():
+    context = ContextBuilder().build([DOCS[0], DOCS[2]], "Tesla battery supply")
+    assert context.doc_ids == ["doc_a"]
+
+
+def test_never_exceeds_budget():
+    builder = ContextBuilder(budget=30)
+    for question in ("Tesla battery", "AI chips", "anything"):
+        assert builder.build(DOCS, question).tokens <= 30
+
+
+def test_truncates_passage_that_does_not_fit():
+    long_doc = {"id": "doc_l", "text": " ".join(["Tesla battery supply"] * 40) + "."}
+    context = ContextBuilder(budget=40).build([long_doc], "Tesla battery supply")
+    assert context.doc_ids == ["doc_l"]
+    assert context.text.endswith(" ...")
+    assert context.tokens <= 40
+
+
+def test_first_passage_is_kept_even_under_a_tiny_budget():
+    context = ContextBuilder(budget=8).build(DOCS[:1], "Tesla battery supply")
+    assert context.doc_ids == ["doc_a"]
+    assert context.tokens <= 8
+
+
+def test_later_passages_need_min_words():
+    builder = ContextBuilder()
+    chosen = [("one two three four five six seven eight nine ten", frozenset())]
+    assert builder.fit("1. x: ", chosen, remaining=6, min_words=8) is None
+    chosen, text, tokens = builder.fit("1. x: ", chosen, remaining=6, min_words=1)
+    assert text.endswith(" ...") and tokens <= 6
+
+
+def test_empty_docs():
+    context = ContextBuilder().build([{"id": "doc_e", "text": ""}], "Tesla")
+    assert (context.text, context.doc_ids, context.tokens) == ("", [], 0)
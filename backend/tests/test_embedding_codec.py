@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from embedding_codec import EMBEDDING_DTYPES, decode_embedding, encode_embedding
+
+VECTOR = np.array([0.5, -1.25, 3.0, 0.0, -0.001, 2.75, -3.0, 1.0], dtype="float32")
+
+
+def test_float32_is_lossless():
+    data = encode_embedding(VECTOR, "float32")
+    assert len(data) == 4 * len(VECTOR)
+    assert np.array_equal(decode_embedding(data, "float32"), VECTOR)
+
+
+def test_float16_halves_size():
+    data = encode_embedding(VECTOR, "float16")
+    assert len(data) == 2 * len(VECTOR)
+    np.testing.assert_allclose(decode_embedding(data, "float16"), VECTOR, atol=1e-3)
+
+
+def test_int8_stores_scale_and_one_byte_per_dimension():
+    data = encode_embedding(VECTOR, "int8")
+    assert len(data) == 4 + len(VECTOR)
+    decoded = decode_embedding(data, "int8")
+    # Symmetric quantization: error is at most half a step of peak / 127
+    np.testing.assert_allclose(decoded, VECTOR, atol=3.0 / 127 / 2 + 1e-6)
+    # The peaks map to +-127 and come back exactly
+    assert (decoded[2], decoded[6]) == pytest.approx((3.0, -3.0))
+
+
+def test_int8_zero_vector():
+    zeros = np.zeros(8, dtype="float32")
+    assert np.array_equal(decode_embedding(encode_embedding(zeros, "int8"), "int8"), zeros)
+
+
+@pytest.mark.parametrize("dtype", EMBEDDING_DTYPES)
+def test_decode_returns_float32(dtype):
+    assert decode_embedding(encode_embedding(VECTOR, dtype), dtype).dtype == np.float32
+
+
+def test_unknown_dtype():
+    with pytest.raises(ValueError):
+        encode_embedding(VECTOR, "float64")
+    with pytest.raises(ValueError):
+        decode_embedding(b"", "bfloat16")
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+QUESTIONS = ["Tesla supply", "AI chips", "drone delivery", "video translation", "cloud revenue"]
+
+
+def ask(client, user_id, question):
+    response = client.post("/query", json={"query": question, "user_id": user_id})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def pages(client, path, **params):
+    """Every page of a paginated endpoint, following X-Next-Cursor."""
+    result = []
+    while True:
+        response = client.get(path, query_string=params)
+        assert response.status_code == 200
+        result.append(response.get_json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return result
+        params["cursor"] = cursor
+
+
+def test_history_cursor_walks_every_response_once(client, user_id):
+    asked = [ask(client, user_id, question)["response_id"] for question in QUESTIONS]
+    result = pages(client, "/history", user_id=user_id, limit=2)
+    assert [len(page) for page in result] == [2, 2, 1]
+    items = [item for page in result for item in page]
+    # Newest first
+    assert [item["response_id"] for item in items] == asked[::-1]
+    assert items[0]["query"] == QUESTIONS[-1]
+    assert items[0]["docs"] and items[0]["answer"]["summary"]
+
+
+def test_history_last_page_has_no_cursor(client, user_id):
+    ask(client, user_id, "Tesla supply")
+    response = client.get("/history", query_string={"user_id": user_id, "limit": 1})
+    assert len(response.get_json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_history_shows_the_users_rating(client, user_id):
+    answer = ask(client, user_id, "Tesla supply")
+    client.post("/feedback", json={
+        "user_id": user_id, "query_id": answer["query_id"], "response_id": answer["response_id"], "rating": "like",
+    })
+    [item] = client.get("/history", query_string={"user_id": user_id}).get_json()
+    assert item["feedback"] == {"rating": "like"}
+
+
+def test_response_history_cursor_is_oldest_first(client, user_id):
+    original = ask(client, user_id, "Tesla supply")["response_id"]
+    regenerated = [
+        client.post("/revalidate", json={"response_id": original}).get_json()["response_id"] for _ in range(3)
+    ]
+    result = pages(client, f"/responses/{original}/history", limit=2)
+    assert [item["response_id"] for page in result for item in page] == regenerated
+    # Regenerations are not listed as separate history entries
+    assert [item["response_id"] for item in client.get("/history", query_string={"user_id": user_id}).get_json()] == [
+        original
+    ]
+
+
+@pytest.mark.parametrize("params", [{"limit": 0}, {"limit": "x"}, {"cursor": "not-a-cursor"}])
+def test_bad_page_args(client, params):
+    response = client.get("/history", query_string=params)
+    assert response.status_code == 400
+    assert response.get_json()["code"] == 400
+
+
+def test_limit_is_capped(client, user_id, monkeypatch):
+    import routes.history
+
+    monkeypatch.setattr(routes.history, "HISTORY_PAGE_MAX", 2)
+    for question in QUESTIONS[:3]:
+        ask(client, user_id, question)
+    response = client.get("/history", query_string={"user_id": user_id, "limit": 500})
+    assert len(response.get_json()) == 2
+    assert response.headers["X-Next-Cursor"]
+
+
+def test_export_streams_every_response(client, user_id):
+    original = ask(client, user_id, "Tesla supply")["response_id"]
+    client.post("/revalidate", json={"response_id": original})
+    response = client.get("/history/export", query_string={"user_id": user_id})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    items = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [item["parent_response_id"] for item in items] == [None, original]
+    assert all(item["user_id"] == user_id and item["archived"] is False for item in items)
+
+
+def test_export_rejects_bad_timestamps(client):
+    assert client.get("/history/export", query_string={"since": "yesterday"}).status_code == 400
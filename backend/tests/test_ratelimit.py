@@ -0,0 +1,71 @@
+import uuid
+
+import pytest
+
+import ratelimit
+from ratelimit import DatabaseRateLimiter, MemoryRateLimiter, parse_rules
+
+
+def test_parse_rules():
+    rules = parse_rules(" /query=60/minute, /revalidate=2/s ,")
+    assert rules == {"/query": (60.0, 1.0), "/revalidate": (2.0, 2.0)}
+    assert parse_rules("") == {}
+
+
+@pytest.mark.parametrize("spec", ["/query", "/query=60", "/query=60/fortnight", "/query=x/minute"])
+def test_parse_rules_rejects_bad_rules(spec):
+    with pytest.raises(ValueError):
+        parse_rules(spec)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    monkeypatch.setattr(ratelimit.time, "time", clock)
+    return clock
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    limiter = MemoryRateLimiter(parse_rules("/query=2/minute"))
+    assert limiter.check("/query", "alice") == (True, 0.0)
+    assert limiter.check("/query", "alice") == (True, 0.0)
+    allowed, retry_after = limiter.check("/query", "alice")
+    assert not allowed and retry_after == pytest.approx(30)
+    clock.now += 30
+    assert limiter.check("/query", "alice")[0]
+
+
+def test_buckets_are_per_user_and_endpoint(clock):
+    limiter = MemoryRateLimiter(parse_rules("/query=1/minute"))
+    assert limiter.check("/query", "alice")[0]
+    assert not limiter.check("/query", "alice")[0]
+    assert limiter.check("/query", "bob")[0]
+    # No rule, no limit
+    assert all(limiter.check("/history", "alice")[0] for _ in range(10))
+
+
+def test_forgotten_keys_start_full(clock):
+    limiter = MemoryRateLimiter(parse_rules("/query=1/minute"), max_keys=1)
+    assert limiter.check("/query", "alice")[0]
+    assert limiter.check("/query", "bob")[0]
+    assert limiter.check("/query", "alice")[0]
+
+
+def test_database_buckets(flask_app, clock):
+    limiter = DatabaseRateLimiter(parse_rules("/query=2/minute"))
+    user = uuid.uuid4().hex
+    assert limiter.check("/query", user)[0]
+    assert limiter.check("/query", user)[0]
+    allowed, retry_after = limiter.check("/query", user)
+    assert not allowed and retry_after == pytest.approx(30)
+    clock.now += 30
+    assert limiter.check("/query", user)[0]
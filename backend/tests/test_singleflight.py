@@ -0,0 +1,90 @@
+import threading
+import uuid
+
+import pytest
+
+from singleflight import DatabaseSingleFlight, SingleFlight
+
+
+def run_concurrently(flight, key, fn, callers):
+    results = []
+    errors = []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return {"answer": 42}
+
+    threads, results, errors = run_concurrently(flight, "k", slow, 5)
+    # Let every caller join the flight before the leader finishes
+    while flight.leaders + flight.followers < 5:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == [{"answer": 42}] * 5 and not errors
+    assert flight.stats() == {"leaders": 1, "followers": 4}
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    threads, results, errors = run_concurrently(flight, "k", failing, 3)
+    while flight.leaders + flight.followers < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert not results
+    assert len(errors) == 3 and all(str(e) == "boom" for e in errors)
+
+
+def test_nothing_is_kept_after_the_call():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == 1
+    assert flight.do("k", lambda: 2) == 2
+    assert flight.stats() == {"leaders": 2, "followers": 0}
+
+
+def test_database_flight_shares_results_across_instances(flask_app):
+    key = f"test-{uuid.uuid4().hex}"
+    first, second = DatabaseSingleFlight(result_ttl=60), DatabaseSingleFlight(result_ttl=60)
+    assert first.do(key, lambda: {"answer": "leader"}) == {"answer": "leader"}
+    # Another process asking within result_ttl gets the published result
+    assert second.do(key, lambda: pytest.fail("should not run")) == {"answer": "leader"}
+    assert second.stats()["remote_results"] == 1
+
+
+def test_database_flight_releases_the_lease_on_failure(flask_app):
+    key = f"test-{uuid.uuid4().hex}"
+    flight = DatabaseSingleFlight()
+
+    def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do(key, failing)
+    assert DatabaseSingleFlight().do(key, lambda: "retried") == "retried"
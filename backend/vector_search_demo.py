@@ -1,89 +1,21 @@
+import hashlib
+import os
+import re
 import numpy as np
 import faiss
+from functools import lru_cache
 from typing import List
+from cache import LRUCache
+from document_store import DOCUMENT_SNAPSHOT_PATH, document_store
+from index_factory import index_params_from_env
+from metrics import stage
+from seed_documents import docs
+from sharded_index import DEFAULT_COLLECTION, ShardedIndex, shard_of
 
-docs = [
-    {
-        "id": "doc_01",
-        "text": "In Q1 2024, Tesla reported significant battery supply shortages that disrupted production of its Model 3 and Model Y vehicles in both its Fremont and Shanghai factories. The shortages stemmed from increasing global demand for lithium-ion batteries and logistical challenges in securing raw materials. Tesla is exploring partnerships with lithium producers in South America to stabilize its supply chain. Analysts believe the shortages could reduce Tesla's Q2 output by up to 15%.",
-    },
-    {
-        "id": "doc_02",
-        "text": "Cybertruck production has been delayed yet again, this time due to regulatory compliance issues in the EU and California. Tesla confirmed that adjustments to the truck's steering and crash detection systems were necessary to meet local safety standards. The vehicle, originally slated for delivery in late 2023, is now expected to enter limited production in Q4 2024. Investors are growing concerned over the repeated delays.",
-    },
-    {
-        "id": "doc_03",
-        "text": "SpaceX successfully launched 60 Starlink Gen 2 satellites into low Earth orbit on March 3, 2024, using its Falcon 9 reusable rocket. The launch supports SpaceX's mission to provide high-speed internet access globally, with a focus on underserved rural regions. Elon Musk stated that Starlink has now reached over 2.5 million subscribers across 45 countries. This marks the 28th successful launch for the Starlink program in the past 12 months.",
-    },
-    {
-        "id": "doc_04",
-        "text": "On April 10, 2024, OpenAI released GPT-4 Turbo, a new version of its large language model featuring improved reasoning and context handling. The model can now process up to 128k tokens in a single prompt, making it ideal for enterprise applications. Early adopters, including financial and legal firms, have integrated the model into research tools. Privacy advocates remain cautious, urging greater regulation of AI-generated content.",
-    },
-    {
-        "id": "doc_05",
-        "text": "Apple introduced its next-generation M4 chip at WWDC 2024, showcasing a 25% performance boost over the M3 in benchmark tests. Designed for use in upcoming MacBook Pro models, the M4 chip includes a new neural engine capable of 40 trillion operations per second. Apple claims this will improve on-device machine learning tasks like image generation and natural language translation significantly.",
-    },
-    {
-        "id": "doc_06",
-        "text": "Google announced new AI-powered search features during its I/O 2024 keynote. The company unveiled 'Search Generative Experience' (SGE), which uses generative AI to summarize search results with contextual highlights. The feature, currently in beta, aims to reduce time users spend clicking links by providing instant answers. Publishers have raised concerns about reduced traffic to their websites.",
-    },
-    {
-        "id": "doc_07",
-        "text": "Microsoft confirmed a $10 billion acquisition of Luma Games, a cloud-based gaming studio known for real-time multiplayer technologies. The acquisition aligns with Microsoft's strategy to expand its Xbox Cloud Gaming service and compete with platforms like PlayStation Now. Regulatory approval is pending in both the U.S. and UK, with antitrust reviews expected to take several months.",
-    },
-    {
-        "id": "doc_08",
-        "text": "Amazon expanded its drone delivery service to three new U.S. cities: Denver, Miami, and Phoenix. The Prime Air drones now deliver lightweight packages in under 30 minutes within a 10-mile radius. Amazon stated that the drone program has achieved over 50,000 deliveries since its 2023 relaunch, with a 98% successful delivery rate. FAA regulations continue to limit expansion in densely populated areas.",
-    },
-    {
-        "id": "doc_09",
-        "text": "Meta is facing an antitrust lawsuit filed by the U.S. Federal Trade Commission over its advertising practices on Facebook and Instagram. The suit alleges that Meta used its dominant position to stifle competition in digital advertising by restricting third-party data access. If found guilty, the company could face billions in fines and be required to divest some of its ad tech operations.",
-    },
-    {
-        "id": "doc_10",
-        "text": "Nvidia's stock price surged by 14% following its Q1 2024 earnings report, which revealed record-breaking revenue of $26.1 billion, driven largely by demand for its AI-focused GPUs. CEO Jensen Huang announced new partnerships with major cloud providers to deliver high-performance compute for AI training workloads. Analysts see Nvidia as the central player in the current AI hardware boom.",
-    },
-    {
-        "id": "doc_11",
-        "text": "Netflix announced a strategic push into interactive content, revealing plans to produce five new choose-your-own-adventure shows by the end of 2024. The company has hired game designers and narrative engineers to work alongside screenwriters. Past experiments like 'Bandersnatch' were well-received, and Netflix believes interactivity will increase viewer retention and reduce subscriber churn.",
-    },
-    {
-        "id": "doc_12",
-        "text": "Samsung unveiled its Galaxy Fold 6, featuring a thinner hinge and improved Flex AMOLED display that supports a 120Hz refresh rate. The device is water-resistant and includes a redesigned S-Pen that fits into the frame. Analysts expect foldable phone shipments to exceed 30 million units globally in 2024, with Samsung maintaining a 65% market share.",
-    },
-    {
-        "id": "doc_13",
-        "text": "IBM launched its Quantum Cloud Service, allowing researchers and enterprise users to run quantum simulations using the 127-qubit Eagle processor. The platform is accessible via IBM Cloud and integrates with popular data science tools. While quantum computing is still in early stages, IBM reported a 300% increase in developer signups over the past year.",
-    },
-    {
-        "id": "doc_14",
-        "text": "Intel delayed its next-gen Arrow Lake processors to mid-2025, citing issues in 3nm fabrication and power efficiency tuning. This delay affects its competitive roadmap against AMD, whose Zen 5 chips are expected in late 2024. Intel reassured stakeholders that Raptor Lake Refresh CPUs will fill the gap in 2024 product lines.",
-    },
-    {
-        "id": "doc_15",
-        "text": "X, formerly Twitter, rolled out several new features in Q2 2024 including AI-based content moderation, editable tweets for verified users, and native podcast hosting. CEO Linda Yaccarino emphasized a focus on media monetization and brand safety to attract more advertisers. User feedback has been mixed, with many welcoming the updates but criticizing ongoing content algorithm issues.",
-    },
-    {
-        "id": "doc_16",
-        "text": "Sony officially confirmed that it has begun development of the PlayStation 6, with a projected launch date in 2027. Early specs suggest a hybrid cloud-gaming model and support for 8K resolution. In the meantime, Sony plans to release a PlayStation 5 Pro in early 2025, aimed at hardcore gamers and developers.",
-    },
-    {
-        "id": "doc_17",
-        "text": "Zoom added real-time language translation to its video conferencing platform, covering 30 languages and dialects. The feature uses AI-powered speech recognition and neural translation. Enterprise customers see this as a game-changer for international collaboration, especially in customer support and remote onboarding scenarios.",
-    },
-    {
-        "id": "doc_18",
-        "text": "Oracle has partnered with over 50 startups as part of its Cloud Accelerator Program, offering $1 million in cloud credits and engineering support per company. The goal is to foster AI and analytics development on Oracle Cloud Infrastructure (OCI). Selected startups range from healthcare to fintech, and will participate in a 6-month bootcamp with Oracle mentors.",
-    },
-    {
-        "id": "doc_19",
-        "text": "Adobe released a suite of AI tools under the 'Firefly' brand, enabling creatives to generate images, fonts, and color palettes with simple text prompts. Integrated directly into Photoshop and Illustrator, these tools have seen rapid adoption by marketing teams. Adobe emphasized ethical AI, noting that the training data excludes copyrighted work without permission.",
-    },
-    {
-        "id": "doc_20",
-        "text": "Uber expanded its electric vehicle (EV) program to over 25 new cities worldwide, aiming to achieve 100% zero-emission rides by 2030. Drivers using EVs will receive bonus incentives and exclusive charging discounts. Uber is partnering with local governments to improve EV infrastructure and reduce barriers to driver adoption.",
-    },
-]
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
 
 
 def get_keyword_mappings():
@@ -158,59 +90,337 @@ def get_keyword_mappings():
     }
 
 
+DETERMINISTIC_EMBEDDINGS = os.environ.get("DETERMINISTIC_EMBEDDINGS", "true").lower() == "true"
+
+AI_BOOST_KEYWORDS = ("openai", "nvidia", "google", "microsoft", "adobe", "ai")
+
+
+def _trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    def render(node):
+        branches = [re.escape(ch) + render(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+    return render(trie)
+
+
+class KeywordMatcher:
+    """get_keyword_mappings() compiled once into a multi-pattern matcher.
+
+    ``hits(text)`` returns the keyword dimensions whose variations occur as
+    substrings of ``text``, exactly like testing every variation with ``in``
+    but in a single pass. Uses a pyahocorasick automaton when installed and
+    a trie-shaped regex otherwise.
+    """
+
+    def __init__(self, keyword_mappings):
+        self.keywords = list(keyword_mappings)
+        self.keyword_dims = {keyword: i for i, keyword in enumerate(self.keywords)}
+        variation_dims = {}
+        for keyword, variations in keyword_mappings.items():
+            for variation in variations:
+                variation_dims.setdefault(variation, set()).add(self.keyword_dims[keyword])
+        if ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for variation, dims in variation_dims.items():
+                self._automaton.add_word(variation, frozenset(dims))
+            self._automaton.make_automaton()
+        else:
+            self._automaton = None
+            # The regex reports only the longest variation starting at each
+            # position, so credit it with every variation that is its prefix.
+            self._variation_hits = {}
+            for variation in variation_dims:
+                dims = set()
+                for other, other_dims in variation_dims.items():
+                    if variation.startswith(other):
+                        dims |= other_dims
+                self._variation_hits[variation] = frozenset(dims)
+            self._pattern = re.compile(f"(?=({_trie_pattern(variation_dims)}))")
+
+    def hits(self, text_lower: str) -> set:
+        dims = set()
+        if self._automaton is not None:
+            for _, variation_dims in self._automaton.iter(text_lower):
+                dims |= variation_dims
+        else:
+            for variation in self._pattern.findall(text_lower):
+                dims |= self._variation_hits[variation]
+        return dims
+
+
+@lru_cache(maxsize=None)
+def get_keyword_matcher():
+    return KeywordMatcher(get_keyword_mappings())
+
+
+@lru_cache(maxsize=None)
+def _keyword_projection(dim: int):
+    """(n_keywords, dim) matrix folding keyword hits into embedding dimensions."""
+    matcher = get_keyword_matcher()
+    projection = np.zeros((len(matcher.keywords), dim))
+    projection[np.arange(len(matcher.keywords)), np.arange(len(matcher.keywords)) % dim] = 1.0
+    boost = np.zeros(dim)
+    for keyword in AI_BOOST_KEYWORDS:
+        boost[matcher.keyword_dims[keyword] % dim] += 0.8
+    return projection, boost
+
+
+def _hashed_noise(texts: List[str], dim: int, scale: float = 0.01) -> np.ndarray:
+    """Gaussian noise seeded by each text's blake2b hash, shape (len(texts), dim).
+
+    Each 64-byte digest yields 16 uniforms, turned into normals with a
+    vectorized Box-Muller transform.
+    """
+    blocks = -(-dim // 16)
+    digests = b"".join(
+        hashlib.blake2b(text.encode("utf-8"), digest_size=64, person=bytes([block])).digest()
+        for text in texts
+        for block in range(blocks)
+    )
+    uniform = (np.frombuffer(digests, dtype="<u4").reshape(len(texts), blocks * 16) + 0.5) / 2**32
+    radius = np.sqrt(-2.0 * np.log(uniform[:, 0::2]))
+    angle = 2.0 * np.pi * uniform[:, 1::2]
+    normal = np.hstack([radius * np.cos(angle), radius * np.sin(angle)])
+    return scale * normal[:, :dim]
+
+
+def embed_batch(
+    texts: List[str],
+    dim: int = 8,
+    is_query: bool = False,
+    original_query: str = "",
+    deterministic: bool = None,
+) -> np.ndarray:
+    """Embed a batch of texts into one float32 matrix of shape (len(texts), dim).
+
+    In deterministic mode the noise is seeded from a hash of each text, so
+    the same text always embeds to the same vector.
+    """
+    if deterministic is None:
+        deterministic = DETERMINISTIC_EMBEDDINGS
+    matcher = get_keyword_matcher()
+    ai_dim = matcher.keyword_dims["ai"]
+    hits = np.zeros((len(texts), len(matcher.keywords)))
+    for row, text in enumerate(texts):
+        hits[row, list(matcher.hits(text.lower()))] = 1.0
+    if is_query:
+        ai_rows = hits[:, ai_dim]
+    elif original_query:
+        ai_rows = np.full(len(texts), float(ai_dim in matcher.hits(original_query.lower())))
+    else:
+        ai_rows = np.zeros(len(texts))
+    projection, boost = _keyword_projection(dim)
+    matrix = hits @ projection + np.outer(ai_rows, boost)
+    if deterministic:
+        matrix += _hashed_noise(texts, dim)
+    else:
+        matrix += np.random.normal(0, 0.01, matrix.shape)
+    return matrix.astype("float32")
+
+
 def get_mock_embedding(
-    text: str, dim: int = 8, is_query: bool = False, original_query: str = ""
+    text: str,
+    dim: int = 8,
+    is_query: bool = False,
+    original_query: str = "",
+    deterministic: bool = None,
 ) -> List[float]:
-    keyword_mappings = get_keyword_mappings()
-    vec = np.zeros(dim)
-    text_lower = text.lower()
-    ai_query = False
-    if is_query and any(kw in text_lower for kw in keyword_mappings["ai"]):
-        ai_query = True
-    if not is_query and original_query:
-        oq_lower = original_query.lower()
-        ai_query = any(kw in oq_lower for kw in keyword_mappings["ai"])
-    for keyword, variations in keyword_mappings.items():
-        for variation in variations:
-            if variation in text_lower:
-                keyword_index = list(keyword_mappings.keys()).index(keyword)
-                vec[keyword_index % dim] += 1.0
-                break
-        if ai_query and keyword in [
-            "openai",
-            "nvidia",
-            "google",
-            "microsoft",
-            "adobe",
-            "ai",
-        ]:
-            keyword_index = list(keyword_mappings.keys()).index(keyword)
-            vec[keyword_index % dim] += 0.8
-    vec += np.random.normal(0, 0.01, dim)
-    return vec.tolist()
+    return embed_batch([text], dim, is_query, original_query, deterministic)[0].tolist()
 
 
 def get_faiss_index():
-    doc_embeddings = np.array(
-        [get_mock_embedding(doc["text"], dim=8) for doc in docs]
-    ).astype("float32")
+    doc_embeddings = embed_batch([doc["text"] for doc in docs], dim=8)
     index = faiss.IndexFlatL2(8)
     index.add(doc_embeddings)
     return index
 
 
-def retrieve_top_k_faiss(query_text: str, k=3):
-    index = get_faiss_index()
-    query_embedding = np.array(
-        [get_mock_embedding(query_text, dim=8, is_query=True)]
-    ).astype("float32")
-    D, I = index.search(query_embedding, k)
-    return [docs[i] for i in I[0]]
+def _load_shard(collection, shard, n_shards):
+    """Return ids and vectors for one shard of a collection.
+
+    Stored documents reuse the embeddings saved at ingestion time. The seed
+    docs belong to the default collection unless they have been stored.
+    """
+    doc_ids, matrices = [], []
+    if not os.environ.get("DATABASE_URL"):
+        print("[INDEX DEBUG] DATABASE_URL not set; indexing seed documents only")
+    else:
+        from ingest import iter_stored_embeddings
+        for batch_ids, vectors in iter_stored_embeddings(collection=collection):
+            rows = [row for row, doc_id in enumerate(batch_ids) if shard_of(doc_id, n_shards) == shard]
+            doc_ids.extend(batch_ids[row] for row in rows)
+            matrices.append(vectors[rows])
+    if collection == DEFAULT_COLLECTION:
+        stored = set(doc_ids)
+        seed_docs = [
+            doc for doc in docs
+            if doc["id"] not in stored and shard_of(doc["id"], n_shards) == shard
+        ]
+        doc_ids.extend(doc["id"] for doc in seed_docs)
+        matrices.append(embed_batch([doc["text"] for doc in seed_docs], dim=8))
+    if not matrices:
+        return doc_ids, np.empty((0, 8), dtype="float32")
+    return doc_ids, np.vstack(matrices)
+
+
+def _stored_collections():
+    if not os.environ.get("DATABASE_URL"):
+        return [DEFAULT_COLLECTION]
+    from ingest import stored_collections
+    return stored_collections()
+
+
+index_manager = ShardedIndex(
+    _load_shard,
+    _stored_collections,
+    shards_per_collection=int(os.environ.get("INDEX_SHARDS", 1)),
+    dim=8,
+    snapshot_path=os.environ.get("FAISS_INDEX_PATH"),
+    search_workers=int(os.environ.get("SHARD_SEARCH_WORKERS", 4)),
+    search_timeout=float(os.environ.get("SHARD_SEARCH_TIMEOUT", 1.0)) or None,
+    max_delta=int(os.environ.get("INDEX_MAX_DELTA", 10000)),
+    max_tombstone_ratio=float(os.environ.get("INDEX_MAX_TOMBSTONE_RATIO", 0.2)),
+    index_params=index_params_from_env(),
+)
+
+
+def write_documents_snapshot():
+    """Write every stored document plus the seed docs to DOCUMENT_SNAPSHOT_PATH."""
+    def records():
+        stored = set()
+        if not os.environ.get("DATABASE_URL"):
+            print("[DOCS DEBUG] DATABASE_URL not set; writing seed documents only")
+        else:
+            from ingest import iter_stored_texts
+            for doc_id, text in iter_stored_texts():
+                stored.add(doc_id)
+                yield doc_id, text
+        for doc in docs:
+            if doc["id"] not in stored:
+                yield doc["id"], doc["text"]
+
+    return document_store.rewrite_snapshot(records())
+
+
+query_embedding_cache = LRUCache(int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", 4096)))
+search_result_cache = LRUCache(int(os.environ.get("SEARCH_RESULT_CACHE_SIZE", 4096)))
+
+
+def normalize_query(query_text: str) -> str:
+    return " ".join(query_text.lower().split())
+
+
+def embed_query(query_text: str) -> np.ndarray:
+    """Embed a query as a (1, 8) float32 array, memoized on the normalized text."""
+    if not DETERMINISTIC_EMBEDDINGS:
+        return embed_batch([query_text], dim=8, is_query=True)
+    normalized = normalize_query(query_text)
+    embedding = query_embedding_cache.get(normalized)
+    if embedding is None:
+        embedding = embed_batch([normalized], dim=8, is_query=True)
+        query_embedding_cache.set(normalized, embedding)
+    return embedding
+
+
+def _with_scores(doc_ids, distances):
+    """Hydrate ``doc_ids`` and attach each one's L2 distance as ``score``."""
+    with stage("hydrate"):
+        docs = document_store.get_many(doc_ids)
+    scores = dict(zip(doc_ids, distances))
+    for doc in docs:
+        doc["score"] = round(float(scores[doc["id"]]), 6)
+    return docs
+
+
+def retrieve_top_k_faiss(query_text: str, k=3, collections=None, shards=None):
+    """Top ``k`` documents for ``query_text``, optionally limited to some collections or shards."""
+    with stage("embed"):
+        query_embedding = embed_query(query_text)
+    if not DETERMINISTIC_EMBEDDINGS:
+        with stage("search"):
+            D, doc_ids, _ = index_manager.search(query_embedding, k, collections, shards)
+        return _with_scores(doc_ids[0], D[0])
+    scope = (
+        None if collections is None else tuple(sorted(collections)),
+        None if shards is None else tuple(sorted(shards)),
+    )
+    key = (index_manager.version, query_embedding.tobytes(), k, scope)
+    hit = search_result_cache.get(key)
+    if hit is None:
+        with stage("search"):
+            D, rows, partial = index_manager.search(query_embedding, k, collections, shards)
+        hit = (tuple(rows[0]), tuple(D[0]))
+        # A partial result would otherwise stick until the index changes
+        if not partial:
+            search_result_cache.set(key, hit)
+    return _with_scores(*hit)
+
+
+def retrieve_top_k_faiss_batch(query_texts: List[str], k=3, collections=None, shards=None):
+    """Retrieve for many queries at once: one embedding matrix, one search per shard."""
+    with stage("embed"):
+        if DETERMINISTIC_EMBEDDINGS:
+            query_texts = [normalize_query(text) for text in query_texts]
+        embeddings = embed_batch(query_texts, dim=8, is_query=True)
+    with stage("search"):
+        D, rows, _ = index_manager.search(embeddings, k, collections, shards)
+    with stage("hydrate"):
+        found = {doc["id"]: doc for doc in document_store.get_many(list(dict.fromkeys(i for row in rows for i in row)))}
+    return [
+        [{**found[doc_id], "score": round(float(distance), 6)} for doc_id, distance in zip(row, distances) if doc_id in found]
+        for row, distances in zip(rows, D)
+    ]
+
+
+def retrieval_cache_stats():
+    return {
+        "query_embeddings": query_embedding_cache.stats(),
+        "search_results": search_result_cache.stats(),
+    }
 
 
 if __name__ == "__main__":
-    query = "Which companies are working on AI chips?"
-    top_docs = retrieve_top_k_faiss(query, k=3)
-    print("Top 3 relevant documents:")
-    for doc in top_docs:
-        print(f"- {doc['id']}: {doc['text']}")
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Rebuild the index and write it to FAISS_INDEX_PATH",
+    )
+    parser.add_argument(
+        "--prepare",
+        action="store_true",
+        help="Write missing index snapshots and a fresh document snapshot, for worker processes to share",
+    )
+    args = parser.parse_args()
+    if args.rebuild or args.prepare:
+        if os.environ.get("DATABASE_URL"):
+            from database import init_schema
+            init_schema()
+        if args.rebuild:
+            index_manager.rebuild()
+        else:
+            # Loads existing shard snapshots and builds and writes the rest
+            index_manager.warm()
+        for name, vectors in index_manager.stats().items():
+            print(f"Shard {name}: {vectors} vectors")
+        if index_manager.snapshot_path:
+            print(f"Snapshots written next to {index_manager.snapshot_path}")
+        # Always rewritten: an existing file may predate updates made since
+        if DOCUMENT_SNAPSHOT_PATH:
+            print(f"Wrote {write_documents_snapshot()} documents to {DOCUMENT_SNAPSHOT_PATH}")
+    else:
+        query = "Which companies are working on AI chips?"
+        top_docs = retrieve_top_k_faiss(query, k=3)
+        print("Top 3 relevant documents:")
+        for doc in top_docs:
+            print(f"- {doc['id']}: {doc['text']}")
@@ -18,6 +18,7 @@ import './App.css'
 
 export default function App() {
   const [history, setHistory] = useState<HistoryItem[]>([])
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null)
   const [isLoading, setIsLoading] = useState(false)
   const [currentResponse, setCurrentResponse] = useState<HistoryItem | null>(null)
   const [revalidatingId, setRevalidatingId] = useState<string | null>(null)
@@ -25,6 +26,8 @@ export default function App() {
   const [sidebarOpen, setSidebarOpen] = useState(true)
   const [isHistoryModalOpen, setIsHistoryModalOpen] = useState(false)
   const [responseHistory, setResponseHistory] = useState<HistoryItem[]>([])
+  const [responseHistoryId, setResponseHistoryId] = useState<string | null>(null)
+  const [responseHistoryCursor, setResponseHistoryCursor] = useState<string | null>(null)
   const [currentQueryForHistory, setCurrentQueryForHistory] = useState("")
 
   const dispatch = useDispatch();
@@ -35,16 +38,30 @@ export default function App() {
     fetchHistory()
   }, [])
 
+  // Reloads the first page; older entries are fetched on demand
   const fetchHistory = async () => {
     try {
-      const data = await getHistory();
-      setHistory(data);
+      const page = await getHistory();
+      setHistory(page.items);
+      setHistoryCursor(page.nextCursor);
     } catch (error) {
       console.error(error);
       toast.error('Failed to load history. Please try again later.')
     }
   }
 
+  const loadMoreHistory = async () => {
+    if (!historyCursor) return;
+    try {
+      const page = await getHistory(historyCursor);
+      setHistory(items => [...items, ...page.items]);
+      setHistoryCursor(page.nextCursor);
+    } catch (error) {
+      console.error(error);
+      toast.error('Failed to load more history.')
+    }
+  }
+
   const handleSubmit = async (query: string) => {
     setIsLoading(true)
     dispatch(setSelectedHistoryId(null))
@@ -95,8 +112,10 @@ export default function App() {
     if (historyItem) {
       setCurrentQueryForHistory(historyItem.query);
       try {
-        const data = await getResponseHistory(responseId);
-        setResponseHistory(data);
+        const page = await getResponseHistory(responseId);
+        setResponseHistory(page.items);
+        setResponseHistoryId(responseId);
+        setResponseHistoryCursor(page.nextCursor);
         setIsHistoryModalOpen(true);
       } catch (error) {
         toast.error('Failed to load response history.');
@@ -105,6 +124,18 @@ export default function App() {
     }
   };
 
+  const loadMoreResponseHistory = async () => {
+    if (!responseHistoryId || !responseHistoryCursor) return;
+    try {
+      const page = await getResponseHistory(responseHistoryId, responseHistoryCursor);
+      setResponseHistory(items => [...items, ...page.items]);
+      setResponseHistoryCursor(page.nextCursor);
+    } catch (error) {
+      toast.error('Failed to load more versions.');
+      console.error(error);
+    }
+  };
+
   const handleSourceClick = (doc: DocType) => {
       setPreviewDoc(doc)
   }
@@ -131,6 +162,8 @@ export default function App() {
         isRevalidating={revalidatingId}
         isOpen={sidebarOpen}
         onCloseSidebar={() => setSidebarOpen(false)}
+        hasMore={!!historyCursor}
+        onLoadMore={loadMoreHistory}
       />
       <main className={`flex-1 p-6 overflow-y-auto relative transition-all flex justify-center items-start ${sidebarOpen ? 'ml-72 md:ml-80' : 'ml-0'}`}>
         <div className="max-w-3xl w-full space-y-6">
@@ -167,6 +200,8 @@ export default function App() {
         onClose={() => setIsHistoryModalOpen(false)}
         history={responseHistory}
         query={currentQueryForHistory}
+        hasMore={!!responseHistoryCursor}
+        onLoadMore={loadMoreResponseHistory}
       />
     </div>
   )
@@ -1,4 +1,4 @@
-import type { HistoryItem } from './types';
+import type { HistoryItem, HistoryPage } from './types';
 
 const API_BASE_URL = import.meta.env.VITE_API_URL;
 
@@ -21,9 +21,20 @@ export const postQuery = async (query: string, userId: string): Promise<HistoryI
     return handleResponse<HistoryItem>(response);
 };
 
-export const getHistory = async (): Promise<HistoryItem[]> => {
-    const response = await fetch(`${API_BASE_URL}/history`);
-    return handleResponse<HistoryItem[]>(response);
+// Paginated endpoints return an X-Next-Cursor header until the last page;
+// callers pass it back to load the next page when the user asks for more
+async function fetchPage(path: string, cursor?: string | null): Promise<HistoryPage> {
+    const params = new URLSearchParams();
+    if (cursor) {
+        params.set('cursor', cursor);
+    }
+    const response = await fetch(`${API_BASE_URL}${path}?${params}`);
+    const items = await handleResponse<HistoryItem[]>(response);
+    return { items, nextCursor: response.headers.get('X-Next-Cursor') };
+}
+
+export const getHistory = async (cursor?: string | null): Promise<HistoryPage> => {
+    return fetchPage('/history', cursor);
 };
 
 export const revalidateResponse = async (responseId: string): Promise<HistoryItem> => {
@@ -37,9 +48,8 @@ export const revalidateResponse = async (responseId: string): Promise<HistoryIte
     return handleResponse<HistoryItem>(response);
 };
 
-export const getResponseHistory = async (responseId: string): Promise<HistoryItem[]> => {
-    const response = await fetch(`${API_BASE_URL}/responses/${responseId}/history`);
-    return handleResponse<HistoryItem[]>(response);
+export const getResponseHistory = async (responseId: string, cursor?: string | null): Promise<HistoryPage> => {
+    return fetchPage(`/responses/${responseId}/history`, cursor);
 };
 
 export const postFeedback = async (
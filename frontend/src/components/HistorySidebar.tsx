@@ -12,6 +12,8 @@ interface HistorySidebarProps {
     isRevalidating?: string | null;
     isOpen?: boolean;
     onCloseSidebar?: () => void;
+    hasMore?: boolean;
+    onLoadMore?: () => void;
 }
 
 const groupHistoryByDate = (history: HistoryItem[]) => {
@@ -52,7 +54,9 @@ export default function HistorySidebar({
     onViewHistory,
     isRevalidating,
     isOpen = true,
-    onCloseSidebar
+    onCloseSidebar,
+    hasMore = false,
+    onLoadMore
 }: HistorySidebarProps) {
     const selectedHistoryId = useSelector((state: RootState) => state.ui.selectedHistoryId);
     const groupedHistory = useMemo(() => groupHistoryByDate(history), [history]);
@@ -143,6 +147,14 @@ export default function HistorySidebar({
                             )
                         ))
                     )}
+                    {hasMore && (
+                        <button
+                            onClick={onLoadMore}
+                            className="w-full p-2 text-sm rounded-md text-gray-600 dark:text-gray-300 hover:bg-gray-200 dark:hover:bg-gray-700"
+                        >
+                            Load more
+                        </button>
+                    )}
                 </div>
             </aside>
         </>
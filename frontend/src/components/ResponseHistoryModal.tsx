@@ -8,9 +8,11 @@ interface ResponseHistoryModalProps {
     onClose: () => void;
     history: HistoryItem[];
     query: string;
+    hasMore?: boolean;
+    onLoadMore?: () => void;
 }
 
-const ResponseHistoryModal: React.FC<ResponseHistoryModalProps> = ({ isOpen, onClose, history, query }) => {
+const ResponseHistoryModal: React.FC<ResponseHistoryModalProps> = ({ isOpen, onClose, history, query, hasMore = false, onLoadMore }) => {
     if (!isOpen) return null;
 
     return (
@@ -37,6 +39,14 @@ const ResponseHistoryModal: React.FC<ResponseHistoryModalProps> = ({ isOpen, onC
                             No other versions of this response have been generated.
                         </p>
                     )}
+                    {hasMore && (
+                        <button
+                            onClick={onLoadMore}
+                            className="w-full p-2 text-sm rounded-md text-gray-600 dark:text-gray-300 hover:bg-gray-200 dark:hover:bg-gray-700"
+                        >
+                            Load more versions
+                        </button>
+                    )}
                 </div>
             </div>
         </div>
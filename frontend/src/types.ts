@@ -21,4 +21,9 @@ export interface HistoryItem {
   timestamp: string;
   docs: Document[];
   feedback: Feedback | null;
-} 
\ No newline at end of file
+} 
+
+export interface HistoryPage {
+  items: HistoryItem[];
+  nextCursor: string | null;
+}